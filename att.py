@@ -0,0 +1,378 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+from __future__ import annotations
+
+import tools
+
+log = tools.logger(__name__)
+
+from collections.abc import Callable
+from ctypes import CDLL, Structure, byref, c_uint8, c_ushort, get_errno, sizeof
+import asyncio, errno, os, socket, struct
+
+# A minimal Bluetooth LE ATT client that runs on the event loop.
+#
+# The connection is a kernel L2CAP socket on the ATT fixed channel, so there is no helper process,
+# and no thread. Notifications are delivered from the event loop's reader callback. The kernel
+# handles encryption with the keys that BlueZ stored when the remote was paired.
+
+class AssignedNumbers:
+    primary_service = 0x2800
+    characteristic = 0x2803
+    client_characteristic_configuration = 0x2902
+    generic_access = 0x1800
+    device_information = 0x180a
+    battery_service = 0x180f
+    device_name = 0x2a00
+    battery_level = 0x2a19
+    system_id = 0x2a23
+    model_number_string = 0x2a24
+    serial_number_string = 0x2a25
+    firmware_revision_string = 0x2a26
+    hardware_revision_string = 0x2a27
+    software_revision_string = 0x2a28
+    manufacturer_name_string = 0x2a29
+    pnp_id = 0x2a50
+    battery_level_status = 0x2bed
+
+class Op:
+    ERROR_RSP = 0x01
+    EXCHANGE_MTU_REQ = 0x02
+    EXCHANGE_MTU_RSP = 0x03
+    FIND_INFORMATION_REQ = 0x04
+    FIND_INFORMATION_RSP = 0x05
+    READ_BY_TYPE_REQ = 0x08
+    READ_BY_TYPE_RSP = 0x09
+    READ_REQ = 0x0a
+    READ_RSP = 0x0b
+    READ_BLOB_REQ = 0x0c
+    READ_BLOB_RSP = 0x0d
+    READ_BY_GROUP_TYPE_REQ = 0x10
+    READ_BY_GROUP_TYPE_RSP = 0x11
+    WRITE_REQ = 0x12
+    WRITE_RSP = 0x13
+    HANDLE_VALUE_NTF = 0x1b
+    HANDLE_VALUE_IND = 0x1d
+    HANDLE_VALUE_CFM = 0x1e
+    WRITE_CMD = 0x52
+    COMMAND_FLAG = 0x40
+
+class ErrorCode:
+    INVALID_HANDLE = 0x01
+    WRITE_NOT_PERMITTED = 0x03
+    REQUEST_NOT_SUPPORTED = 0x06
+    ATTRIBUTE_NOT_FOUND = 0x0a
+    ATTRIBUTE_NOT_LONG = 0x0b
+
+DEFAULT_MTU = 23
+TRANSACTION_TIMEOUT_SEC = 30
+max_pdus_per_read = 32
+
+class AttError(Exception):
+    def __init__(self, op: int, handle: int, code: int) -> None:
+        self.op = op
+        self.handle = handle
+        self.code = code
+
+    def __str__(self) -> str:
+        return f'ATT error 0x{self.code:02X} for op 0x{self.op:02X} handle 0x{self.handle:04X}'
+
+# The Bluetooth base UUID is 0000xxxx-0000-1000-8000-00805F9B34FB. UUIDs are kept as ints, and ones
+# derived from the base UUID are reduced to their short form.
+base_uuid = 0x0000000000001000800000805f9b34fb
+base_uuid_mask = (1 << 96) - 1
+
+def uuid_from_bytes(data: bytes) -> int:
+    uuid = int.from_bytes(data, byteorder='little')
+    if len(data) == 16 and uuid & base_uuid_mask == base_uuid:
+        uuid >>= 96
+    return uuid
+
+def uuid_to_bytes(uuid: int) -> bytes:
+    if uuid <= 0xffff:
+        return uuid.to_bytes(2, byteorder='little')
+    if uuid <= 0xffffffff:
+        uuid = (uuid << 96) | base_uuid
+    return uuid.to_bytes(16, byteorder='little')
+
+class Characteristic:
+    def __init__(self, uuid: int, handle: int, properties: int, value_handle: int) -> None:
+        self.uuid = uuid
+        self.handle = handle
+        self.properties = properties
+        self.value_handle = value_handle
+        self.end_handle = value_handle
+        self.descriptors: dict[int, int] = {} # uuid -> handle
+
+    def __repr__(self) -> str:
+        return f'Characteristic(0x{self.uuid:04X} value 0x{self.value_handle:04X})'
+
+class Service:
+    def __init__(self, uuid: int, start_handle: int, end_handle: int) -> None:
+        self.uuid = uuid
+        self.start_handle = start_handle
+        self.end_handle = end_handle
+        self.characteristics: list[Characteristic] = []
+
+    def characteristic(self, uuid: int) -> Characteristic | None:
+        for ch in self.characteristics:
+            if ch.uuid == uuid:
+                return ch
+        return None
+
+    def __repr__(self) -> str:
+        return f'Service(0x{self.uuid:04X} 0x{self.start_handle:04X}-0x{self.end_handle:04X})'
+
+NotificationCallback = Callable[[int, bytes], None]
+
+class Client:
+    def __init__(self, sock: socket.socket, on_notification: NotificationCallback) -> None:
+        self.sock = sock
+        self.on_notification = on_notification
+        self.loop = asyncio.get_running_loop()
+        self.mtu = DEFAULT_MTU
+        self.lock = asyncio.Lock()
+        self.response: asyncio.Future[bytes] | None = None
+        self.closed: asyncio.Future[None] = self.loop.create_future()
+        sock.setblocking(False)
+        self.loop.add_reader(sock.fileno(), self.__read)
+
+    def close(self, exc: BaseException | None = None) -> None:
+        if self.closed.done():
+            return
+        self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+        if exc is None:
+            exc = ConnectionResetError('ATT connection closed')
+        if self.response is not None and not self.response.done():
+            self.response.set_exception(exc)
+        self.closed.set_exception(exc)
+        # Nobody may be waiting on closed, so don't let asyncio complain about it
+        self.closed.exception()
+
+    async def wait_closed(self) -> None:
+        """ Raises the exception that closed the connection """
+        await asyncio.shield(self.closed)
+
+    def __read(self) -> None:
+        # Handle the whole burst that is waiting, so that callbacks scheduled by notifications run
+        # after all of it
+        for _ in range(max_pdus_per_read):
+            try:
+                pdu = self.sock.recv(1024)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                self.close(e)
+                return
+            if not pdu:
+                self.close()
+                return
+            self.handle_pdu(pdu)
+            if self.closed.done():
+                return
+
+    def handle_pdu(self, pdu: bytes) -> None:
+        op = pdu[0]
+        if op == Op.HANDLE_VALUE_NTF:
+            self.on_notification(int.from_bytes(pdu[1:3], byteorder='little'), pdu[3:])
+        elif op == Op.HANDLE_VALUE_IND:
+            self.send(bytes([Op.HANDLE_VALUE_CFM]))
+            self.on_notification(int.from_bytes(pdu[1:3], byteorder='little'), pdu[3:])
+        elif op & 1 or op == Op.ERROR_RSP:
+            # Responses have odd opcodes
+            if self.response is not None and not self.response.done():
+                self.response.set_result(pdu)
+            else:
+                log.info(f'Unexpected ATT response {pdu.hex()}')
+        elif not op & Op.COMMAND_FLAG:
+            # A request from the peer that this client doesn't serve
+            self.send(struct.pack('<BBHB', Op.ERROR_RSP, op, 0, ErrorCode.REQUEST_NOT_SUPPORTED))
+
+    def send(self, pdu: bytes) -> None:
+        exc = self.closed.exception() if self.closed.done() else None
+        if exc is not None:
+            raise exc
+        try:
+            self.sock.send(pdu)
+        except OSError as e:
+            self.close(e)
+            raise
+
+    async def request(self, pdu: bytes, expected_op: int) -> bytes:
+        async with self.lock:
+            self.response = self.loop.create_future()
+            try:
+                self.send(pdu)
+                # Not wait_for, which can swallow a cancellation that comes with the response
+                async with asyncio.timeout(TRANSACTION_TIMEOUT_SEC):
+                    rsp = await self.response
+            finally:
+                self.response = None
+        if rsp[0] == Op.ERROR_RSP:
+            op, handle, code = struct.unpack_from('<BHB', rsp, 1)
+            raise AttError(op, handle, code)
+        if rsp[0] != expected_op:
+            raise ConnectionError(f'Unexpected ATT response {rsp.hex()} to {pdu.hex()}')
+        return rsp
+
+    async def exchange_mtu(self, mtu: int) -> int:
+        rsp = await self.request(struct.pack('<BH', Op.EXCHANGE_MTU_REQ, mtu), Op.EXCHANGE_MTU_RSP)
+        server_mtu, = struct.unpack_from('<H', rsp, 1)
+        self.mtu = max(DEFAULT_MTU, min(mtu, server_mtu))
+        return self.mtu
+
+    async def read(self, handle: int) -> bytes:
+        rsp = await self.request(struct.pack('<BH', Op.READ_REQ, handle), Op.READ_RSP)
+        value = rsp[1:]
+        # A value that fills the response may continue
+        while len(rsp) == self.mtu:
+            try:
+                rsp = await self.request(struct.pack('<BHH', Op.READ_BLOB_REQ, handle, len(value)),
+                                         Op.READ_BLOB_RSP)
+            except AttError as e:
+                if e.code == ErrorCode.ATTRIBUTE_NOT_LONG:
+                    break
+                raise
+            value += rsp[1:]
+        return value
+
+    async def write(self, handle: int, value: bytes) -> None:
+        await self.request(struct.pack('<BH', Op.WRITE_REQ, handle) + value, Op.WRITE_RSP)
+
+    def write_command(self, handle: int, value: bytes) -> None:
+        self.send(struct.pack('<BH', Op.WRITE_CMD, handle) + value)
+
+    async def discover_services(self) -> list[Service]:
+        services: list[Service] = []
+        start = 1
+        while start <= 0xffff:
+            pdu = struct.pack('<BHH', Op.READ_BY_GROUP_TYPE_REQ, start, 0xffff) + \
+                uuid_to_bytes(AssignedNumbers.primary_service)
+            try:
+                rsp = await self.request(pdu, Op.READ_BY_GROUP_TYPE_RSP)
+            except AttError as e:
+                if e.code == ErrorCode.ATTRIBUTE_NOT_FOUND:
+                    break
+                raise
+            length = rsp[1]
+            for i in range(2, len(rsp) - length + 1, length):
+                start_handle, end_handle = struct.unpack_from('<HH', rsp, i)
+                services.append(Service(uuid_from_bytes(rsp[i + 4:i + length]), start_handle, end_handle))
+                start = end_handle + 1
+        return services
+
+    async def discover_characteristics(self, service: Service) -> list[Characteristic]:
+        chars: list[Characteristic] = []
+        start = service.start_handle
+        while start <= service.end_handle:
+            pdu = struct.pack('<BHH', Op.READ_BY_TYPE_REQ, start, service.end_handle) + \
+                uuid_to_bytes(AssignedNumbers.characteristic)
+            try:
+                rsp = await self.request(pdu, Op.READ_BY_TYPE_RSP)
+            except AttError as e:
+                if e.code == ErrorCode.ATTRIBUTE_NOT_FOUND:
+                    break
+                raise
+            length = rsp[1]
+            for i in range(2, len(rsp) - length + 1, length):
+                handle, properties, value_handle = struct.unpack_from('<HBH', rsp, i)
+                chars.append(Characteristic(uuid_from_bytes(rsp[i + 5:i + length]), handle,
+                                            properties, value_handle))
+                start = handle + 1
+        # Each characteristic ends where the next one begins
+        for ch, next_ch in zip(chars, chars[1:]):
+            ch.end_handle = next_ch.handle - 1
+        if chars:
+            chars[-1].end_handle = service.end_handle
+        for ch in chars:
+            await self.discover_descriptors(ch)
+        service.characteristics = chars
+        return chars
+
+    async def discover_descriptors(self, ch: Characteristic) -> None:
+        start = ch.value_handle + 1
+        while start <= ch.end_handle:
+            pdu = struct.pack('<BHH', Op.FIND_INFORMATION_REQ, start, ch.end_handle)
+            try:
+                rsp = await self.request(pdu, Op.FIND_INFORMATION_RSP)
+            except AttError as e:
+                if e.code == ErrorCode.ATTRIBUTE_NOT_FOUND:
+                    break
+                raise
+            uuid_len = 2 if rsp[1] == 0x01 else 16
+            for i in range(2, len(rsp) - uuid_len - 1, 2 + uuid_len):
+                handle, = struct.unpack_from('<H', rsp, i)
+                ch.descriptors[uuid_from_bytes(rsp[i + 2:i + 2 + uuid_len])] = handle
+                start = handle + 1
+
+    async def discover(self) -> list[Service]:
+        services = await self.discover_services()
+        for service in services:
+            await self.discover_characteristics(service)
+        return services
+
+# Kernel L2CAP socket addressing. Python's socket module can't address the LE ATT fixed channel,
+# so bind and connect are done through libc.
+SOL_BLUETOOTH = 274
+BT_SECURITY = 4
+BT_SECURITY_MEDIUM = 2
+BDADDR_LE_PUBLIC = 1
+BDADDR_LE_RANDOM = 2
+ATT_CID = 4
+
+def bdaddr(mac: str) -> bytes:
+    """ Returns the kernel's bdaddr_t for a MAC, which is little endian """
+    return bytes(reversed(bytes.fromhex(mac.replace(':', ''))))
+
+class SockAddrL2(Structure):
+    _fields_ = [
+        ('l2_family', c_ushort),
+        ('l2_psm', c_ushort),
+        ('l2_bdaddr', c_uint8 * 6),
+        ('l2_cid', c_ushort),
+        ('l2_bdaddr_type', c_uint8)]
+
+    def __init__(self, mac: str | None, address_type: int) -> None:
+        self.l2_family = socket.AF_BLUETOOTH
+        self.l2_cid = ATT_CID
+        self.l2_bdaddr_type = address_type
+        if mac is not None:
+            for i, b in enumerate(bdaddr(mac)):
+                self.l2_bdaddr[i] = b
+
+libc = CDLL(None, use_errno=True)
+
+async def connect(mac: str, address_type: int = BDADDR_LE_PUBLIC,
+                  timeout_sec: float = 10) -> socket.socket:
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_SEQPACKET, socket.BTPROTO_L2CAP)
+    try:
+        sock.setsockopt(SOL_BLUETOOTH, BT_SECURITY, struct.pack('BB', BT_SECURITY_MEDIUM, 0))
+        local = SockAddrL2(None, BDADDR_LE_PUBLIC)
+        if libc.bind(sock.fileno(), byref(local), sizeof(local)) != 0:
+            e = get_errno()
+            raise OSError(e, os.strerror(e))
+        sock.setblocking(False)
+        peer = SockAddrL2(mac, address_type)
+        if libc.connect(sock.fileno(), byref(peer), sizeof(peer)) != 0:
+            e = get_errno()
+            if e != errno.EINPROGRESS:
+                raise OSError(e, os.strerror(e))
+            writable: asyncio.Future[None] = loop.create_future()
+            loop.add_writer(sock.fileno(), lambda: writable.done() or writable.set_result(None))
+            try:
+                await asyncio.wait_for(writable, timeout_sec)
+            finally:
+                loop.remove_writer(sock.fileno())
+            e = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if e != 0:
+                raise OSError(e, os.strerror(e))
+    except BaseException:
+        sock.close()
+        raise
+    return sock
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# Measures the touch gesture recognizers over a corpus: CPU per touch sample, how many samples, and
+# milliseconds, into a gesture it is recognized, and how often the right keys come out.
+#
+# The corpus is recordings made with remote.record.dir, and a synthetic corpus of labelled swipes,
+# taps, clicks, holds and nudges. A recording can be labelled with a <recording>.labels.json file, holding
+# the list of keys it should produce (i.e. ["RIGHT", "POWER"]).
+#
+# If NumPy is installed, the batched recognizers in gestures_batch are measured too, over windows
+# of samples, and checked to make the same decisions as the scalar recognizers.
+
+import sys, os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'test'))
+
+import argparse, asyncio, json, math, random, statistics, time
+from collections.abc import Callable
+from typing import Any
+
+import gestures, recording, remote
+from aconfig import config
+from fake_touch import Clock, gen_1_remote
+from gestures import EventType
+from hdmi import Key
+from remote import HwRevisions, SiriRemote, Touch
+
+try:
+    import gestures_batch
+except ImportError:
+    gestures_batch = None # type: ignore[assignment]
+
+# A corpus item is a list of (time, touches) and (time, buttons) samples
+Sample = tuple[float, list[Touch] | int]
+
+class Item:
+    def __init__(self, name: str, kind: str, remote: SiriRemote, samples: list[Sample],
+                 label: list[str] | None) -> None:
+        self.name = name
+        self.kind = kind
+        self.remote = remote
+        self.samples = samples
+        self.label = label
+
+class Keys:
+    """ Maps recognizer decisions to keys, as remote_adapter.Adapter does """
+    def __init__(self) -> None:
+        self.keys: list[tuple[int, str]] = [] # (sample index, key)
+        self.sample = 0
+        self.button_state = 0
+
+    def press(self, key: Key, count: int = 0) -> None:
+        self.keys.append((self.sample, key.name + (f' x{count}' if count else '')))
+
+    def swipe(self, recognizer: Any, event: gestures.SwipeEvent) -> None:
+        if not (event.type & EventType.Detected) or self.button_state != 0:
+            return
+        counter = event.x + event.y
+        count = abs(counter)
+        if event.type & EventType.End and event.velocity != 0:
+            # The glide, less the steps sent early. It's counted as one decision.
+            count -= event.early_steps
+            if count == 0:
+                return
+        if event.x:
+            self.press(Key.RIGHT if counter > 0 else Key.LEFT, count)
+        else:
+            self.press(Key.UP if counter > 0 else Key.DOWN, count)
+
+    def multitap(self, recognizer: Any, event: gestures.TapEvent) -> None:
+        if event.type & EventType.Detected:
+            self.press(Key.POWER)
+
+    def buttons(self, remote: SiriRemote, dpad: gestures.DPadEmulator, buttons: int) -> None:
+        buttons = dpad.buttons(remote, buttons)
+        pressed = buttons & ~self.button_state
+        self.button_state = buttons
+        btns = remote.profile.buttons
+        for button, key in ((btns.UP, Key.UP), (btns.RIGHT, Key.RIGHT), (btns.DOWN, Key.DOWN),
+                            (btns.LEFT, Key.LEFT), (btns.SELECT, Key.SELECT)):
+            if pressed & button:
+                self.press(key)
+
+def run_scalar(item: Item, predict: bool = True) -> Keys:
+    keys = Keys()
+    clock = Clock()
+    sr = item.remote
+    swipe = gestures.SwipeRecognizer(keys.swipe)
+    if not predict:
+        for r in swipe.rs:
+            r.predict_horizon_sec = 0
+    dpad = gestures.DPadEmulator()
+    multitap = gestures.MultiTapRecognizer(1, 3, keys.multitap, clock)
+    gen_1 = sr.profile.hw_revision in (HwRevisions.GEN_1, HwRevisions.GEN_1_5)
+    for i, (t, sample) in enumerate(item.samples):
+        keys.sample = i
+        clock.now = t
+        if isinstance(sample, int):
+            keys.buttons(sr, dpad, sample)
+            continue
+        swipe.touches(sr, sample)
+        dpad.touches(sr, sample)
+        if gen_1:
+            multitap.touches(sr, sample)
+    return keys
+
+def run_batched(item: Item, window: int) -> Keys:
+    assert gestures_batch is not None
+    keys = Keys()
+    sr = item.remote
+    swipe = gestures_batch.BatchSwipeRecognizer(keys.swipe)
+    dpad = gestures_batch.BatchDPadEmulator()
+    multitap = gestures_batch.BatchMultiTapRecognizer(1, 3, keys.multitap)
+    gen_1 = sr.profile.hw_revision in (HwRevisions.GEN_1, HwRevisions.GEN_1_5)
+    reports: list[gestures_batch.Report] = []
+
+    def flush() -> None:
+        swipe.reports(sr, reports)
+        dpad.reports(sr, reports)
+        if gen_1:
+            multitap.reports(sr, reports)
+        reports.clear()
+
+    for i, (t, sample) in enumerate(item.samples):
+        # Decisions are made when a window is full, so they are counted from there
+        keys.sample = i
+        if isinstance(sample, int):
+            # Touches that came before a button must be seen before it
+            flush()
+            keys.buttons(sr, dpad, sample)
+            continue
+        reports.append((t, sample))
+        if len(reports) == window:
+            flush()
+    flush()
+    return keys
+
+def synthetic_corpus(sr: SiriRemote, count: int, seed: int) -> list[Item]:
+    rng = random.Random(seed)
+    rtp = sr.profile.touchpad
+    period_sec = 0.01
+    pressure = 60
+    items = []
+    t = 0.0
+    clock_ticks = 0
+
+    def touch(x_mm: float, y_mm: float, p: int) -> tuple[float, list[Touch]]:
+        nonlocal t, clock_ticks
+        t += period_sec
+        clock_ticks = (clock_ticks + round(period_sec * rtp.TIMESTAMP_HZ)) % 65536
+        xy = (round(x_mm / rtp.MM_PER_UNIT[0]), round(y_mm / rtp.MM_PER_UNIT[1]))
+        return t, [Touch(sr, (0, clock_ticks, xy[0], xy[1], p))]
+
+    def stroke(start: tuple[float, float], end: tuple[float, float], duration_sec: float,
+               jitter_mm: float = 0.2) -> list[Sample]:
+        n = max(2, round(duration_sec / period_sec))
+        samples: list[Sample] = []
+        for i in range(n):
+            f = i / (n - 1)
+            samples.append(touch(start[0] + (end[0] - start[0]) * f + rng.gauss(0, jitter_mm),
+                                 start[1] + (end[1] - start[1]) * f + rng.gauss(0, jitter_mm),
+                                 pressure))
+        samples.append(touch(end[0], end[1], 0))
+        return samples
+
+    def pause(duration_sec: float) -> None:
+        nonlocal t, clock_ticks
+        t += duration_sec
+        clock_ticks = (clock_ticks + round(duration_sec * rtp.TIMESTAMP_HZ)) % 65536
+
+    directions = {'RIGHT': (1, 0), 'LEFT': (-1, 0), 'UP': (0, 1), 'DOWN': (0, -1)}
+    btns = sr.profile.buttons
+    for i in range(count):
+        pause(1)
+        kind = ('swipe', 'tap', 'click', 'hold', 'nudge')[i % 5]
+        name, (dx, dy) = rng.choice(list(directions.items()))
+        if kind == 'swipe':
+            length_mm = rng.uniform(10, 25)
+            x0, y0 = rng.uniform(-4, 4) - dx * length_mm / 2, rng.uniform(-4, 4) - dy * length_mm / 2
+            samples = stroke((x0, y0), (x0 + dx * length_mm, y0 + dy * length_mm),
+                             rng.uniform(0.1, 0.3))
+            items.append(Item(f'swipe {i}', kind, sr, samples, [name]))
+        elif kind == 'tap':
+            samples = []
+            for _ in range(3):
+                xy = (rng.uniform(-5, 5), rng.uniform(-5, 5))
+                samples += stroke(xy, xy, rng.uniform(0.06, 0.15))
+                pause(rng.uniform(0.1, 0.2))
+            items.append(Item(f'triple tap {i}', kind, sr, samples, ['POWER']))
+        elif kind == 'click':
+            # Rest a finger near the edge, and click
+            r_mm = rng.uniform(13, 17)
+            xy = (dx * r_mm, dy * r_mm)
+            samples = stroke(xy, xy, 0.1)[:-1]
+            samples.append((t, btns.SELECT))
+            samples += stroke(xy, xy, rng.uniform(0.1, 0.2))[:-1]
+            samples.append((t, 0))
+            samples.append(touch(*xy, 0))
+            items.append(Item(f'click {i}', kind, sr, samples, [name]))
+        elif kind == 'hold':
+            xy = (rng.uniform(-5, 5), rng.uniform(-5, 5))
+            samples = stroke(xy, xy, rng.uniform(0.6, 1.2), jitter_mm=0.5)
+            items.append(Item(f'hold {i}', kind, sr, samples, []))
+        else:
+            # Slowly shift a resting finger, short of a swipe
+            length_mm = rng.uniform(3, 6)
+            x0, y0 = rng.uniform(-5, 5), rng.uniform(-5, 5)
+            samples = stroke((x0, y0), (x0 + dx * length_mm, y0 + dy * length_mm),
+                             rng.uniform(0.3, 0.6))
+            items.append(Item(f'nudge {i}', kind, sr, samples, []))
+    return items
+
+class Capture(remote.RemoteListener):
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.samples: list[Sample] = []
+    def event_button(self, remote: SiriRemote, buttons: int) -> None:
+        self.samples.append((self.now, buttons))
+    def event_touches(self, remote: SiriRemote, touches: list[Touch]) -> None:
+        self.samples.append((self.now, touches))
+
+async def load_recording(path: str) -> Item:
+    """ Decodes a recording as the remote did, including filtering and coalescing touches """
+    identity, notifications = recording.load(path)
+    capture = Capture()
+    sr = SiriRemote('00:00:00:00:00:00', capture)
+    sr.load_identity(identity)
+    for t, handle, data in notifications:
+        capture.now = t
+        sr.handleNotification(handle, data)
+        await asyncio.sleep(0)
+    label = None
+    if os.path.exists(path + '.labels.json'):
+        with open(path + '.labels.json', 'r') as file:
+            label = json.load(file)
+    return Item(os.path.basename(path), 'recording', sr, capture.samples, label)
+
+def key_names(keys: Keys) -> list[str]:
+    return [k.split(' ')[0] for _, k in keys.keys]
+
+def is_correct(item: Item, keys: Keys) -> bool:
+    assert item.label is not None
+    if item.kind == 'recording':
+        return key_names(keys) == item.label
+    # A swipe can step more than once, or a click can also select
+    return set(key_names(keys)) - {'SELECT'} == set(item.label)
+
+def begin_index(item: Item) -> int | None:
+    threshold = config['remote.touchpad.pressure_threshold']
+    for i, (_, sample) in enumerate(item.samples):
+        if not isinstance(sample, int) and any(t.p >= threshold for t in sample):
+            return i
+    return None
+
+def cpu_per_sample(items: list[Item], run: Callable[[Item], Keys], repeat: int) -> float:
+    samples = sum(len(item.samples) for item in items)
+    best = math.inf
+    for _ in range(repeat):
+        start = time.process_time()
+        for item in items:
+            run(item)
+        best = min(best, time.process_time() - start)
+    return best / max(samples, 1)
+
+def report(name: str, items: list[Item], results: list[Keys], cpu_sec: float) -> None:
+    print(f'{name}: {cpu_sec * 1e6:.1f}us CPU per sample')
+    print(f'  {"kind":<10} {"items":>6} {"correct":>8} {"samples":>8} {"ms":>7}')
+    for kind in sorted({item.kind for item in items}):
+        latency_samples = []
+        latency_ms = []
+        correct = labelled = 0
+        for item, keys in zip(items, results):
+            if item.kind != kind:
+                continue
+            if item.label is not None:
+                labelled += 1
+                correct += is_correct(item, keys)
+            begin = begin_index(item)
+            if keys.keys and begin is not None:
+                first = keys.keys[0][0]
+                latency_samples.append(first - begin)
+                latency_ms.append((item.samples[first][0] - item.samples[begin][0]) * 1000)
+        accuracy = f'{correct * 100 / labelled:.0f}%' if labelled else '-'
+        samples = f'{statistics.median(latency_samples):.0f}' if latency_samples else '-'
+        ms = f'{statistics.median(latency_ms):.0f}' if latency_ms else '-'
+        count = sum(item.kind == kind for item in items)
+        print(f'  {kind:<10} {count:>6} {accuracy:>8} {samples:>8} {ms:>7}')
+
+async def main() -> None:
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('recordings', nargs='*', help='recordings made with remote.record.dir')
+    arg_parser.add_argument('-n', '--synthetic', type=int, default=400,
+                            help='number of synthetic gestures')
+    arg_parser.add_argument('--seed', type=int, default=1)
+    arg_parser.add_argument('-w', '--window', type=int, action='append',
+                            help='batched window sizes, in samples (default 4 and 16)')
+    arg_parser.add_argument('-r', '--repeat', type=int, default=5, help='CPU measurements to take the best of')
+    args = arg_parser.parse_args()
+
+    items = synthetic_corpus(gen_1_remote(), args.synthetic, args.seed)
+    for path in args.recordings:
+        items.append(await load_recording(path))
+    print(f'{len(items)} items, {sum(len(item.samples) for item in items)} samples')
+
+    unpredicted = [run_scalar(item, False) for item in items]
+    report('scalar, without swipe prediction', items, unpredicted,
+           cpu_per_sample(items, lambda item: run_scalar(item, False), args.repeat))
+    scalar = [run_scalar(item) for item in items]
+    report('scalar', items, scalar, cpu_per_sample(items, run_scalar, args.repeat))
+    if gestures_batch is None:
+        print('NumPy is not installed, skipping the batched recognizers')
+        return
+    for window in args.window or [4, 16]:
+        batched = [run_batched(item, window) for item in items]
+        run: Callable[[Item], Keys] = lambda item: run_batched(item, window)
+        report(f'batched, window {window}', items, batched, cpu_per_sample(items, run, args.repeat))
+        for item, s, b in zip(items, scalar, batched):
+            if [k for _, k in s.keys] != [k for _, k in b.keys]:
+                print(f'  {item.name}: scalar {[k for _, k in s.keys]} batched {[k for _, k in b.keys]}')
+
+if __name__ == '__main__':
+    asyncio.run(main())
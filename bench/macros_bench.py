@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# Measures the per key press cost of macro detection as the number of configured macros grows.
+# The linear scan is the detection that Hub.client_press_key used before macros were compiled.
+
+import sys, os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import argparse, timeit
+
+from macros import MacroMatcher
+
+POWER = 0x40
+
+def make_macros(n: int) -> list[tuple[int, ...]]:
+    # POWER chords with distinct function keys, like the default configuration, only more of them.
+    return [(POWER, 0x1000 + i) for i in range(n)]
+
+def linear_scan(macros: list[tuple[int, ...]], key_state: dict[int, object]) -> int | None:
+    for macro_index, macro in enumerate(macros):
+        key_count = 0
+        for k in macro:
+            if k in key_state:
+                key_count += 1
+        if key_count == len(macro):
+            return macro_index
+    return None
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-n', '--number', type=int, default=20000, help='presses per measurement')
+    args = arg_parser.parse_args()
+
+    print(f'{"macros":>8} {"linear ns/press":>16} {"compiled ns/press":>18}')
+    for n in (1, 10, 100, 1000):
+        macros = make_macros(n)
+        matcher = MacroMatcher(macros)
+        # Worst case for the linear scan: the held chord is the last macro
+        key = 0x1000 + n - 1
+        key_state = {POWER: None, key: None}
+        assert linear_scan(macros, key_state) == matcher.match(key, key_state) == n - 1
+        linear = timeit.timeit(lambda: linear_scan(macros, key_state), number=args.number)
+        compiled = timeit.timeit(lambda: matcher.match(key, key_state), number=args.number)
+        print(f'{n:>8} {linear / args.number * 1e9:>16.0f} {compiled / args.number * 1e9:>18.0f}')
+
+if __name__ == '__main__':
+    main()
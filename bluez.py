@@ -0,0 +1,190 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+from __future__ import annotations
+
+import tools
+
+log = tools.logger(__name__)
+
+import asyncio
+from collections.abc import Callable
+from dbus_fast import BusType, Message, MessageType
+from dbus_fast.aio import MessageBus
+from typing import Any
+
+# Talks to BlueZ over the system D-Bus, to disconnect remotes from the system, to learn when a
+# remote is around, and to follow the batteries of input devices, without polling.
+
+device_interface = 'org.bluez.Device1'
+battery_interface = 'org.bluez.Battery1'
+
+# Service UUIDs of HID over classic Bluetooth, and HID over GATT
+hid_uuids = {'00001124-0000-1000-8000-00805f9b34fb', '00001812-0000-1000-8000-00805f9b34fb'}
+
+# Device properties that change when BlueZ hears from a device, whether by an advertisement, or
+# by the device connecting
+presence_properties = {'Connected', 'RSSI', 'ManufacturerData', 'ServiceData', 'TxPower'}
+
+match_rules = (
+    "type='signal',sender='org.bluez',interface='org.freedesktop.DBus.Properties',"
+    f"member='PropertiesChanged',arg0='{device_interface}'",
+    "type='signal',sender='org.bluez',interface='org.freedesktop.DBus.ObjectManager',"
+    "member='InterfacesAdded'",
+    "type='signal',sender='org.bluez',interface='org.freedesktop.DBus.Properties',"
+    f"member='PropertiesChanged',arg0='{battery_interface}'",
+    "type='signal',sender='org.bluez',interface='org.freedesktop.DBus.ObjectManager',"
+    "member='InterfacesRemoved'",
+)
+
+# Called with the MAC of an input device, and its battery percentage, or None once it is gone
+BatteryCallback = Callable[[str, int | None], None]
+
+def is_input_device(properties: dict[str, Any]) -> bool:
+    if not properties.get('Paired'):
+        return False
+    if str(properties.get('Icon', '')).startswith('input-'):
+        return True
+    return bool(hid_uuids & set(properties.get('UUIDs', ())))
+
+def values(properties: dict[str, Any]) -> dict[str, Any]:
+    """ Unwraps the variants of a property dict """
+    return {name: variant.value for name, variant in properties.items()}
+
+class BlueZ:
+    def __init__(self, bus: MessageBus, adapter: str = 'hci0') -> None:
+        self.bus = bus
+        self.adapter = adapter
+        self.waiters: dict[str, set[asyncio.Future[None]]] = {}
+        self.battery_callbacks: list[BatteryCallback] = []
+        # Device properties, and battery percentages, by object path. Only kept while batteries
+        # are being watched.
+        self.devices: dict[str, dict[str, Any]] = {}
+        self.batteries: dict[str, int] = {}
+        bus.add_message_handler(self.handle_message)
+
+    def device_path(self, mac: str) -> str:
+        return f'/org/bluez/{self.adapter}/dev_{mac.upper().replace(":", "_")}'
+
+    def handle_message(self, msg: Message) -> None:
+        if msg.message_type != MessageType.SIGNAL:
+            return
+        if msg.member == 'PropertiesChanged':
+            interface, changed, _ = msg.body
+            if interface == battery_interface:
+                self.battery_changed(msg.path, values(changed))
+                return
+            if interface != device_interface:
+                return
+            self.device_changed(msg.path, values(changed))
+            if not presence_properties & changed.keys():
+                return
+            connected = changed.get('Connected')
+            if connected is not None and not connected.value:
+                return
+            self.wake(msg.path)
+        elif msg.member == 'InterfacesAdded':
+            path, interfaces = msg.body
+            self.interfaces_added(path, interfaces)
+            if device_interface in interfaces:
+                self.wake(path)
+        elif msg.member == 'InterfacesRemoved':
+            path, interfaces = msg.body
+            if device_interface in interfaces or battery_interface in interfaces:
+                self.battery_removed(path)
+            if device_interface in interfaces:
+                self.devices.pop(path, None)
+
+    def interfaces_added(self, path: str, interfaces: dict[str, dict[str, Any]]) -> None:
+        if device_interface in interfaces:
+            self.device_changed(path, values(interfaces[device_interface]))
+        if battery_interface in interfaces:
+            self.battery_changed(path, values(interfaces[battery_interface]))
+
+    def device_changed(self, path: str, changed: dict[str, Any]) -> None:
+        if not self.battery_callbacks:
+            return
+        self.devices.setdefault(path, {}).update(changed)
+        if 'Paired' in changed or 'UUIDs' in changed or 'Icon' in changed:
+            # The device may have just become an input device
+            percentage = self.batteries.get(path)
+            if percentage is not None:
+                self.battery_changed(path, {'Percentage': percentage})
+
+    def battery_changed(self, path: str, changed: dict[str, Any]) -> None:
+        percentage = changed.get('Percentage')
+        if not self.battery_callbacks or percentage is None:
+            return
+        self.batteries[path] = percentage
+        device = self.devices.get(path)
+        if device is None or not is_input_device(device) or 'Address' not in device:
+            return
+        for callback in self.battery_callbacks:
+            callback(device['Address'], percentage)
+
+    def battery_removed(self, path: str) -> None:
+        if self.batteries.pop(path, None) is None:
+            return
+        device = self.devices.get(path)
+        if device is None or not is_input_device(device) or 'Address' not in device:
+            return
+        for callback in self.battery_callbacks:
+            callback(device['Address'], None)
+
+    async def watch_batteries(self, callback: BatteryCallback) -> None:
+        """ Calls back with the battery of each paired input device, now, and as it changes """
+        self.battery_callbacks.append(callback)
+        reply = await self.bus.call(Message(destination='org.bluez', path='/',
+                                            interface='org.freedesktop.DBus.ObjectManager',
+                                            member='GetManagedObjects'))
+        if reply.message_type == MessageType.ERROR:
+            log.info(f'Failed to get BlueZ objects {reply.error_name} {reply.body}')
+            return
+        for path, interfaces in reply.body[0].items():
+            self.interfaces_added(path, interfaces)
+
+    def wake(self, path: str) -> None:
+        for waiter in self.waiters.pop(path, ()):
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def wait_for_device(self, mac: str, timeout_sec: float) -> None:
+        """ Waits until BlueZ hears from the device, or the timeout expires """
+        path = self.device_path(mac)
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        waiters = self.waiters.setdefault(path, set())
+        waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout_sec)
+        except TimeoutError:
+            pass
+        finally:
+            waiters.discard(waiter)
+
+    async def disconnect(self, mac: str) -> None:
+        reply = await self.bus.call(Message(destination='org.bluez', path=self.device_path(mac),
+                                            interface=device_interface, member='Disconnect'))
+        if reply.message_type == MessageType.ERROR and reply.error_name != 'org.bluez.Error.NotConnected':
+            log.info(f'Failed to disconnect MAC {mac} {reply.error_name} {reply.body}')
+
+async def connect(adapter: str = 'hci0') -> BlueZ | None:
+    """ Returns None if BlueZ can't be reached over D-Bus """
+    bus: MessageBus | None = None
+    try:
+        bus = await MessageBus(bus_type=BusType.SYSTEM).connect()
+        for rule in match_rules:
+            reply = await bus.call(Message(destination='org.freedesktop.DBus',
+                                           path='/org/freedesktop/DBus',
+                                           interface='org.freedesktop.DBus', member='AddMatch',
+                                           signature='s', body=[rule]))
+            if reply.message_type == MessageType.ERROR:
+                raise ConnectionError(f'{reply.error_name} {reply.body}')
+    except Exception as e:
+        log.info(f'D-Bus unavailable {e}')
+        if bus is not None:
+            bus.disconnect()
+        return None
+    return BlueZ(bus, adapter)
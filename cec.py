@@ -19,6 +19,8 @@ import errno
 import fcntl
 import os
 
+import latency
+
 _IOC_NRBITS   =  8
 _IOC_TYPEBITS =  8
 _IOC_SIZEBITS = 14
@@ -668,6 +670,7 @@ class Adapter:
 
     async def transmit(self, msg: Message) -> Message:
         state = AsyncState(msg, asyncio.Event())
+        latency.hop('transmit')
         try:
             ret = self.ioctl(Ioctl.TRANSMIT, msg)
         except OSError as e:
@@ -680,6 +683,7 @@ class Adapter:
         self.states[msg.sequence] = state
         await state.event.wait()
         msg = state.msg
+        latency.end(msg.tx_ts)
         return msg
 
     async def active_source(self) -> None:
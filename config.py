@@ -8,9 +8,81 @@ import tools
 log = tools.logger(__name__)
 
 import os, re, shutil, tempfile, time, yaml
-from collections.abc import Callable, Generator
+from collections.abc import Callable, Generator, Iterator, Mapping
 from typing import Any
 
+# A compiled path, as the steps from the root to the value. Each step is a dict key, or a list index.
+Steps = tuple[str | int, ...]
+
+class Accessor:
+    """ A path that is compiled once, and a value that is read once per config change, for the
+    config that is read at runtime, i.e.
+
+        low_threshold = config.accessor('remote.battery.low_threshold')
+        ...
+        if level <= low_threshold():
+
+    The value is only read again when the config is changed through Config, so changing the
+    containers it returns in place isn't seen.
+    """
+    __slots__ = ('config', 'path', 'steps', 'generation', 'value')
+
+    def __init__(self, config: 'Config', path: str) -> None:
+        self.config = config
+        self.path = path
+        self.steps = config.compile(path)
+        self.generation = -1
+        self.value: Any = None
+
+    def __call__(self) -> Any:
+        if self.generation != self.config.generation:
+            self.value = self.config.lookup(self.steps)
+            self.generation = self.config.generation
+        return self.value
+
+class Snapshot(Mapping[Any, Any]):
+    """ A read only copy of the config, i.e. snapshot['remote']['battery']['low_threshold'], or
+    snapshot.remote.battery.low_threshold
+
+    Dicts become snapshots, and lists become tuples. A key that isn't an identifier, or that is the
+    name of a mapping method, such as keys or get, is only read by subscript.
+    """
+    __slots__ = ('_values',)
+
+    def __init__(self, node: dict[Any, Any]) -> None:
+        object.__setattr__(self, '_values', {name: freeze(value) for name, value in node.items()})
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(f'Config: snapshot has no {name}') from None
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError('Config: snapshots are read only')
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError('Config: snapshots are read only')
+
+    def __getitem__(self, name: Any) -> Any:
+        return self._values[name]
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __repr__(self) -> str:
+        return f'Snapshot({self._values!r})'
+
+def freeze(value: Any) -> Any:
+    if type(value) is dict:
+        return Snapshot(value)
+    if type(value) is list:
+        return tuple(freeze(item) for item in value)
+    return value
+
 class Config:
     def __init__(self, filename: str) -> None:
         self.default_paths: dict[str, Any] = {}
@@ -18,6 +90,11 @@ class Config:
         self.cfg: dict[str, Any] = {}
         self.loaded = False
         self.filename = filename
+        # Counts the changes to the config, so accessors and snapshots know when to read it again
+        self.generation = 0
+        self.compiled: dict[str, Steps] = {}
+        self.current: Snapshot | None = None
+        self.current_generation = -1
         self.loader_class: type[yaml.SafeLoader] = type('Loader', (yaml.SafeLoader,), {})
         self.dumper_class: type[yaml.SafeDumper] = type('Dumper', (yaml.SafeDumper,), {})
         self.default('config.max_backups', 10)
@@ -42,6 +119,7 @@ class Config:
             log.info(f'{self.filename} not found. Defaulting to empty config.')
         self.__overlay(self.cfg, self.user_cfg)
         self.loaded = True
+        self.generation += 1
 
     def save(self, backup: bool = False) -> None:
         log.info(f'Save {self.filename}')
@@ -125,6 +203,7 @@ class Config:
         else:
             self.default_paths[path] = value
             self.__apply(self.cfg, path, value)
+            self.generation += 1
             log.info(f"Default '{path}' = '{value}'")
 
     def __apply(self, node: Any, path: str, value: Any) -> None:
@@ -181,27 +260,47 @@ class Config:
             raise ValueError(f'Config: malformed path {path!r}')
         return ((elems[i], elems[i+1]) for i in range(0, len(elems), 2))
 
-    def __getitem__(self, path: str) -> Any:
+    def compile(self, path: str) -> Steps:
         if type(path) is not str:
             raise TypeError(f'Config: path must be str, got {type(path).__name__}')
-        elems = self.__elements(path)
+        steps = self.compiled.get(path)
+        if steps is None:
+            steps = tuple(name if sep == '.' else int(name)
+                          for sep, name in self.__elements(path) if name is not None)
+            self.compiled[path] = steps
+        return steps
+
+    def lookup(self, steps: Steps) -> Any:
         node = self.cfg
-        for sep, name in elems:
-            if sep == '.': # dict
+        for step in steps:
+            if type(step) is str: # dict
                 if type(node) is not dict:
-                    raise TypeError(f'Config: expected dict at {name!r} in path, got {type(node).__name__}')
-                if name not in node:
+                    raise TypeError(f'Config: expected dict at {step!r} in path, got {type(node).__name__}')
+                if step not in node:
                     return None
-                node = node[name]
-            else: # sep == ',' # list
+                node = node[step]
+            else: # list
                 if type(node) is not list:
-                    raise TypeError(f'Config: expected list at index {name!r} in path, got {type(node).__name__}')
-                index = int(name)
-                if index >= len(node):
+                    raise TypeError(f'Config: expected list at index {str(step)!r} in path, got {type(node).__name__}')
+                if step >= len(node):
                     return None
-                node = node[index]
+                node = node[step]
         return node
 
+    def __getitem__(self, path: str) -> Any:
+        return self.lookup(self.compile(path))
+
+    def accessor(self, path: str) -> Accessor:
+        return Accessor(self, path)
+
+    def snapshot(self) -> Snapshot:
+        """ Returns a read only copy of the config. It is made once per config change, so holders
+        of a snapshot see the same config until they take a new one. """
+        if self.current is None or self.current_generation != self.generation:
+            self.current = Snapshot(self.cfg)
+            self.current_generation = self.generation
+        return self.current
+
     def __setitem__(self, path: str, value: Any) -> None:
         if type(path) is not str:
             raise TypeError(f'Config: path must be str, got {type(path).__name__}')
@@ -213,6 +312,7 @@ class Config:
         else:
             self.__apply(self.user_cfg, path, value)
             self.__apply(self.cfg, path, value)
+        self.generation += 1
 
     def replace_user_root(self, value: dict[str, Any]) -> None:
         """ Replace all user settings while maintaining defaults """
@@ -221,3 +321,4 @@ class Config:
             self.__apply(self.cfg, path, default_value)
         self.user_cfg = value
         self.__overlay(self.cfg, self.user_cfg)
+        self.generation += 1
@@ -2,7 +2,7 @@ import tools
 
 log = tools.logger('var/log/echo_test.log')
 
-import subprocess, sys
+import asyncio, sys
 
 from remote import SiriRemote, RemoteListener
 
@@ -52,7 +52,6 @@ class Callback(RemoteListener):
 if __name__ == '__main__':
     if len(sys.argv) > 1:
         mac = sys.argv[1]
-        subprocess.run(['/usr/bin/bluetoothctl', 'disconnect', mac], capture_output=True)
-        SiriRemote(mac, Callback())
+        asyncio.run(SiriRemote(mac, Callback()).run())
     else:
         print("error: no mac address")
@@ -8,26 +8,121 @@ import tools
 
 log = tools.logger(__name__)
 
-import asyncio, evdev, time
+import asyncio, evdev, os, time, yaml
+import evdev.ecodes as e
 from evdev import InputDevice
 from typing import Any, Protocol
-from watchdog.events import FileSystemEventHandler
-from watchdog.observers import Observer
+
+from aconfig import config
+import inotify
+from latency import Histogram
+
+config.default('evdev.fingerprint_cache_path', 'var/evdev/fingerprints.yaml')
+# Names of the handlers whose devices are grabbed, so no other reader, like a console, gets their
+# events. i.e. ['SolarCell']
+config.default('evdev.grab', [])
 
 class InputHandler(Protocol):
     name: str
     def wait_on(self) -> set[asyncio.Task[Any]]: ...
     def probe(self, dev: InputDevice) -> bool: ...
-    async def dispatch_input_event(self, event: evdev.InputEvent) -> None: ...
+    def probe_key(self) -> str:
+        """ Changes whenever what probe() matches does, so cached results of old probes are
+        dropped """
+        ...
+    async def dispatch_input_frame(self, events: list[evdev.InputEvent]) -> None:
+        """ Gets the events of a device up to each SYN_REPORT, without it """
+        ...
+
+class HandlerStats:
+    def __init__(self) -> None:
+        self.reads = 0
+        self.frames = 0
+        self.events = 0
+        # Frames the kernel dropped events from, when we didn't read fast enough
+        self.dropped = 0
+        # From the kernel's timestamp of each SYN_REPORT, to dispatching its frame
+        self.latency = Histogram()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'reads': self.reads,
+            'frames': self.frames,
+            'events': self.events,
+            'dropped': self.dropped,
+            'latency': self.latency.stats(),
+        }
+
+def fingerprint(device: InputDevice) -> str:
+    """ Identifies a model of device, so reconnects can skip probing """
+    info = device.info
+    return (f'{info.bustype:04x}:{info.vendor:04x}:{info.product:04x}:{info.version:04x} '
+            f'{device.name}')
+
+# The probe results of a fingerprint, by handler name, i.e.
+#   {'Keyboard': {'probe': <the handler's probe_key()>, 'match': True}}
+Entry = dict[str, dict[str, Any]]
+
+class FingerprintCache:
+    """ Remembers which handlers match each fingerprint """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.entries: dict[str, Entry] = {}
+        try:
+            with open(path, 'r') as file:
+                entries = yaml.safe_load(file)
+            if isinstance(entries, dict):
+                self.entries = entries
+        except FileNotFoundError:
+            pass
+        except (OSError, yaml.YAMLError) as e:
+            log.info(f'Ignoring fingerprint cache {path} {e}')
+
+    def get(self, fingerprint: str, handler: InputHandler) -> bool | None:
+        """ Returns whether the handler matches, or None if it has to probe """
+        entry = self.entries.get(fingerprint)
+        result = entry.get(handler.name) if isinstance(entry, dict) else None
+        # A result only holds for the probe that made it, i.e. not once keyboard.required_keys
+        # changes
+        if not isinstance(result, dict) or result.get('probe') != handler.probe_key():
+            return None
+        return bool(result.get('match'))
+
+    def put(self, fingerprint: str, handler: InputHandler, match: bool) -> None:
+        entry = self.entries.get(fingerprint)
+        if not isinstance(entry, dict):
+            entry = self.entries[fingerprint] = {}
+        entry[handler.name] = {'probe': handler.probe_key(), 'match': match}
+        self.save()
 
-class EvdevInput(FileSystemEventHandler):
+    def save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as file:
+                yaml.safe_dump(self.entries, file)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.info(f'Failed to save fingerprint cache {self.path} {e}')
+
+class EvdevInput:
     def __init__(self, handlers: list[InputHandler], loop: asyncio.AbstractEventLoop) -> None:
         self.devices: list[InputDevice] = []
         self.handlers = handlers
         self.loop = loop
         self.taskit = tools.Tasker('EvdevInput')
-        self.listen_to_all_devices()
+        # Paths of devices that are being listened to, and of devices we can't open yet
+        self.listening: set[str] = set()
+        self.pending: set[str] = set()
+        # The listeners of physical devices, by handler. A device that shows up again at a new path
+        # before its old one goes away, i.e. as it reconnects, replaces the listener of the old one.
+        self.physical: dict[tuple[str, str, str, str], asyncio.Task[None]] = {}
+        self.cache = FingerprintCache(config['evdev.fingerprint_cache_path'])
+        self.grab: list[str] = config['evdev.grab']
+        self.handler_stats = {handler.name: HandlerStats() for handler in handlers}
+        self.watcher: inotify.Watcher | None = None
         self.start_input_monitor()
+        self.listen_to_all_devices()
 
     def wait_on(self) -> set[asyncio.Task[Any]]:
         tasks = set(self.taskit.tasks)
@@ -35,47 +130,142 @@ class EvdevInput(FileSystemEventHandler):
             tasks.update(handler.wait_on())
         return tasks
 
+    def stats(self) -> dict[str, dict[str, Any]]:
+        return {name: stats.stats() for name, stats in self.handler_stats.items()}
+
     def start_input_monitor(self) -> None:
-        path = '/dev/input/'
+        path = '/dev/input'
         log.info(f'Monitoring {path} for new input devices')
-        self.observer = Observer()
-        self.observer.schedule(self, path, recursive=False)
-        self.observer.start()
-
-    # Watchdog handler must be called dispatch()
-    def dispatch(self, event: Any) -> None:
-        if event.event_type == 'created' and not event.is_directory:
-            log.info(f'New input event source {event.src_path}')
-
-            # This sleep is obviously a hack...
-            # The issue is that the device is initially created with permissions
-            # that don't allow us to access it. It's chmoded after creation. In theory, we need
-            # to monitor the create, and then the modification messages to hit at the right time.
-            # That's an ugly can of worms that is best avoided with this very generous sleep on the
-            # observer's thread.
-            time.sleep(.75)
-            self.loop.call_soon_threadsafe(self.listen_device_at_path, event.src_path)
-        elif event.event_type == 'deleted' and not event.is_directory:
-            log.info(f'Input event source delete {event.src_path}')
-
-    async def listen_device_task(self, device: InputDevice, handler: InputHandler) -> None:
+        try:
+            mask = inotify.IN_CREATE | inotify.IN_ATTRIB | inotify.IN_DELETE
+            self.watcher = inotify.Watcher(path, mask, self.device_changed, self.loop)
+        except OSError as e:
+            log.info(f'Failed to monitor {path} {e}')
+
+    def device_changed(self, mask: int, path: str) -> None:
+        if mask & inotify.IN_ISDIR or not os.path.basename(path).startswith('event'):
+            return
+        if mask & inotify.IN_DELETE:
+            log.info(f'Input event source delete {path}')
+            self.pending.discard(path)
+            return
+        if path in self.listening:
+            return
+        if mask & inotify.IN_CREATE:
+            log.info(f'New input event source {path}')
+        elif path not in self.pending:
+            return
+        # The device is created with permissions that don't allow us to access it, and udev
+        # changes them after. If it can't be opened yet, this is tried again when they change.
+        self.listen_device_at_path(path)
+
+    async def listen_device_task(self, device: InputDevice, handler: InputHandler,
+                                 physical: tuple[str, str, str, str]) -> None:
         path = device.path
         log.info(f'{handler.name}: Listening to device {path}')
+        stats = self.handler_stats[handler.name]
+        if handler.name in self.grab:
+            try:
+                device.grab()
+                log.info(f'{handler.name}: Grabbed device {path}')
+            except OSError as exc:
+                log.info(f'{handler.name}: Failed to grab device {path} {exc}')
+        frame: list[evdev.InputEvent] = []
+        dropping = False
+        # The keys the handler was last told are down, so they can be released if their key up
+        # was dropped
+        down: set[int] = set()
         try:
-            async for event in device.async_read_loop():
-                await handler.dispatch_input_event(event)
+            while True:
+                # Each read returns all the events that are queued, so a chatty device wakes us up
+                # once for many of them
+                events = await device.async_read()
+                stats.reads += 1
+                for event in events:
+                    if event.type != e.EV_SYN:
+                        if not dropping:
+                            frame.append(event)
+                    elif event.code == e.SYN_REPORT:
+                        if dropping:
+                            # The device's state is complete again from here. Release the keys
+                            # that were released in the meantime.
+                            dropping = False
+                            active = set(device.active_keys())
+                            frame = [evdev.InputEvent(event.sec, event.usec, e.EV_KEY, code, 0)
+                                     for code in sorted(down - active)]
+                            if frame:
+                                log.info(f'{handler.name}: Releasing {len(frame)} keys after '
+                                         'dropped events')
+                        if frame:
+                            stats.frames += 1
+                            stats.events += len(frame)
+                            stats.latency.add((time.time() - event.timestamp()) * 1000)
+                            for key_event in frame:
+                                if key_event.type == e.EV_KEY:
+                                    if key_event.value:
+                                        down.add(key_event.code)
+                                    else:
+                                        down.discard(key_event.code)
+                            await handler.dispatch_input_frame(frame)
+                            frame = []
+                    elif event.code == e.SYN_DROPPED:
+                        # The kernel's buffer overflowed. Skip the events up to the next
+                        # SYN_REPORT, which are incomplete, and sync then.
+                        stats.dropped += 1
+                        dropping = True
+                        frame = []
         except OSError as exc:
             log.info(f'{handler.name}: Stopped listening to device {path}')
+        except asyncio.CancelledError:
+            # Replaced by a new node of the same device. This isn't a failure, which is what the
+            # Tasker takes a cancelled task to be.
+            log.info(f'{handler.name}: Stopped listening to replaced device {path}')
+            device.close()
+        finally:
+            self.listening.discard(path)
+            if self.physical.get(physical) is asyncio.current_task():
+                del self.physical[physical]
 
     def listen_to_all_devices(self) -> None:
         for path in evdev.list_devices():
             self.listen_device_at_path(path)
 
     def listen_device_at_path(self, path: str) -> None:
-        device = evdev.InputDevice(path)
+        try:
+            device = evdev.InputDevice(path)
+        except PermissionError:
+            log.info(f'Waiting for access to {path}')
+            self.pending.add(path)
+            return
+        except OSError as e:
+            log.info(f'Failed to open {path} {e}')
+            self.pending.discard(path)
+            return
+        self.pending.discard(path)
+        key = fingerprint(device)
+        for handler in self.matching_handlers(device, key):
+            physical = (handler.name, key, device.phys, device.uniq)
+            old = self.physical.get(physical)
+            if old is not None:
+                log.info(f'{handler.name}: {device.name} {device.phys} is back at {path}, '
+                         'replacing its old listener')
+                old.cancel()
+            self.listening.add(path)
+            task = self.taskit(self.listen_device_task(device, handler, physical))
+            self.physical[physical] = task
+        if path not in self.listening:
+            device.close()
+
+    def matching_handlers(self, device: InputDevice, key: str) -> list[InputHandler]:
+        handlers = []
         for handler in self.handlers:
-            if handler.probe(device):
-                self.taskit(self.listen_device_task(device, handler))
+            match = self.cache.get(key, handler)
+            if match is None:
+                match = handler.probe(device)
+                self.cache.put(key, handler, match)
+            if match:
+                handlers.append(handler)
+        return handlers
 
 async def main() -> None:
     loop = asyncio.get_event_loop()
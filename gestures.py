@@ -1,4 +1,4 @@
-# Copyright 2024.
+# Copyright 2024-2026.
 # This file is part of Amity.
 # Amity is free software: you can redistribute it and/or modify it under the terms of the
 # GNU General Public License as published by the Free Software Foundation, either version 3 of the
@@ -6,16 +6,28 @@
 
 from __future__ import annotations
 
-import math, time
+import asyncio, math, time
 from collections.abc import Callable
 from typing import Any
 
 from remote import HwRevisions, SiriRemote, Touch
 from aconfig import config
 
-config.default('remote.touchpad.pressure_threshold', 20)
 config.default('remote.touchpad.swipe.distance_thresholds_mm', (7.0, 7.0))
 config.default('remote.touchpad.swipe.deceleration', -250)
+# A key press takes about 80ms on the CEC wire, so a glide mustn't step faster than this
+config.default('remote.touchpad.swipe.kinetic.min_interval_sec', 0.1)
+# A swipe that is heading past the distance threshold within the horizon sends its first key early.
+# A horizon of 0 turns prediction off. See OneAxisSwipeRecognizer.predict().
+#
+# A wrong prediction isn't undone. Sending the opposite key isn't an undo at the edge of a list,
+# where the early key didn't move, so the undo would. The early step stands as the swipe's first,
+# and is only taken off the steps of a swipe that heads the same way.
+config.default('remote.touchpad.swipe.predict.horizon_sec', 0.05)
+config.default('remote.touchpad.swipe.predict.window_sec', 0.15)
+config.default('remote.touchpad.swipe.predict.samples', 4)
+config.default('remote.touchpad.swipe.predict.min_velocity', 80) # mm/s
+config.default('remote.touchpad.swipe.predict.confidence', 0.6)
 
 class EventType:
     Inactive: int = 0
@@ -29,6 +41,11 @@ class TouchState:
     def __init__(self, start_touch: Touch) -> None:
         self.start_touch = start_touch
         self.last_active_touch = start_touch
+        # Swipe prediction. The latest samples, the step sent early, if any, and whether the touch
+        # is too old to predict.
+        self.recent: list[Touch] = []
+        self.committed = 0
+        self.prediction_over = False
     def is_begin_touch(self, touch: Touch) -> bool:
         return self.start_touch.timestamp == touch.timestamp
 
@@ -67,9 +84,14 @@ class GestureRecognizer:
         return None
 
 class SwipeEvent:
-    def __init__(self, type: int, xy: tuple[int, int]) -> None:
+    def __init__(self, type: int, xy: tuple[int, int], velocity: float = 0,
+                 early_steps: int = 0) -> None:
         self.type = type
         self.x, self.y = xy
+        # When a swipe ends, the velocity it was released with along its axis, in mm/s, and how
+        # many steps of its glide were sent early. See KineticScroller.start().
+        self.velocity = velocity
+        self.early_steps = early_steps
     def __str__(self) -> str:
         return f'0x{self.type:02X} ({self.x}, {self.y})'
 
@@ -79,10 +101,70 @@ class OneAxisSwipeRecognizer(GestureRecognizer):
         self.axis = axis
         self.distance_threshold_mm = distance_threshold_mm
         self.deceleration: float = config['remote.touchpad.swipe.deceleration']
+        self.predict_horizon_sec: float = config['remote.touchpad.swipe.predict.horizon_sec']
+        self.predict_min_velocity: float = config['remote.touchpad.swipe.predict.min_velocity']
+        self.predict_confidence: float = config['remote.touchpad.swipe.predict.confidence']
+        self.predict_window_sec: float = config['remote.touchpad.swipe.predict.window_sec']
+        self.predict_samples: int = config['remote.touchpad.swipe.predict.samples']
+
+    def is_predicting(self, touch_state: TouchState) -> bool:
+        """ Whether the start of a touch may still be predicted, or a prediction is yet to be
+        settled by the touch passing the threshold """
+        if self.predict_horizon_sec <= 0:
+            return False
+        if touch_state.last_active_touch is not touch_state.start_touch:
+            return False
+        return touch_state.committed != 0 or not touch_state.prediction_over
+
+    def predict(self, touch_state: TouchState, touch: Touch) -> int:
+        """ Returns the direction a touch is confidently heading past the threshold in, or 0 """
+        if touch.time_from_touch(touch_state.start_touch) > self.predict_window_sec:
+            # Only the start of a touch is predicted
+            touch_state.prediction_over = True
+            touch_state.recent = []
+            return 0
+        recent = touch_state.recent
+        recent.append(touch)
+        if len(recent) > self.predict_samples:
+            del recent[0]
+        if len(recent) < self.predict_samples:
+            return 0
+        axis = self.axis
+        # The velocity of each step between samples, along this axis
+        velocities = []
+        for a, b in zip(recent, recent[1:]):
+            dt = b.time_from_touch(a)
+            if dt <= 0:
+                return 0
+            velocities.append(b.axis_distances_from_touch(a)[axis] / dt)
+        if not (all(v > 0 for v in velocities) or all(v < 0 for v in velocities)):
+            # Not heading one way yet
+            return 0
+        first, last = recent[0], recent[-1]
+        dt = last.time_from_touch(first)
+        along, across = (abs(d) / dt for d in last.axis_distances_from_touch(first))
+        if axis != 0:
+            along, across = across, along
+        if along < self.predict_min_velocity:
+            return 0
+        # How much the touch heads along this axis, rather than across it, from 0 to 1
+        confidence = (along - across) / (along + across)
+        if confidence < self.predict_confidence:
+            return 0
+        v = velocities[-1]
+        acceleration = (v - velocities[0]) / (dt - dt / len(velocities))
+        h = self.predict_horizon_sec
+        distance = last.axis_distances_from_touch(touch_state.start_touch)[axis]
+        distance += v * h + .5 * acceleration * h * h
+        if abs(distance) <= self.distance_threshold_mm:
+            return 0
+        return 1 if v > 0 else -1
 
     def touches_internal(self, remote: SiriRemote, touches: list[Touch]) -> SwipeEvent:
         event_type = EventType.Running
         counter = 0
+        velocity = 0.0
+        early_steps = 0
         for touch in touches:
             touch_state, et = self.state_for_touch(touch)
             if touch_state is None:
@@ -103,10 +185,13 @@ class OneAxisSwipeRecognizer(GestureRecognizer):
                     a = -a
                 t = -v / a
                 d = v*t + .5*a*t*t
+                # How far the swipe glides. See KineticScroller.
                 counter = int(d / self.distance_threshold_mm)
+                committed = touch_state.committed
                 if counter != 0:
-                    # Clamp the counter so it doesn't do surprising things...
-                    counter = min(max(counter, -6), 6)
+                    velocity = v
+                    # A step sent early the same way counts as the glide's first
+                    early_steps = max(committed if counter > 0 else -committed, 0)
                     event_type |= EventType.Detected
             else:
                 axis_distances = touch.axis_distances_from_touch(touch_state.last_active_touch)
@@ -114,12 +199,22 @@ class OneAxisSwipeRecognizer(GestureRecognizer):
                 # Do we have an event?
                 if abs(distance) > self.distance_threshold_mm:
                     counter = int(distance / self.distance_threshold_mm)
+                    if counter * touch_state.committed > 0:
+                        # Less the step that was sent early
+                        counter -= touch_state.committed
+                    touch_state.committed = 0
                     touch_state.last_active_touch = touch
-                    event_type |= EventType.Detected
+                    if counter != 0:
+                        event_type |= EventType.Detected
+                elif touch_state.committed == 0 and self.is_predicting(touch_state):
+                    counter = self.predict(touch_state, touch)
+                    if counter != 0:
+                        touch_state.committed = counter
+                        event_type |= EventType.Detected
 
         xy = [0, 0]
         xy[self.axis] = counter
-        return SwipeEvent(event_type, tuple(xy)) # type: ignore[arg-type]
+        return SwipeEvent(event_type, tuple(xy), velocity, early_steps) # type: ignore[arg-type]
 
     def touches(self, remote: SiriRemote, touches: list[Touch]) -> None:
         event = self.touches_internal(remote, touches)
@@ -163,6 +258,80 @@ class SwipeRecognizer:
             event_type = EventType.Running
         self.callback(self, SwipeEvent(event_type, (0, 0)))
 
+class KineticScroller:
+    """ Keeps a released swipe gliding along the deceleration curve, and steps each time it glides
+    another threshold distance. Steps are spaced by at least the minimum interval, so as not to flood
+    the bus. A step that waited for its slot takes the thresholds glided meanwhile with it, and the
+    glide ends when its motion does, so a fast glide covers fewer steps rather than taking
+    longer. """
+    def __init__(self, callback: Callable[[int, int], None]) -> None:
+        self.callback = callback # (axis, direction)
+        self.deceleration = -config['remote.touchpad.swipe.deceleration'] # mm/s^2
+        self.distance_thresholds_mm = config['remote.touchpad.swipe.distance_thresholds_mm']
+        self.min_interval_sec: float = config['remote.touchpad.swipe.kinetic.min_interval_sec']
+        self.timer: asyncio.TimerHandle | None = None
+        self.axis = 0
+        self.direction = 0
+        self.speed = 0.0
+        self.steps = 0
+        self.start_time = 0.0
+        self.last_step_time = 0.0
+
+    def is_running(self) -> bool:
+        return self.timer is not None
+
+    def start(self, axis: int, velocity: float, early_steps: int = 0) -> None:
+        """ early_steps of the glide were sent before the release """
+        self.cancel()
+        if self.deceleration <= 0 or velocity == 0:
+            return
+        self.axis = axis
+        self.direction = 1 if velocity > 0 else -1
+        self.speed = abs(velocity)
+        self.steps = early_steps
+        self.start_time = asyncio.get_running_loop().time()
+        self.last_step_time = -math.inf
+        self.schedule()
+
+    def cancel(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def step_time(self, step: int) -> float | None:
+        """ Returns how long after the release the glide covers step thresholds, or None if it
+        stops before """
+        # Solve d = v*t - a*t*t/2 for t
+        d = max(step, 0) * self.distance_thresholds_mm[self.axis]
+        discriminant = self.speed * self.speed - 2 * self.deceleration * d
+        if discriminant < 0:
+            return None
+        return (self.speed - math.sqrt(discriminant)) / self.deceleration
+
+    def steps_at(self, elapsed: float) -> int:
+        """ Returns how many thresholds the glide covers in elapsed seconds after the release """
+        t = min(max(elapsed, 0.0), self.speed / self.deceleration)
+        d = self.speed * t - self.deceleration * t * t / 2
+        return int(d / self.distance_thresholds_mm[self.axis])
+
+    def schedule(self) -> None:
+        self.timer = None
+        t = self.step_time(self.steps + 1)
+        if t is None:
+            return
+        when = max(self.start_time + t, self.last_step_time + self.min_interval_sec)
+        if when > self.start_time + self.speed / self.deceleration:
+            # The glide has stopped by then
+            return
+        self.timer = asyncio.get_running_loop().call_at(when, self.step)
+
+    def step(self) -> None:
+        now = asyncio.get_running_loop().time()
+        self.steps = max(self.steps + 1, self.steps_at(now - self.start_time))
+        self.last_step_time = now
+        self.schedule()
+        self.callback(self.axis, self.direction)
+
 class TapEvent:
     def __init__(self, type: int, remote: SiriRemote, x: int, y: int) -> None:
         self.type = type
@@ -171,9 +340,11 @@ class TapEvent:
         self.y = y
 
 class TapRecognizer(GestureRecognizer):
-    def __init__(self, num_fingers: int, callback: Callable[..., Any]) -> None:
+    def __init__(self, num_fingers: int, callback: Callable[..., Any],
+                 clock: Callable[[], float] = time.time) -> None:
         super().__init__(num_fingers, callback)
         self.num_fingers = num_fingers
+        self.clock = clock
         self.reset()
 
     def reset(self) -> None:
@@ -210,7 +381,7 @@ class TapRecognizer(GestureRecognizer):
             if et == EventType.Begin:
                 self.num_active_touches += 1
                 if self.num_active_touches == 1:
-                    self.begin_touch_timestamp = time.time()
+                    self.begin_touch_timestamp = self.clock()
                 if self.num_active_touches == self.num_fingers:
                     self.begin_xy = self.midpoint_of_touches(self.last_active_touches())
                 self.end_touches = []
@@ -224,7 +395,7 @@ class TapRecognizer(GestureRecognizer):
                     if self.have_all_touches:
                         # Was this more of a long press than a tap?
                         assert self.begin_touch_timestamp is not None
-                        td = time.time() - self.begin_touch_timestamp
+                        td = self.clock() - self.begin_touch_timestamp
                         if td > .4 or td < .05:
                             self.reset()
                             if self.callback is not None:
@@ -257,21 +428,23 @@ class TapRecognizer(GestureRecognizer):
             self.callback(self, TapEvent(event_type, remote, x, y))
 
 class MultiTapRecognizer:
-    def __init__(self, num_fingers: int, num_taps: int, callback: Callable[..., Any]) -> None:
+    def __init__(self, num_fingers: int, num_taps: int, callback: Callable[..., Any],
+                 clock: Callable[[], float] = time.time) -> None:
         self.num_fingers = num_fingers
         self.num_taps = num_taps
         self.callback = callback
-        self.tap_recognizer = TapRecognizer(self.num_fingers, self.tap_event)
+        self.clock = clock
+        self.tap_recognizer = TapRecognizer(self.num_fingers, self.tap_event, clock)
         self.reset()
 
     def reset(self) -> None:
-        self.last_tap_time: float = time.time()
+        self.last_tap_time: float = self.clock()
         self.tap_recognizer.reset()
         self.tap_count: int = 0
 
     def tap_event(self, recognizer: TapRecognizer, event: TapEvent) -> None:
         if event.type & EventType.Detected:
-            now = time.time()
+            now = self.clock()
             if now - self.last_tap_time > .4:
                 if self.tap_count > 0:
                     self.callback(self, TapEvent(EventType.Cancelled, event.remote, 0, 0))
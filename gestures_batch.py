@@ -0,0 +1,208 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Sequence
+from typing import Any
+
+import numpy as np
+
+import gestures
+from gestures import EventType, SwipeEvent
+from remote import SiriRemote, Touch
+
+# Gesture recognizers that take a window of touch reports at a time, and make the same decisions
+# as the recognizers in gestures, one report at a time.
+#
+# Each batched recognizer wraps its scalar recognizer, and shares its state. Reports that begin,
+# end, or cancel a touch go through the scalar recognizer. Runs of reports that only move a touch
+# that is already down are handled with array math, since nothing but a swipe can happen in them.
+# Events of moves that don't detect anything carry no decision, and aren't reported.
+#
+# NumPy isn't in requirements.txt, as the hub doesn't need it. See bench/gestures_bench.py.
+
+Report = tuple[float, list[Touch]] # Arrival time, and the touches of one report
+
+class Window:
+    """ The first touch of each report of a window, as arrays """
+    def __init__(self, reports: Sequence[Report]) -> None:
+        self.reports = reports
+        n = len(reports)
+        self.count = np.zeros(n, dtype=np.int64)
+        self.id = np.full(n, -1, dtype=np.int64)
+        self.x = np.zeros(n, dtype=np.int64)
+        self.y = np.zeros(n, dtype=np.int64)
+        self.p = np.zeros(n, dtype=np.int64)
+        for i, (_, touches) in enumerate(reports):
+            self.count[i] = len(touches)
+            if touches:
+                t = touches[0]
+                self.id[i], self.x[i], self.y[i], self.p[i] = t.id, t.x, t.y, t.p
+
+    def touch(self, i: int) -> Touch:
+        return self.reports[i][1][0]
+
+    def move_run_end(self, start: int, touch_id: int, pressure_threshold: int) -> int:
+        """ Returns the end of the run of reports from start that only move the touch """
+        moves = ((self.count[start:] == 1) & (self.id[start:] == touch_id) &
+                 (self.p[start:] >= pressure_threshold))
+        if moves.all():
+            return len(moves) + start
+        return int(moves.argmin()) + start
+
+class BatchRecognizer(ABC):
+    def __init__(self, callback: Callable[..., Any]) -> None:
+        self.callback = callback
+        self.now = 0.0
+
+    def clock(self) -> float:
+        """ The arrival time of the report being recognized """
+        return self.now
+
+    def active_touch_id(self) -> int | None:
+        """ Returns the touch that runs of moves can be batched for """
+        return None
+
+    @abstractmethod
+    def pressure_threshold(self) -> int:
+        """ The pressure a touch needs to count as down """
+
+    @abstractmethod
+    def step(self, remote: SiriRemote, touches: list[Touch]) -> None:
+        """ Recognizes one report with the scalar recognizer """
+
+    @abstractmethod
+    def moves(self, remote: SiriRemote, window: Window, start: int, end: int) -> None:
+        """ Recognizes a run of reports that only move the active touch """
+
+    def scalar_callback(self, recognizer: Any, event: Any) -> None:
+        self.callback(self, event)
+
+    def reports(self, remote: SiriRemote, reports: Sequence[Report]) -> None:
+        window = Window(reports)
+        i = 0
+        while i < len(reports):
+            touch_id = self.active_touch_id()
+            end = i
+            if touch_id is not None:
+                end = window.move_run_end(i, touch_id, self.pressure_threshold())
+            if end > i:
+                self.moves(remote, window, i, end)
+                i = end
+            else:
+                self.now, touches = reports[i]
+                self.step(remote, touches)
+                i += 1
+
+class BatchSwipeRecognizer(BatchRecognizer):
+    def __init__(self, callback: Callable[..., Any]) -> None:
+        super().__init__(callback)
+        self.scalar = gestures.SwipeRecognizer(self.scalar_callback)
+
+    def reset(self) -> None:
+        self.scalar.reset()
+
+    def axes(self) -> list[gestures.OneAxisSwipeRecognizer]:
+        if self.scalar.primary_axis is None:
+            return self.scalar.rs
+        return [self.scalar.rs[self.scalar.primary_axis]]
+
+    def active_touch_id(self) -> int | None:
+        axes = self.axes()
+        ids = [tuple(r.touch_states) for r in axes]
+        if not ids[0] or len(ids[0]) != 1 or any(i != ids[0] for i in ids):
+            return None
+        touch_id = ids[0][0]
+        # Swipes are predicted one report at a time
+        if any(r.is_predicting(r.touch_states[touch_id]) for r in axes):
+            return None
+        return touch_id
+
+    def pressure_threshold(self) -> int:
+        return self.scalar.rs[0].pressure_threshold
+
+    def step(self, remote: SiriRemote, touches: list[Touch]) -> None:
+        self.scalar.touches(remote, touches)
+
+    def moves(self, remote: SiriRemote, window: Window, start: int, end: int) -> None:
+        mm_per_unit = remote.profile.touchpad.MM_PER_UNIT
+        coordinates = (window.x, window.y)
+        touch_id = int(window.id[start])
+        while start < end:
+            # The first move that goes past the threshold of an axis, from where that axis last
+            # detected. Axes are checked in order, as the scalar recognizer does.
+            axes = self.axes()
+            distances = []
+            first = end
+            for r in axes:
+                last = r.touch_states[touch_id].last_active_touch
+                last_coordinate = (last.x, last.y)[r.axis]
+                d = (coordinates[r.axis][start:end] - last_coordinate) * mm_per_unit[r.axis]
+                over = np.abs(d) > r.distance_threshold_mm
+                if over.any():
+                    first = min(first, start + int(over.argmax()))
+                distances.append(d)
+            if first == end:
+                return
+            for r, d in zip(axes, distances):
+                distance = float(d[first - start])
+                if abs(distance) > r.distance_threshold_mm:
+                    break
+            touch = window.touch(first)
+            r.touch_states[touch_id].last_active_touch = touch
+            xy = [0, 0]
+            xy[r.axis] = int(distance / r.distance_threshold_mm)
+            self.scalar.primary_axis = r.axis
+            event = SwipeEvent(EventType.Running | EventType.Detected, tuple(xy)) # type: ignore[arg-type]
+            self.callback(self, event)
+            start = first + 1
+
+class BatchTapRecognizer(BatchRecognizer):
+    def __init__(self, num_fingers: int, callback: Callable[..., Any]) -> None:
+        super().__init__(callback)
+        self.scalar = gestures.TapRecognizer(num_fingers, self.scalar_callback, self.clock)
+
+    def reset(self) -> None:
+        self.scalar.reset()
+
+    def active_touch_id(self) -> int | None:
+        if self.scalar.num_fingers != 1 or len(self.scalar.touch_states) != 1:
+            return None
+        return next(iter(self.scalar.touch_states))
+
+    def pressure_threshold(self) -> int:
+        return self.scalar.pressure_threshold
+
+    def step(self, remote: SiriRemote, touches: list[Touch]) -> None:
+        self.scalar.touches(remote, touches)
+
+    def moves(self, remote: SiriRemote, window: Window, start: int, end: int) -> None:
+        # A tap only cares where a touch ends up
+        touch_state = self.scalar.touch_states[int(window.id[start])]
+        touch_state.last_active_touch = window.touch(end - 1)
+
+class BatchMultiTapRecognizer(BatchTapRecognizer):
+    def __init__(self, num_fingers: int, num_taps: int, callback: Callable[..., Any]) -> None:
+        BatchRecognizer.__init__(self, callback)
+        self.multitap = gestures.MultiTapRecognizer(num_fingers, num_taps, self.scalar_callback,
+                                                    self.clock)
+        self.scalar = self.multitap.tap_recognizer
+
+    def reset(self) -> None:
+        self.multitap.reset()
+
+    def step(self, remote: SiriRemote, touches: list[Touch]) -> None:
+        self.multitap.touches(remote, touches)
+
+class BatchDPadEmulator(gestures.DPadEmulator):
+    def reports(self, remote: SiriRemote, reports: Sequence[Report]) -> None:
+        # Only the last touch before a button matters
+        for _, touches in reversed(reports):
+            if touches:
+                self.last_touch = touches[0]
+                return
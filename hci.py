@@ -0,0 +1,85 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+from __future__ import annotations
+
+import tools
+
+log = tools.logger(__name__)
+
+from typing import Any
+import fcntl, socket, struct
+
+import att
+
+# Updates the parameters of LE connections with raw HCI commands. As the central, the hub can
+# change the connection interval, and peripheral latency, of a remote at any time.
+
+HCIGETCONNINFO = 0x800448d5 # _IOR('H', 213, int)
+LE_LINK = 0x80
+HCI_COMMAND_PKT = 0x01
+OGF_LE_CTL = 0x08
+OCF_LE_CONN_UPDATE = 0x0013
+
+class ConnectionParameters:
+    def __init__(self, interval_ms: float, latency: int, timeout_ms: int) -> None:
+        self.interval_ms = interval_ms
+        self.latency = latency
+        self.timeout_ms = timeout_ms
+
+    @classmethod
+    def from_config(cls, cfg: dict[str, Any]) -> ConnectionParameters:
+        return ConnectionParameters(cfg['interval_ms'], cfg['latency'], cfg['timeout_ms'])
+
+    def command(self, handle: int) -> bytes:
+        # Intervals are in 1.25ms units, and the supervision timeout is in 10ms units
+        interval = round(self.interval_ms / 1.25)
+        params = struct.pack('<HHHHHHH', handle, interval, interval, self.latency,
+                             self.timeout_ms // 10, 0, 0)
+        opcode = (OGF_LE_CTL << 10) | OCF_LE_CONN_UPDATE
+        return struct.pack('<BHB', HCI_COMMAND_PKT, opcode, len(params)) + params
+
+    def __str__(self) -> str:
+        return f'interval {self.interval_ms}ms latency {self.latency} timeout {self.timeout_ms}ms'
+
+class Hci:
+    def __init__(self, dev_id: int = 0) -> None:
+        self.dev_id = dev_id
+        self.sock: socket.socket | None = None
+        self.failed = False
+
+    def open(self) -> socket.socket | None:
+        if self.sock is None and not self.failed:
+            try:
+                sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_RAW, socket.BTPROTO_HCI)
+                try:
+                    sock.bind((self.dev_id,))
+                except OSError:
+                    sock.close()
+                    raise
+                self.sock = sock
+            except OSError as e:
+                # Most likely missing CAP_NET_RAW. Don't try again.
+                log.info(f'Failed to open HCI device {self.dev_id} {e}')
+                self.failed = True
+        return self.sock
+
+    def connection_handle(self, sock: socket.socket, mac: str) -> int:
+        # struct hci_conn_info_req, followed by a struct hci_conn_info, which is 4 byte aligned
+        req = bytearray(att.bdaddr(mac) + bytes([LE_LINK]) + bytes(17))
+        fcntl.ioctl(sock.fileno(), HCIGETCONNINFO, req)
+        handle, = struct.unpack_from('<H', req, 8)
+        return handle
+
+    def update_connection(self, mac: str, params: ConnectionParameters) -> None:
+        sock = self.open()
+        if sock is None:
+            return
+        try:
+            sock.send(params.command(self.connection_handle(sock, mac)))
+            log.info(f'Requested {params} for MAC {mac}')
+        except OSError as e:
+            log.info(f'Failed to update connection of MAC {mac} {e}')
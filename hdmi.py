@@ -12,7 +12,7 @@ from typing import Any
 
 from aconfig import config
 import asyncio, pprint, time
-import cec
+import cec, latency
 from cec import DeviceType, Key, Message, PowerStatus
 
 config.default('hdmi.quirks', {})
@@ -159,6 +159,14 @@ class ControllerImpl:
         self.rescan_wait_time_sec = 2 * 60
         self.activities = activities
         self.current_activity = no_activity
+        # Devices that activity transitions have powered on, in the order they were powered on.
+        # After an interrupted transition, this is the partial state from which the next transition
+        # is planned.
+        self.active_devices: dict[str, None] = {}
+        # Each transition takes a new generation. A transition that sees a newer generation at an
+        # operation boundary abandons the rest of its operations.
+        self.transition_generation = 0
+        self.transition_lock = asyncio.Lock()
         self.front_adapter = cec.Adapter(devname=front_dev,
                                          loop=loop,
                                          listen_callback_coro=self.front_listen,
@@ -304,10 +312,10 @@ class ControllerImpl:
             log.info(f'{name:15s} {device.address:6X}   {pretty_physical_address(device.physical_address):10}')
         return devices
 
-    async def rescan_devices(self) -> None:
+    async def rescan_devices(self, force: bool = False) -> None:
         now = time.time()
         delta = now - self.last_device_rescan_time
-        if delta < self.rescan_wait_time_sec:
+        if delta < self.rescan_wait_time_sec and not force:
             time_left = self.rescan_wait_time_sec - delta
             log.info(f'Device rescan is too frequent, {time_left:0.2f}s until allowed')
             return
@@ -333,52 +341,71 @@ class ControllerImpl:
         if index < -1 or index >= len(self.activities):
             log.info(f'Activity index {index} is out of bounds')
             return False
-        ca = self.current_activity
         if index >= 0:
             na = self.activities[index]
-            is_power_off = False
         else:
             na = no_activity
-            is_power_off = True
-        log.info(f'Setting activity {na.name} from activity {ca.name}')
+        return await self.transition(na, is_fix=False)
+
+    async def fix_current_activity(self) -> None:
+        await self.transition(self.current_activity, is_fix=True)
+
+    async def transition(self, na: Activity, is_fix: bool) -> bool:
+        latency.hop('controller')
+        self.transition_generation += 1
+        generation = self.transition_generation
+        async with self.transition_lock:
+            if self.is_superseded(generation, na):
+                return False
+            return await self.apply_activity(na, is_fix, generation)
+
+    def is_superseded(self, generation: int, na: Activity) -> bool:
+        if generation == self.transition_generation:
+            return False
+        log.info(f'Abandoning transition to activity {na.name} for a newer transition')
+        return True
+
+    async def apply_activity(self, na: Activity, is_fix: bool, generation: int) -> bool:
+        ca = self.current_activity
+        is_power_off = na is no_activity
         if na is ca:
-            await self.fix_current_activity()
-            return True
-        current_devices = ca.devices()
-        new_devices = na.devices()
-        for current_device in current_devices:
-            if current_device not in new_devices:
-                device = await self.get_device(current_device, 'STANDBY')
-                if device is None:
-                    continue
+            # Fixing an activity powers on all of its devices, again
+            is_fix = True
+            log.info(f'Fixing activity {ca.name}')
+        else:
+            log.info(f'Setting activity {na.name} from activity {ca.name}')
+        new_devices = [name for name in dict.fromkeys(na.devices()) if name is not None]
+        # A device's state is only recorded once its command is done, as the transition may be
+        # cancelled at any await, and a device that never got its command must get it next time
+        for current_device in list(self.active_devices):
+            if current_device in new_devices:
+                continue
+            if self.is_superseded(generation, na):
+                return False
+            device = await self.get_device(current_device, 'STANDBY')
+            if device is not None:
                 log.info(f'Device {current_device} STANDBY')
                 if is_power_off:
                     await device.power_off()
                 else:
                     await device.standby()
+            self.active_devices.pop(current_device, None)
         for new_device in new_devices:
-            if new_device not in current_devices:
-                device = await self.get_device(new_device, 'POWER ON')
-                if device is None:
-                    continue
+            if new_device in self.active_devices and not is_fix:
+                continue
+            if self.is_superseded(generation, na):
+                return False
+            device = await self.get_device(new_device, 'POWER ON')
+            if device is not None:
                 log.info(f'Device {new_device} POWER ON')
                 await device.power_on()
+            self.active_devices[new_device] = None
+        if self.is_superseded(generation, na):
+            return False
         await self.set_activity_input(na)
         self.current_activity = na
         return True
 
-    async def fix_current_activity(self) -> None:
-        ca = self.current_activity
-        log.info(f'Fixing activity {ca.name}')
-        current_devices = ca.devices()
-        for current_device in current_devices:
-            device = await self.get_device(current_device, 'POWER ON')
-            if device is None:
-                continue
-            log.info(f'Device {current_device} POWER ON')
-            await device.power_on()
-        await self.set_activity_input(ca)
-
     async def set_activity_input(self, activity: Activity) -> None:
         # Setting the stream path is the better way...
         device = await self.get_device(activity.source, 'SET STREAM PATH')
@@ -401,6 +428,10 @@ class ControllerImpl:
         await self.set_activity(-1)
 
     async def force_standby(self) -> None:
+        # Abandon any transition in flight, so it doesn't power devices on again once it finishes
+        self.transition_generation += 1
+        self.active_devices.clear()
+        self.current_activity = no_activity
         await self.front_adapter.broadcast().standby()
         await self.back_adapter.broadcast().standby()
 
@@ -409,9 +440,11 @@ class ControllerImpl:
             device_name = self.current_activity.audio
         else:
             device_name = self.current_activity.source
+        latency.hop('controller')
         device = await self.get_device(device_name, 'PRESS KEY')
         if device is None:
             return False
+        latency.hop('get_device')
         log.info(f'Device {device_name} PRESS KEY 0x{key:02X}')
         await device.press_key(key, repeat)
         return True
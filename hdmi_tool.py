@@ -14,7 +14,7 @@ import argparse, asyncio, glob, logging, sys, yaml
 from collections.abc import Iterator, Sequence
 from typing import Any
 
-import cec, hdmi
+import cec, hdmi, ipc
 from aconfig import config
 
 def all_adapter_devices() -> Iterator[str]:
@@ -47,10 +47,28 @@ def mock_devices() -> list[MockDevice] | None:
         return None
     return devices
 
+async def hub_devices() -> list[MockDevice] | None:
+    # The running hub owns the adapters, so ask it to scan, rather than fighting it for them
+    try:
+        reply = await ipc.request('scan')
+    except (OSError, ipc.ProtocolError, asyncio.TimeoutError) as e:
+        log.info(f'Hub scan failed {e!r}')
+        return None
+    if reply is None:
+        return None
+    if reply['status'] != 'OK':
+        log.info(f'Hub scan failed {reply["status"]}')
+        return None
+    log.info('Using devices scanned by the running hub')
+    adapters = {d['adapter']: MockAdapter(d['adapter']) for d in reply['devices']}
+    return [MockDevice(adapters, d) for d in reply['devices']]
+
 async def scan(args: argparse.Namespace) -> list[Any]:
-    mock = mock_devices()
-    devices: list[Any] = mock if mock is not None else []
-    if mock is None:
+    found = mock_devices()
+    if found is None and not args.nohub:
+        found = await hub_devices()
+    devices: list[Any] = found if found is not None else []
+    if found is None:
         for devname in all_adapter_devices():
             try:
                 adapter = cec.Adapter(devname=devname)
@@ -172,6 +190,8 @@ async def main() -> None:
                             help="don't write recommended activity configuration to config.yaml")
     arg_parser.add_argument('-y', '--yaml', action='store_true',
                             help='YAML output')
+    arg_parser.add_argument('--nohub', action='store_true',
+                            help="scan the adapters directly, even if the hub is running")
     args = arg_parser.parse_args()
 
     if not args.yaml:
@@ -17,6 +17,7 @@ from pyhap.accessory_driver import AccessoryDriver # type: ignore[import-untyped
 from pyhap.const import CATEGORY_TELEVISION # type: ignore[import-untyped]
 
 from hdmi import Key
+import latency
 from messaging import Pipe
 
 from aconfig import config
@@ -159,6 +160,7 @@ class TV(Accessory):
         if self.pipe is None:
             log.info('No pipe')
             return
+        latency.begin('homekit')
         self.pipe.set_activity(i)
 
     def _on_active_identifier_changed(self, value: int) -> None:
@@ -169,6 +171,7 @@ class TV(Accessory):
         if self.pipe is None:
             log.info('No pipe')
             return
+        latency.begin('homekit')
         self.pipe.set_activity(i)
 
     def _on_remote_key(self, value: int) -> None:
@@ -195,6 +198,7 @@ class TV(Accessory):
         if self.pipe is None:
             log.info('No pipe')
             return
+        latency.begin('homekit')
         self.pipe.key_press(key, 1)
 
 
@@ -0,0 +1,70 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+from __future__ import annotations
+
+import tools
+
+log = tools.logger(__name__)
+
+from collections.abc import Callable
+from ctypes import CDLL, get_errno
+import asyncio, os, struct
+
+# Watches a directory with inotify, from the event loop, so no thread is needed
+
+IN_ATTRIB = 0x00000004
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# struct inotify_event, followed by a NUL padded name
+event_header = struct.Struct('iIII')
+
+libc = CDLL(None, use_errno=True)
+
+class Watcher:
+    def __init__(self, path: str, mask: int, callback: Callable[[int, str], None],
+                 loop: asyncio.AbstractEventLoop) -> None:
+        """ Calls back with the mask of each event, and the path of the file it is for """
+        self.path = path
+        self.callback = callback
+        self.loop = loop
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            e = get_errno()
+            raise OSError(e, os.strerror(e))
+        if libc.inotify_add_watch(fd, os.fsencode(path), mask) < 0:
+            e = get_errno()
+            os.close(fd)
+            raise OSError(e, os.strerror(e), path)
+        self.fd: int | None = fd
+        loop.add_reader(fd, self.__read)
+
+    def __read(self) -> None:
+        assert self.fd is not None
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = event_header.unpack_from(data, offset)
+            offset += event_header.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_IGNORED:
+                log.info(f'Stopped watching {self.path}')
+                self.close()
+                return
+            self.callback(mask, os.path.join(self.path, os.fsdecode(name)))
+
+    def close(self) -> None:
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,141 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import tools
+
+log = tools.logger(__name__)
+
+import asyncio, contextlib, json, os, struct
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from aconfig import config
+
+config.default('ipc.path', 'var/run/hub.sock')
+config.default('ipc.timeout_sec', 30)
+
+timeout_sec = config.accessor('ipc.timeout_sec')
+
+# A local control socket into the running hub. Tools and the management UI use it to query and
+# drive the hub, instead of restarting the hub, or fighting it for the HDMI-CEC adapters.
+#
+# A frame is a 4 byte big endian length, followed by that many bytes of UTF-8 JSON. A request is an
+# object with an 'op', and the op's arguments. A reply is an object with a 'status' that is 'OK' on
+# success, or describes the error otherwise.
+
+header = struct.Struct('>I')
+max_frame_len = 1 << 20
+
+class ProtocolError(Exception):
+    pass
+
+async def read_frame(reader: asyncio.StreamReader) -> dict[str, Any] | None:
+    """ Returns the next frame, or None if the peer closed the connection between frames """
+    try:
+        data = await reader.readexactly(header.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ProtocolError('Truncated frame header')
+    length, = header.unpack(data)
+    if length > max_frame_len:
+        raise ProtocolError(f'Frame length {length} is too long')
+    try:
+        data = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise ProtocolError('Truncated frame')
+    try:
+        obj = json.loads(data)
+    except ValueError as e:
+        raise ProtocolError(f'Bad frame {e}')
+    if not isinstance(obj, dict):
+        raise ProtocolError('Frame is not an object')
+    return obj
+
+def write_frame(writer: asyncio.StreamWriter, obj: dict[str, Any]) -> None:
+    data = json.dumps(obj, separators=(',', ':')).encode('utf-8')
+    writer.write(header.pack(len(data)) + data)
+
+OpHandler = Callable[[dict[str, Any]], Awaitable[dict[str, Any]]]
+
+class Server:
+    def __init__(self, path: str | None = None) -> None:
+        self.path: str = path if path is not None else config['ipc.path']
+        self.ops: dict[str, OpHandler] = {}
+        self.server: asyncio.AbstractServer | None = None
+
+    def add_op(self, name: str, handler: OpHandler) -> None:
+        self.ops[name] = handler
+
+    async def start(self) -> None:
+        dir_path = os.path.dirname(self.path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        # Remove a stale socket left behind by a previous run
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.handle_connection, path=self.path)
+        os.chmod(self.path, 0o600)
+        log.info(f'Listening for IPC on {self.path}')
+
+    async def close(self) -> None:
+        if self.server is None:
+            return
+        self.server.close()
+        await self.server.wait_closed()
+        self.server = None
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await read_frame(reader)
+                except ProtocolError as e:
+                    log.info(f'Dropping IPC connection {e}')
+                    break
+                if request is None:
+                    break
+                write_frame(writer, await self.handle_request(request))
+                await writer.drain()
+        except ConnectionError as e:
+            log.info(f'IPC connection error {e}')
+        finally:
+            writer.close()
+
+    async def handle_request(self, request: dict[str, Any]) -> dict[str, Any]:
+        op = request.get('op')
+        handler = self.ops.get(op) if isinstance(op, str) else None
+        if handler is None:
+            return {'status': f'Unknown op {op}'}
+        log.info(f'IPC request {request}')
+        try:
+            reply = await handler(request)
+        except (KeyError, TypeError, ValueError) as e:
+            return {'status': f'Bad {op} request {e!r}'}
+        reply.setdefault('status', 'OK')
+        return reply
+
+async def request(op: str, path: str | None = None, **args: Any) -> dict[str, Any] | None:
+    """ Returns the hub's reply, or None if the hub isn't running """
+    if path is None:
+        path = config['ipc.path']
+    try:
+        reader, writer = await asyncio.open_unix_connection(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+    try:
+        write_frame(writer, {'op': op, **args})
+        await writer.drain()
+        reply = await asyncio.wait_for(read_frame(reader), timeout_sec())
+    finally:
+        writer.close()
+        with contextlib.suppress(ConnectionError):
+            await writer.wait_closed()
+    if reply is None:
+        raise ProtocolError('Hub closed the connection')
+    return reply
@@ -16,7 +16,9 @@ import evdev.ecodes as e
 from evdev import InputDevice, KeyEvent
 
 from aconfig import config
+import bluez
 from hdmi import Key
+import latency
 from messaging import Pipe
 
 config.default('keyboard.required_keys', ((e.KEY_ENTER, e.KEY_SELECT), e.KEY_UP,
@@ -88,21 +90,55 @@ config.default('keyboard.keymap', {
         e.KEY_SPREADSHEET : Key.F3, # Google TV Remote star key
     })
 
+# What holding a key does, once the kernel starts to autorepeat it:
+#   hold: the key stays pressed until it is released, and the hub repeats it, like the Siri remote
+#   pass: every autorepeat is a key press of its own
+#   rate_limit: autorepeats are key presses of their own, at most one every interval_sec
+# In pass and rate_limit, a key press is a single press, so the key can't be long pressed. An
+# unknown policy is taken as hold.
+autorepeat_policies = ('hold', 'pass', 'rate_limit')
+config.default('keyboard.autorepeat.policy', 'hold')
+config.default('keyboard.autorepeat.keys', {}) # Policies by key, i.e. {Key.VOLUME_UP: 'rate_limit'}
+# Roughly how often a TV accepts a repeated CEC key press
+config.default('keyboard.autorepeat.interval_sec', 0.25)
+
 config.default('keyboard.battery.monitor.enable', True)
 config.default('keyboard.battery.monitor.period_sec', 3600)
 
 class Handler:
-    def __init__(self, pipe: Pipe | None) -> None:
+    def __init__(self, pipe: Pipe | None, system: bluez.BlueZ | None = None) -> None:
         self.name = 'Keyboard'
         self.pipe = pipe
+        self.system = system
+        # Battery percentages of the input devices, by MAC
+        self.batteries: dict[str, int] = {}
+        self.remote_mac = config.accessor('remote.mac')
+        self.additional_remotes = config.accessor('remote.additional')
         self.taskit = tools.Tasker('Keyboard')
         self.taskit(self.battery_monitor_task())
+        # Keys that are pressed until they are released, and when each key was last pressed
+        self.held: set[int] = set()
+        self.last_press: dict[int, float] = {}
+        self.autorepeat_policy = self.checked_policy(config['keyboard.autorepeat.policy'],
+                                                     'keyboard.autorepeat.policy')
+        self.autorepeat_keys = {key: self.checked_policy(policy, f'key {key}')
+                                for key, policy in config['keyboard.autorepeat.keys'].items()}
+
+    @staticmethod
+    def checked_policy(policy: str, what: str) -> str:
+        if policy in autorepeat_policies:
+            return policy
+        log.error(f'Unknown autorepeat policy {policy} for {what}. Using hold.')
+        return 'hold'
 
     def wait_on(self) -> set[asyncio.Task[Any]]:
         return self.taskit.tasks
 
     required_keys = config['keyboard.required_keys']
 
+    def probe_key(self) -> str:
+        return repr(self.required_keys)
+
     def probe(self, dev: InputDevice) -> bool:
         caps = dev.capabilities()
         supported_keys = caps.get(e.EV_KEY)
@@ -120,27 +156,65 @@ class Handler:
         return True
 
     keymap = config['keyboard.keymap']
+    autorepeat_interval_sec = config['keyboard.autorepeat.interval_sec']
 
-    async def dispatch_input_event(self, event: evdev.InputEvent) -> None:
+    async def dispatch_input_frame(self, events: list[evdev.InputEvent]) -> None:
+        for event in events:
+            self.dispatch_input_event(event)
+
+    def dispatch_input_event(self, event: evdev.InputEvent) -> None:
         if event.type != e.EV_KEY:
             return
         hkey = self.keymap.get(event.code, None)
         if hkey is None:
             log.debug(f'Unhandled key {event.code:02X}')
             return
-        if event.value == KeyEvent.key_down:
+        policy = self.autorepeat_keys.get(hkey, self.autorepeat_policy)
+        if policy == 'hold':
+            if event.value == KeyEvent.key_hold and hkey in self.held:
+                # The hub is already repeating it
+                return
+            if event.value == KeyEvent.key_up:
+                if hkey not in self.held:
+                    return
+                latency.begin('keyboard')
+                log.info(f'Key release {hkey:02X}')
+                self.held.discard(hkey)
+                if self.pipe:
+                    self.pipe.key_release(hkey)
+                return
+            # Either a key down, or a repeat of a key whose key down was missed, i.e. while the
+            # device was grabbed by someone else
+            latency.begin('keyboard')
             log.info(f'Key press {hkey:02X}')
+            self.held.add(hkey)
             if self.pipe:
                 self.pipe.key_press(hkey)
-        elif event.value == KeyEvent.key_up:
-            log.info(f'Key release {hkey:02X}')
-            if self.pipe:
-                self.pipe.key_release(hkey)
+            return
+
+        if event.value == KeyEvent.key_up:
+            self.last_press.pop(hkey, None)
+            return
+        now = event.timestamp()
+        if event.value == KeyEvent.key_hold and policy == 'rate_limit':
+            last = self.last_press.get(hkey)
+            if last is not None and now - last < self.autorepeat_interval_sec:
+                return
+        self.last_press[hkey] = now
+        latency.begin('keyboard')
+        log.info(f'Key press {hkey:02X}' + (' repeat' if event.value == KeyEvent.key_hold else ''))
+        if self.pipe:
+            self.pipe.key_press(hkey, 1)
 
     async def battery_monitor_task(self) -> None:
         if not config['keyboard.battery.monitor.enable']:
             log.info('Keyboard battery monitoring disabled')
             return
+        if self.system is not None:
+            log.info('Keyboard battery monitoring over D-Bus')
+            await self.system.watch_batteries(self.battery_changed)
+            return
+        # Without D-Bus, fall back to polling bluetoothctl for keyboard.mac
         mac = config['keyboard.mac']
         if mac is None:
             log.info('No keyboard mac. Not monitoring battery')
@@ -170,6 +244,27 @@ class Handler:
                     break
             await asyncio.sleep(period_sec)
 
+    def battery_changed(self, mac: str, percentage: int | None) -> None:
+        # The Siri remotes report their own batteries
+        remotes = [self.remote_mac()]
+        remotes += [entry['mac'] for entry in self.additional_remotes() or []]
+        if mac.upper() in (str(remote).upper() for remote in remotes if remote):
+            return
+        if percentage is None:
+            if self.batteries.pop(mac, None) is None:
+                return
+            log.info(f'Battery of {mac} is gone')
+        else:
+            log.info(f'Battery level of {mac} {percentage}')
+            self.batteries[mac] = percentage
+        if not self.pipe:
+            return
+        # Report the keyboard that most needs charging
+        if self.batteries:
+            self.pipe.battery_state(min(self.batteries.values()), False)
+        else:
+            self.pipe.clear_battery_state()
+
 async def main() -> None:
     import evdev_input
     h = Handler(None)
@@ -0,0 +1,162 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import tools
+
+log = tools.logger(__name__)
+
+import bisect, contextvars, itertools, time
+from collections import deque
+from typing import Any
+
+# Latency tracing follows an input event from its source, hop by hop, to the CEC wire.
+#
+# An input source begins a trace. The trace travels with the code that handles the input in a
+# context variable, which asyncio copies into callbacks and tasks, and which bus events carry
+# across queues. Each hop notes the monotonic time it was reached. The first CEC transmission made
+# on behalf of a trace closes it with the kernel's transmit timestamp, which is taken on the same
+# monotonic clock.
+#
+# Closed traces are summarized in per source histograms, of the total latency, and of the time
+# spent reaching each hop. The most recent closed traces can be exported in Chrome trace format.
+
+bucket_bounds_ms = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+class Trace:
+    __slots__ = ('id', 'source', 'hops', 'closed')
+
+    def __init__(self, id: int, source: str) -> None:
+        self.id = id
+        self.source = source
+        self.hops: list[tuple[str, int]] = [(source, time.monotonic_ns())]
+        self.closed = False
+
+class Histogram:
+    def __init__(self) -> None:
+        self.counts = [0] * (len(bucket_bounds_ms) + 1)
+        self.count = 0
+        self.total_ms: float = 0
+        self.max_ms: float = 0
+
+    def add(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(bucket_bounds_ms, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, p: float) -> float:
+        """ Returns the upper bound of the bucket that holds the p-th percentile """
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(bucket_bounds_ms, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'count': self.count,
+            'mean_ms': self.total_ms / self.count if self.count else 0,
+            'p50_ms': self.percentile(50),
+            'p90_ms': self.percentile(90),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max_ms,
+            'buckets_ms': dict(zip([*bucket_bounds_ms, 'inf'], self.counts)),
+        }
+
+class SourceStats:
+    def __init__(self) -> None:
+        self.total = Histogram()
+        self.hops: dict[str, Histogram] = {}
+
+enabled = False
+current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar('current_trace',
+                                                                            default=None)
+trace_ids = itertools.count(1)
+sources: dict[str, SourceStats] = {}
+recent: deque[Trace] = deque(maxlen=500)
+
+def enable(recent_len: int = 500) -> None:
+    global enabled, recent
+    enabled = True
+    recent = deque(maxlen=recent_len)
+    log.info('Latency tracing enabled')
+
+def begin(source: str) -> None:
+    if not enabled:
+        return
+    current_trace.set(Trace(next(trace_ids), source))
+
+def current() -> Trace | None:
+    if not enabled:
+        return None
+    return current_trace.get()
+
+def attach(trace: Trace | None) -> contextvars.Token[Trace | None] | None:
+    """ Resumes a trace that crossed a queue. Returns a token for detach() """
+    if not enabled:
+        return None
+    return current_trace.set(trace)
+
+def detach(token: contextvars.Token[Trace | None] | None) -> None:
+    if token is not None:
+        current_trace.reset(token)
+
+def hop(name: str) -> None:
+    if not enabled:
+        return
+    trace = current_trace.get()
+    if trace is None or trace.closed:
+        return
+    trace.hops.append((name, time.monotonic_ns()))
+
+def end(tx_ts_ns: int) -> None:
+    """ Closes the current trace with the kernel's CEC transmit timestamp """
+    if not enabled:
+        return
+    trace = current_trace.get()
+    if trace is None or trace.closed:
+        return
+    trace.closed = True
+    if tx_ts_ns <= 0:
+        tx_ts_ns = time.monotonic_ns()
+    trace.hops.append(('wire', tx_ts_ns))
+    stats = sources.get(trace.source)
+    if stats is None:
+        stats = sources[trace.source] = SourceStats()
+    begin_ns = trace.hops[0][1]
+    stats.total.add((tx_ts_ns - begin_ns) / 1e6)
+    for (_, prev_ns), (name, ns) in zip(trace.hops, trace.hops[1:]):
+        histogram = stats.hops.get(name)
+        if histogram is None:
+            histogram = stats.hops[name] = Histogram()
+        histogram.add((ns - prev_ns) / 1e6)
+    recent.append(trace)
+
+def stats() -> dict[str, Any]:
+    return {source: {
+                'total': source_stats.total.stats(),
+                'hops': {name: h.stats() for name, h in source_stats.hops.items()},
+                } for source, source_stats in sources.items()}
+
+def chrome_trace() -> dict[str, Any]:
+    """ Returns the recent closed traces in Chrome trace event format """
+    events: list[dict[str, Any]] = []
+    for trace in recent:
+        for (_, prev_ns), (name, ns) in zip(trace.hops, trace.hops[1:]):
+            events.append({
+                'name': name,
+                'cat': trace.source,
+                'ph': 'X',
+                'ts': prev_ns / 1000,
+                'dur': (ns - prev_ns) / 1000,
+                'pid': 1,
+                'tid': trace.source,
+                'args': {'trace': trace.id},
+            })
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import tools
+
+log = tools.logger('var/log/latency_tool')
+
+import argparse, asyncio, json, logging, sys
+from typing import Any
+
+import ipc
+
+def print_histogram(name: str, stats: dict[str, Any]) -> None:
+    log.info(f'  {name:16s} n={stats["count"]:<6} mean={stats["mean_ms"]:7.2f}ms '
+             f'p50<={stats["p50_ms"]:g}ms p90<={stats["p90_ms"]:g}ms p99<={stats["p99_ms"]:g}ms '
+             f'max={stats["max_ms"]:.2f}ms')
+
+async def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Show input to CEC wire latency of the running hub')
+    arg_parser.add_argument('-c', '--chrome', metavar='PATH',
+                            help='also write the recent traces to PATH in Chrome trace format')
+    args = arg_parser.parse_args()
+    log.addHandler(logging.StreamHandler(sys.stdout))
+
+    reply = await ipc.request('stats')
+    if reply is None:
+        log.info('Hub is not running')
+        return
+    sources = reply['latency']
+    if not sources:
+        log.info('No traces. Is latency.enable set?')
+    for source, stats in sources.items():
+        log.info(f'{source}:')
+        print_histogram('total', stats['total'])
+        for hop, hop_stats in stats['hops'].items():
+            print_histogram(hop, hop_stats)
+
+    if args.chrome:
+        reply = await ipc.request('trace')
+        assert reply is not None
+        with open(args.chrome, 'w') as file:
+            json.dump(reply['trace'], file)
+        log.info(f'Wrote {len(reply["trace"]["traceEvents"])} trace events to {args.chrome}')
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import time
+from collections.abc import Iterable, Sequence
+from typing import Any
+
+# Macros are configured as tuples of keys.
+#
+# A tuple of distinct keys is a chord. It matches when all of its keys are held at the same time,
+# regardless of the order in which they were pressed (i.e. POWER+SELECT, or POWER+UP+RIGHT).
+#
+# A tuple that repeats a key is a sequence. It matches when its keys are pressed one after the
+# other, each within the sequence window of the previous press (i.e. SELECT, SELECT is a double
+# tap of SELECT). While presses may still become a sequence, the hub holds them back, so that the
+# first tap of a double tap doesn't also reach the device. See Hub.defer_key().
+#
+# Macros are compiled once. Every key that appears in a chord is assigned a bit, so the set of held
+# keys reduces to a mask. The first matching chord for a mask is computed once, and cached, so
+# detection is a single dictionary lookup regardless of the number of macros. Sequences are
+# compiled into a trie, and are tracked with one cursor per possible starting press.
+
+class MacroMatcher:
+    def __init__(self, macros: Sequence[Sequence[int]], sequence_window_sec: float = .4) -> None:
+        self.macros = [tuple(int(k) for k in macro) for macro in macros]
+        self.sequence_window_sec = sequence_window_sec
+        self.key_bits: dict[int, int] = {}
+        self.chords: list[tuple[int, int]] = [] # (mask, macro index), in configuration order
+        self.sequences: dict[int, Any] = {}
+        self.chord_cache: dict[int, int | None] = {}
+        self.cursors: list[dict[int, Any]] = []
+        self.last_press_time: float = 0
+        for index, macro in enumerate(self.macros):
+            if len(set(macro)) == len(macro):
+                self.chords.append((self.mask_for_keys(macro, True), index))
+            else:
+                self.add_sequence(macro, index)
+
+    def mask_for_keys(self, keys: Iterable[int], allocate: bool = False) -> int:
+        mask = 0
+        for key in keys:
+            bit = self.key_bits.get(key)
+            if bit is None:
+                if not allocate:
+                    continue
+                bit = 1 << len(self.key_bits)
+                self.key_bits[key] = bit
+            mask |= bit
+        return mask
+
+    def add_sequence(self, macro: tuple[int, ...], index: int) -> None:
+        node = self.sequences
+        for key in macro:
+            node = node.setdefault(key, {})
+        # The first sequence configured for a path wins, just like chords.
+        node.setdefault(None, index)
+
+    def match_chord(self, held_keys: Iterable[int]) -> int | None:
+        mask = self.mask_for_keys(held_keys)
+        try:
+            return self.chord_cache[mask]
+        except KeyError:
+            pass
+        match = None
+        for chord_mask, index in self.chords:
+            if chord_mask & mask == chord_mask:
+                match = index
+                break
+        self.chord_cache[mask] = match
+        return match
+
+    def match_sequence(self, key: int, now: float | None = None) -> int | None:
+        if not self.sequences:
+            return None
+        if now is None:
+            now = time.monotonic()
+        if now - self.last_press_time > self.sequence_window_sec:
+            self.cursors = []
+        self.last_press_time = now
+        match = None
+        cursors = []
+        for node in self.cursors + [self.sequences]:
+            node = node.get(key)
+            if node is None:
+                continue
+            index = node.get(None)
+            if index is not None and (match is None or index < match):
+                match = index
+            cursors.append(node)
+        if match is not None:
+            self.cursors = []
+        else:
+            self.cursors = cursors
+        return match
+
+    def reset(self) -> None:
+        self.cursors = []
+
+    def is_pending(self) -> bool:
+        """ Whether the presses so far may still become a sequence """
+        return bool(self.cursors)
+
+    def is_chord_key(self, key: int) -> bool:
+        return key in self.key_bits
+
+    def match(self, key: int, held_keys: Iterable[int], now: float | None = None) -> int | None:
+        """ Returns the index of the macro matched by pressing key while held_keys are held """
+        sequence_index = self.match_sequence(key, now)
+        chord_index = self.match_chord(held_keys)
+        if sequence_index is None:
+            return chord_index
+        if chord_index is None:
+            return sequence_index
+        return min(sequence_index, chord_index)
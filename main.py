@@ -20,14 +20,17 @@ else:
 log = tools.logger(log_name)
 
 import asyncio, pprint, signal, time, traceback
+from collections.abc import Callable, Coroutine
 from types import FrameType
 from typing import Any
 
 from aconfig import config, ConfigWatcher
-import remote, remote_adapter
+import bluez, remote, remote_adapter
 import hdmi
+import hci, ipc, latency
 from hdmi import Key
 import homekit
+import macros
 import mqtt
 import evdev_input, keyboard, solarcell
 import memory
@@ -75,6 +78,7 @@ config.default('hub.macros', [
     (Key.F9, ),
     (Key.F10, ),
 ])
+config.default('hub.macro_sequence.window_sec', .4)
 config.default('hub.long_press.duration_sec', .5)
 config.default('hub.long_press.keymap', {
     Key.SELECT : Key.F6,
@@ -93,6 +97,8 @@ config.default('hub.short_press.keymap', {
 })
 config.default('hub.play_pause.mode', 'emulate')
 config.default('keyboard.enable', True)
+config.default('latency.enable', False)
+config.default('latency.recent_traces', 500)
 config.default('memory.monitor.enable', False)
 config.default('memory.monitor.period_sec', 5*60)
 config.default('remote.battery.low_threshold', 10)
@@ -101,32 +107,52 @@ class KeyState:
     def __init__(self, count: int) -> None:
         self.timestamp: float = time.time()
         self.repeat_count: int = count
+        # Set once the press has been acted upon, so the release doesn't act on it again
+        self.handled: bool = False
+        self.long_press_timer: asyncio.TimerHandle | None = None
+
+    def cancel_long_press(self) -> None:
+        if self.long_press_timer is not None:
+            self.long_press_timer.cancel()
+            self.long_press_timer = None
 
 class Hub(remote.RemoteListener):
     # Used to ensure that repeat counted keys use a different KeyState than non-repeat counted
     # keys.
     REPEAT_COUNT_FLAG = 0x8000
+    # Press action index that means standby, rather than an activity
+    STANDBY_INDEX = -1
 
-    def __init__(self, controller: hdmi.ControllerImpl) -> None:
+    def __init__(self, controller: hdmi.ControllerImpl, bus: messaging.Bus | None = None) -> None:
         self.activity_map: dict[int, int] = config['hub.activity_map']
         self.macros: list[tuple[Key]] = config['hub.macros']
+        self.macro_matcher = macros.MacroMatcher(self.macros, config['hub.macro_sequence.window_sec'])
         self.long_press_keymap: dict[int, int] = config['hub.long_press.keymap']
         self.long_press_duration_sec: float = config['hub.long_press.duration_sec']
         self.short_press_keymap: dict[int, int] = config['hub.short_press.keymap']
         self.play_pause_mode: str = config['hub.play_pause.mode']
+        self.battery_low_threshold = config.accessor('remote.battery.low_threshold')
         self.taskit: tools.Tasker = tools.Tasker('Hub')
         self.controller: hdmi.ControllerImpl = controller
         self.key_state: dict[int, KeyState] = {}
+        self.key_holders: dict[int, set[str]] = {}
+        self.batteries: dict[str, tuple[int, bool]] = {}
         self.wait_for_release: bool = False
+        self.bus = bus if bus is not None else messaging.Bus()
         self.pipes: list[messaging.Pipe] = []
         self.in_macro: bool = False
         self.macro_index: int | None = None
         self.macro_executed: bool = False
         self.play_pause_is_playing: bool = False
+        # Presses held back while they may still become a sequence macro
+        self.deferred_keys: list[int] = []
+        self.deferred_timer: asyncio.TimerHandle | None = None
         self.set_wait_for_release()
 
     def set_wait_for_release(self) -> None:
         self.wait_for_release = True
+        self.macro_matcher.reset()
+        self.drop_deferred_keys()
         loop = asyncio.get_running_loop()
         loop.call_later(1, self.auto_clear_wait_for_release)
 
@@ -135,7 +161,50 @@ class Hub(remote.RemoteListener):
 
     def add_pipe(self, pipe: messaging.Pipe) -> None:
         self.pipes.append(pipe)
-        pipe.start_server_task(self)
+        pipe.start_server_task(HubSource(self, pipe.name))
+
+    # Front ends can hold the same key at the same time. The key is pressed when the first
+    # holder presses it, and released when the last holder releases it. A front end can only
+    # release keys that it holds.
+    async def source_press_key(self, source: str, key: int, count: int = 0) -> None:
+        if count > 0:
+            # Counted presses are never released
+            await self.client_press_key(key, count)
+            return
+        holders = self.key_holders.setdefault(int(key), set())
+        if source in holders:
+            return
+        holders.add(source)
+        if len(holders) > 1:
+            log.info(f'Key {key:02X} is already held')
+            return
+        await self.client_press_key(key, count)
+
+    async def source_release_key(self, source: str, key: int) -> None:
+        holders = self.key_holders.get(int(key))
+        if holders is None or source not in holders:
+            log.info(f'Key {key:02X} is not held by {source}')
+            return
+        holders.discard(source)
+        if holders:
+            return
+        del self.key_holders[int(key)]
+        await self.client_release_key(key)
+
+    async def source_battery_state(self, source: str, level: int | None,
+                                   is_charging: bool) -> None:
+        # Report the remote that most needs charging
+        if level is None:
+            if self.batteries.pop(source, None) is None:
+                return
+        else:
+            self.batteries[source] = (level, is_charging)
+        if self.batteries:
+            level, is_charging = min(self.batteries.values())
+        else:
+            # No battery is left to report, so report a full one
+            level, is_charging = 100, False
+        await self.client_battery_state(level, is_charging)
 
     # Duck typed methods for messaging
     async def client_set_activity(self, index: int) -> None:
@@ -171,25 +240,112 @@ class Hub(remote.RemoteListener):
             if count > 0:
                 # Ignore key sequences originating from swipes...
                 self.key_state.pop(key)
+            elif not self.in_macro:
+                self.classify_press(key, state, True)
             return
 
         if not self.in_macro:
-            for macro_index, macro in enumerate(self.macros):
-                key_count = 0
-                for k in macro:
-                    if k in self.key_state:
-                        key_count += 1
-                if key_count == len(macro):
-                    self.in_macro = True
-                    self.macro_index = macro_index
-                    self.macro_executed = False
-                    return
+            macro_index = self.macro_matcher.match(key, self.key_state)
+            if macro_index is not None:
+                # Presses that were held back are part of the macro
+                self.drop_deferred_keys()
+                self.in_macro = True
+                self.macro_index = macro_index
+                self.macro_executed = False
+                fn_key = self.macros[macro_index][-1]
+                fn_state = self.key_state.get(fn_key)
+                if fn_state is not None:
+                    self.classify_press(fn_key, fn_state, False)
+                return
 
         if hkey == Key.POWER:
+            self.flush_deferred_keys()
+            # POWER may be the start of a chord, in which case a long hold is not a long press.
+            if not self.in_macro and not self.macro_matcher.is_chord_key(hkey):
+                self.arm_long_press(key, state, self.controller.fix_current_activity)
             return
 
+        if not self.in_macro and self.macro_matcher.is_pending():
+            self.defer_key(key)
+            return
+        self.flush_deferred_keys()
         self.taskit(self.press_key(key))
 
+    def defer_key(self, key: int) -> None:
+        """ Holds back a press that may start a sequence macro, until the sequence window expires,
+        or a press that can't continue the sequence comes """
+        log.info(f'Deferring key {key:02X} for a sequence')
+        self.deferred_keys.append(key)
+        if self.deferred_timer is not None:
+            self.deferred_timer.cancel()
+        self.deferred_timer = asyncio.get_running_loop().call_later(
+            self.macro_matcher.sequence_window_sec, self.flush_deferred_keys)
+
+    def flush_deferred_keys(self) -> None:
+        """ Presses the keys that were held back. A key that was released meanwhile is a tap. """
+        keys = self.deferred_keys
+        self.drop_deferred_keys()
+        for key in keys:
+            self.taskit(self.press_key(key))
+
+    def drop_deferred_keys(self) -> None:
+        self.deferred_keys = []
+        if self.deferred_timer is not None:
+            self.deferred_timer.cancel()
+            self.deferred_timer = None
+
+    def press_activity(self, key: int, is_long: bool, allow_standby: bool) -> int | None:
+        if is_long:
+            key = self.long_press_keymap.get(key, key)
+        else:
+            key = self.short_press_keymap.get(key, key)
+        if allow_standby and key == Key.POWER:
+            return self.STANDBY_INDEX
+        return self.activity_map.get(key)
+
+    async def run_press_activity(self, index: int | None) -> None:
+        if index == self.STANDBY_INDEX:
+            await self.standby()
+        elif index is not None:
+            await self.set_activity(index)
+
+    def classify_press(self, key: int, state: KeyState, allow_standby: bool) -> None:
+        short_index = self.press_activity(key, False, allow_standby)
+        long_index = self.press_activity(key, True, allow_standby)
+        if short_index == long_index:
+            # A short and a long press do the same thing, so don't wait for the release to find
+            # out which it is.
+            self.mark_press_handled(state)
+            if short_index is not None:
+                log.info(f'Speculative short press key {key:02X}')
+                self.taskit(self.run_press_activity(short_index))
+            return
+        self.arm_long_press(key, state, lambda: self.run_press_activity(long_index))
+
+    def arm_long_press(self, key: int, state: KeyState,
+                       action: Callable[[], Coroutine[Any, Any, Any]]) -> None:
+        # Act on a long press as soon as it is long enough, rather than on release
+        loop = asyncio.get_running_loop()
+        state.cancel_long_press()
+        state.long_press_timer = loop.call_later(self.long_press_duration_sec,
+                                                 self.long_press_elapsed, key, state, action)
+
+    def long_press_elapsed(self, key: int, state: KeyState,
+                           action: Callable[[], Coroutine[Any, Any, Any]]) -> None:
+        state.long_press_timer = None
+        if self.key_state.get(key) is not state or state.handled:
+            return
+        if self.in_macro and self.macro_executed:
+            return
+        log.info(f'Long press key {key:02X} promoted')
+        self.mark_press_handled(state)
+        self.taskit(action())
+
+    def mark_press_handled(self, state: KeyState) -> None:
+        state.handled = True
+        if self.in_macro:
+            self.macro_executed = True
+
     def map_key_press(self, key: int, time_pressed_sec: float) -> int:
         if time_pressed_sec >= self.long_press_duration_sec:
             key = self.long_press_keymap.get(key, key)
@@ -209,33 +365,36 @@ class Hub(remote.RemoteListener):
         if state is None:
             log.info('No state for key?')
             return
+        state.cancel_long_press()
 
+        # Transitions run in tasks of their own, so that later keys aren't held up behind them
         if self.controller.current_activity is hdmi.no_activity:
-            if not self.in_macro:
+            if not self.in_macro and not state.handled:
                 key = self.map_key_press(key, time.time() - state.timestamp)
                 if key == Key.POWER:
-                    await self.standby()
+                    self.taskit(self.standby())
                 else:
                     index = self.activity_map.get(key)
                     if index is not None:
-                        await self.set_activity(index)
+                        self.taskit(self.set_activity(index))
         else:
             if self.in_macro and not self.macro_executed:
                 assert self.macro_index is not None
                 skip = False
                 now = time.time()
                 fn_key = self.macros[self.macro_index][-1]
-                if key == Key.POWER:
+                if fn_key == key:
+                    # The macro's function key has been released
+                    time_pressed_sec = now - state.timestamp
+                elif key == Key.POWER:
                     # The macro's power key has been released
                     fn_state = self.key_state.get(fn_key, None)
                     if fn_state is not None:
+                        fn_state.cancel_long_press()
                         time_pressed_sec = now - fn_state.timestamp
                     else:
                         log.error('Macro state is inconsistent')
                         skip = True
-                elif fn_key == key:
-                    # The macro's function key has been released
-                    time_pressed_sec = now - state.timestamp
                 else:
                     # Some other key has been released
                     skip = True
@@ -244,13 +403,13 @@ class Hub(remote.RemoteListener):
                     key = self.map_key_press(fn_key, time_pressed_sec)
                     index = self.activity_map.get(key)
                     if index is not None:
-                        await self.set_activity(index)
+                        self.taskit(self.set_activity(index))
                     self.macro_executed = True
-            elif not self.in_macro and key == Key.POWER:
+            elif not self.in_macro and key == Key.POWER and not state.handled:
                 if time.time() - state.timestamp >= self.long_press_duration_sec:
-                    await self.controller.fix_current_activity()
+                    self.taskit(self.controller.fix_current_activity())
                 else:
-                    await self.standby()
+                    self.taskit(self.standby())
 
         if not self.key_state:
             self.wait_for_release = False
@@ -259,10 +418,9 @@ class Hub(remote.RemoteListener):
             self.macro_executed = False
 
     async def client_battery_state(self, level: int, is_charging: bool) -> None:
-        is_low = level <= config['remote.battery.low_threshold'] and not is_charging
+        is_low = level <= self.battery_low_threshold() and not is_charging
         log.info(f'Notifying battery state {level} {is_charging} {is_low}')
-        for pipe in self.pipes:
-            pipe.notify_battery_state(level, is_charging, is_low)
+        self.bus.publish(messaging.BatteryNotice(level, is_charging, is_low))
 
     async def standby(self) -> None:
         if self.controller.current_activity is hdmi.no_activity:
@@ -272,15 +430,13 @@ class Hub(remote.RemoteListener):
             await self.controller.standby()
         self.play_pause_is_playing = False
         self.set_wait_for_release()
-        for pipe in self.pipes:
-            pipe.notify_set_activity(-1)
+        self.bus.publish(messaging.ActivityNotice(-1))
 
     async def set_activity(self, index: int) -> bool:
         if not await self.controller.set_activity(index):
             return False
         self.set_wait_for_release()
-        for pipe in self.pipes:
-            pipe.notify_set_activity(index)
+        self.bus.publish(messaging.ActivityNotice(index))
         return True
 
     async def check_release_all_keys(self) -> None:
@@ -319,6 +475,94 @@ class Hub(remote.RemoteListener):
         self.key_state.pop(key, None)
         await self.check_release_all_keys()
 
+class HubSource:
+    """ Serves the hub to one pipe, so the hub knows which front end each key comes from """
+    def __init__(self, hub: Hub, name: str) -> None:
+        self.hub = hub
+        self.name = name
+
+    async def client_set_activity(self, index: int) -> None:
+        await self.hub.client_set_activity(index)
+
+    async def client_press_key(self, key: int, count: int = 0) -> None:
+        await self.hub.source_press_key(self.name, key, count)
+
+    async def client_release_key(self, key: int) -> None:
+        await self.hub.source_release_key(self.name, key)
+
+    async def client_battery_state(self, level: int | None, is_charging: bool) -> None:
+        await self.hub.source_battery_state(self.name, level, is_charging)
+
+# Serves the IPC control socket, so that tools can query and drive the running hub
+class HubControl:
+    def __init__(self, hub: Hub, pipe: messaging.Pipe,
+                 inp: evdev_input.EvdevInput | None = None) -> None:
+        self.hub = hub
+        self.pipe = pipe
+        self.inp = inp
+        self.start_time = time.monotonic()
+        self.server = ipc.Server()
+        for op in ('devices', 'scan', 'set_activity', 'key', 'status', 'stats', 'trace'):
+            self.server.add_op(op, getattr(self, f'op_{op}'))
+
+    async def start(self) -> None:
+        await self.server.start()
+
+    def devices(self) -> list[dict[str, Any]]:
+        return [{
+                'osd_name': device.osd_name,
+                'address': device.address,
+                'physical_address': device.physical_address,
+                'vendor_id': device.dev.vendor_id,
+                'adapter': device.dev.adapter.devname,
+                } for device in self.hub.controller.devices.values()]
+
+    def activity_index(self) -> int:
+        controller = self.hub.controller
+        if controller.current_activity is hdmi.no_activity:
+            return -1
+        return controller.activities.index(controller.current_activity)
+
+    async def op_devices(self, request: dict[str, Any]) -> dict[str, Any]:
+        return {'devices': self.devices()}
+
+    async def op_scan(self, request: dict[str, Any]) -> dict[str, Any]:
+        await self.hub.controller.rescan_devices(force=True)
+        return {'devices': self.devices()}
+
+    async def op_set_activity(self, request: dict[str, Any]) -> dict[str, Any]:
+        index = int(request['index'])
+        if index < -1 or index >= len(self.hub.controller.activities):
+            return {'status': f'Activity index {index} is out of bounds'}
+        latency.begin('ipc')
+        self.pipe.set_activity(index)
+        return {}
+
+    async def op_key(self, request: dict[str, Any]) -> dict[str, Any]:
+        key = int(request['key'])
+        count = max(1, int(request.get('count', 1)))
+        latency.begin('ipc')
+        self.pipe.key_press(key, count)
+        return {}
+
+    async def op_status(self, request: dict[str, Any]) -> dict[str, Any]:
+        return {
+            'activity': self.activity_index(),
+            'activity_name': self.hub.controller.current_activity.name,
+            'activities': [activity.name for activity in self.hub.controller.activities],
+            'held_keys': [int(key) for key in self.hub.key_state],
+            'uptime_sec': time.monotonic() - self.start_time,
+        }
+
+    async def op_stats(self, request: dict[str, Any]) -> dict[str, Any]:
+        stats = {'bus': self.hub.bus.stats(), 'latency': latency.stats()}
+        if self.inp is not None:
+            stats['evdev'] = self.inp.stats()
+        return stats
+
+    async def op_trace(self, request: dict[str, Any]) -> dict[str, Any]:
+        return {'trace': latency.chrome_trace()}
+
 def config_update() -> None:
     log.info('Config was updated. Exiting.')
     tools.die('Config update')
@@ -342,6 +586,9 @@ async def _main() -> None:
     log.info('Runtime activities:')
     log.info(pprint.pformat(activities))
 
+    if config['latency.enable']:
+        latency.enable(config['latency.recent_traces'])
+
     if config['memory.monitor.enable']:
         mem = memory.Monitor(config['memory.monitor.period_sec'])
         mem.start()
@@ -372,16 +619,19 @@ async def _main() -> None:
             await asyncio.sleep(10)
 
 
-    hub = Hub(controller)
+    bus = messaging.Bus()
+    hub = Hub(controller, bus)
 
+    blue: bluez.BlueZ | None = None
     if config['keyboard.enable']:
-        # Wire hub and keyboard
-        kb_pipe = messaging.Pipe()
+        # Wire hub and keyboard. Without D-Bus, the keyboard battery falls back to bluetoothctl
+        kb_pipe = messaging.Pipe(bus, 'keyboard')
         hub.add_pipe(kb_pipe)
-        kb = keyboard.Handler(kb_pipe)
+        blue = await bluez.connect()
+        kb = keyboard.Handler(kb_pipe, blue)
 
         # Wire hub and SolarCell
-        sc_pipe = messaging.Pipe()
+        sc_pipe = messaging.Pipe(bus, 'solarcell')
         hub.add_pipe(sc_pipe)
         sc = solarcell.Handler(sc_pipe)
         inp = evdev_input.EvdevInput([kb, sc], loop)
@@ -390,29 +640,48 @@ async def _main() -> None:
 
     if config['homekit.enable']:
         # Wire hub and HomeKit
-        hk_pipe = messaging.Pipe()
+        hk_pipe = messaging.Pipe(bus, 'homekit')
         hub.add_pipe(hk_pipe)
         hk = homekit.HomeKit(activity_names, loop, hk_pipe)
         await hk.start()
 
     if config['mqtt.enable']:
         # Wire hub and MQTT
-        mqtt_pipe = messaging.Pipe()
+        mqtt_pipe = messaging.Pipe(bus, 'mqtt')
         hub.add_pipe(mqtt_pipe)
         mq = mqtt.MQTT(activity_names, loop, mqtt_pipe)
         await mq.start()
     else:
         mq = None
 
-    mac = config['remote.mac']
-    if mac is not None:
-        # Wire hub and Siri remote
-        sr_pipe = messaging.Pipe()
-        hub.add_pipe(sr_pipe)
-        ra = remote_adapter.Adapter(sr_pipe)
-        wrapper = remote.RemoteListenerAsyncWrapper(loop, ra)
-        log.info(f'Connecting to remote with MAC {mac}')
-        siri = asyncio.to_thread(lambda: remote.SiriRemote(mac, wrapper))
+    # Wire hub and the IPC control socket
+    ipc_pipe = messaging.Pipe(bus, 'ipc')
+    hub.add_pipe(ipc_pipe)
+    control = HubControl(hub, ipc_pipe, inp)
+    await control.start()
+
+    remotes = []
+    if config['remote.mac'] is not None:
+        remotes.append((config['remote.mac'], 'remote'))
+    for entry in config['remote.additional']:
+        remotes.append((entry['mac'], f'remote.{entry.get("name", entry["mac"])}'))
+    if remotes:
+        # Without D-Bus, the remotes fall back to bluetoothctl
+        link = hci.Hci() if config['remote.connection.adaptive'] else None
+        if blue is None:
+            blue = await bluez.connect()
+        manager = remote.RemoteManager(blue, link=link)
+        # Remote connection parameters follow the activity
+        link_pipe = messaging.Pipe(bus, 'remote.link')
+        link_pipe.start_client_task(manager)
+        for mac, name in remotes:
+            # Wire hub and Siri remote. Each remote has its own pipe, so the hub tracks the keys
+            # each one holds, and its own adapter, for its own gesture and battery state.
+            sr_pipe = messaging.Pipe(bus, name)
+            hub.add_pipe(sr_pipe)
+            log.info(f'Connecting to remote {name} with MAC {mac}')
+            manager.add(mac, remote_adapter.Adapter(sr_pipe))
+        siri = manager.run()
     else:
         log.info(f'Siri remote not configured. Must be using a keyboard...')
         siri = None
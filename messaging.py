@@ -1,4 +1,4 @@
-# Copyright 2024.
+# Copyright 2024-2026.
 # This file is part of Amity.
 # Amity is free software: you can redistribute it and/or modify it under the terms of the
 # GNU General Public License as published by the Free Software Foundation, either version 3 of the
@@ -8,101 +8,351 @@ import tools
 
 log = tools.logger(__name__)
 
-import asyncio
+import asyncio, time
+from collections import deque
 from typing import Any, Protocol, runtime_checkable
 
+import latency
+
 from enum import Enum, auto
 
-class Type(Enum):
-    SetActivity = auto()
-    KeyPress = auto()
-    KeyRelease = auto()
-    BatteryState = auto()
+# Front ends and the Hub talk over an in-process event bus. Events are typed, and each subscriber
+# has its own bounded queue, so a slow subscriber can't hold up the publisher or other subscribers.
+
+# Server events are handled in separate lanes, so that one kind of event can't hold up another. A
+# key release must not wait for an activity change that takes seconds, and a burst of battery
+# updates must not delay keys.
+class Lane(Enum):
+    Activity = auto()
+    Key = auto()
+    Telemetry = auto()
+    Notification = auto()
+
+class Event:
+    __slots__ = ('source', 'time', 'trace')
+    lane: Lane
+    # A mergeable event replaces an older queued event of the same type, instead of queueing
+    # behind it. Only the newest matters.
+    merge = False
+    # When a subscriber's queue is full, its oldest droppable event is dropped. Events that aren't
+    # droppable are queued past the limit, so that i.e. a key release is never lost.
+    droppable = False
+
+    def __init__(self) -> None:
+        self.source: Any = None
+        self.time: float = 0
+        self.trace: latency.Trace | None = None
+
+    def __repr__(self) -> str:
+        values = ' '.join(f'{k}={getattr(self, k)}' for k in self.__slots__)
+        return f'{type(self).__name__}({values})'
+
+class SetActivity(Event):
+    __slots__ = ('index', )
+    lane = Lane.Activity
+    merge = True
+
+    def __init__(self, index: int) -> None:
+        super().__init__()
+        self.index = index
+
+    async def dispatch(self, handler: 'ServerHandler') -> None:
+        await handler.client_set_activity(self.index)
+
+class KeyPress(Event):
+    __slots__ = ('key', 'count')
+    lane = Lane.Key
+
+    def __init__(self, key: int, count: int = 0) -> None:
+        super().__init__()
+        self.key = key
+        self.count = count
+
+    async def dispatch(self, handler: 'ServerHandler') -> None:
+        await handler.client_press_key(self.key, self.count)
+
+class KeyRelease(Event):
+    __slots__ = ('key', )
+    lane = Lane.Key
 
-class Message:
-    def __init__(self, type: Type, *values: Any) -> None:
-        self.type = type
-        self.values = values
+    def __init__(self, key: int) -> None:
+        super().__init__()
+        self.key = key
+
+    async def dispatch(self, handler: 'ServerHandler') -> None:
+        await handler.client_release_key(self.key)
+
+class BatteryState(Event):
+    __slots__ = ('level', 'is_charging')
+    lane = Lane.Telemetry
+    merge = True
+    droppable = True
+
+    # A level of None clears the source's battery, i.e. when its last device goes away
+    def __init__(self, level: int | None, is_charging: bool) -> None:
+        super().__init__()
+        self.level = level
+        self.is_charging = is_charging
+
+    async def dispatch(self, handler: 'ServerHandler') -> None:
+        await handler.client_battery_state(self.level, self.is_charging)
+
+class ActivityNotice(Event):
+    __slots__ = ('index', )
+    lane = Lane.Notification
+    merge = True
+    droppable = True
+
+    def __init__(self, index: int) -> None:
+        super().__init__()
+        self.index = index
+
+    async def dispatch(self, handler: 'ClientHandler') -> None:
+        await handler.server_notify_set_activity(self.index)
+
+class BatteryNotice(Event):
+    __slots__ = ('level', 'is_charging', 'is_low')
+    lane = Lane.Notification
+    merge = True
+    droppable = True
+
+    def __init__(self, level: int, is_charging: bool, is_low: bool) -> None:
+        super().__init__()
+        self.level = level
+        self.is_charging = is_charging
+        self.is_low = is_low
+
+    async def dispatch(self, handler: 'ClientHandler') -> None:
+        await handler.server_notify_battery_state(self.level, self.is_charging, self.is_low)
+
+server_event_types: dict[Lane, tuple[type[Event], ...]] = {
+    Lane.Activity: (SetActivity, ),
+    Lane.Key: (KeyPress, KeyRelease),
+    Lane.Telemetry: (BatteryState, ),
+}
+notification_event_types = (ActivityNotice, BatteryNotice)
 
 @runtime_checkable
 class ServerHandler(Protocol):
     async def client_set_activity(self, index: int) -> None: ...
     async def client_press_key(self, key: int, count: int = 0) -> None: ...
     async def client_release_key(self, key: int) -> None: ...
-    async def client_battery_state(self, level: int, is_charging: bool) -> None: ...
+    async def client_battery_state(self, level: int | None, is_charging: bool) -> None: ...
 
 @runtime_checkable
 class ClientHandler(Protocol):
     async def server_notify_set_activity(self, index: int) -> None: ...
     async def server_notify_battery_state(self, level: int, is_charging: bool, is_low: bool) -> None: ...
 
-# A trivial object for connecting the Hub and UI indirectly with duck typing.
-class Pipe:
+class Subscription:
+    def __init__(self, bus: 'Bus', name: str, max_len: int) -> None:
+        self.bus = bus
+        self.name = name
+        self.max_len = max_len
+        self.q: deque[Event] = deque()
+        self.waiter: asyncio.Future[None] | None = None
+        self.delivered = 0
+        self.merged = 0
+        self.dropped = 0
+        self.overflowed = 0
+        self.total_lag_sec: float = 0
+        self.max_lag_sec: float = 0
+
+    def put(self, event: Event) -> None:
+        if event.merge:
+            for i, queued in enumerate(self.q):
+                if type(queued) is type(event):
+                    self.q[i] = event
+                    self.merged += 1
+                    return
+        if len(self.q) >= self.max_len:
+            for i, queued in enumerate(self.q):
+                if queued.droppable:
+                    del self.q[i]
+                    self.dropped += 1
+                    log.info(f'Subscriber {self.name} is full, dropping {queued}')
+                    break
+            else:
+                self.overflowed += 1
+                log.info(f'Subscriber {self.name} is full, queueing {event} anyway')
+        self.q.append(event)
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def empty(self) -> bool:
+        return not self.q
+
+    def get_nowait(self) -> Event:
+        event = self.q.popleft()
+        lag = time.monotonic() - event.time
+        self.delivered += 1
+        self.total_lag_sec += lag
+        if lag > self.max_lag_sec:
+            self.max_lag_sec = lag
+        return event
+
+    async def get(self) -> Event:
+        while not self.q:
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+        return self.get_nowait()
+
+    def close(self) -> None:
+        self.bus.unsubscribe(self)
+
+    def stats(self) -> dict[str, Any]:
+        mean_lag_sec = self.total_lag_sec / self.delivered if self.delivered else 0
+        return {
+            'queued': len(self.q),
+            'delivered': self.delivered,
+            'merged': self.merged,
+            'dropped': self.dropped,
+            'overflowed': self.overflowed,
+            'mean_lag_sec': mean_lag_sec,
+            'max_lag_sec': self.max_lag_sec,
+        }
+
+class Bus:
     def __init__(self) -> None:
-        self.server_q: asyncio.Queue[Message] = asyncio.Queue()
-        self.client_q: asyncio.Queue[Message] = asyncio.Queue()
+        # Subscriptions are routed by (event type, source). A source of None receives events from
+        # all sources.
+        self.routes: dict[tuple[type[Event], Any], list[Subscription]] = {}
+        self.subscriptions: list[Subscription] = []
+
+    def subscribe(self, name: str, types: tuple[type[Event], ...], source: Any = None,
+                  max_len: int = 256) -> Subscription:
+        sub = Subscription(self, name, max_len)
+        for event_type in types:
+            self.routes.setdefault((event_type, source), []).append(sub)
+        self.subscriptions.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        for subs in self.routes.values():
+            if sub in subs:
+                subs.remove(sub)
+        if sub in self.subscriptions:
+            self.subscriptions.remove(sub)
+
+    def publish(self, event: Event, source: Any = None) -> None:
+        event.source = source
+        event.time = time.monotonic()
+        event.trace = latency.current()
+        latency.hop('publish')
+        event_type = type(event)
+        for sub in self.routes.get((event_type, None), ()):
+            sub.put(event)
+        if source is not None:
+            for sub in self.routes.get((event_type, source), ()):
+                sub.put(event)
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        return {sub.name: sub.stats() for sub in self.subscriptions}
+
+# A front end's endpoint on the bus. The Hub serves each pipe in its own lanes, so that one front
+# end can't hold up another.
+class Pipe:
+    count = 0
+
+    def __init__(self, bus: Bus | None = None, name: str | None = None) -> None:
+        if bus is None:
+            bus = Bus()
+        if name is None:
+            Pipe.count += 1
+            name = f'pipe{Pipe.count}'
+        self.bus = bus
+        self.name = name
+        self.server_subs: dict[Lane, Subscription] = {}
+        self.client_sub: Subscription | None = None
         self.server_t: asyncio.Task[None] | None = None
         self.client_t: asyncio.Task[None] | None = None
         self.taskit = tools.Tasker('Messaging')
 
     # Server calls
-    def notify_set_activity(self, index: int) -> None:
-        if self.client_t:
-            self.taskit(self.client_q.put(Message(Type.SetActivity, index)))
-
-    def notify_battery_state(self, level: int, is_charging: bool, is_low: bool) -> None:
-        if self.client_t:
-            self.taskit(self.client_q.put(Message(Type.BatteryState, level, is_charging, is_low)))
-
     def start_server_task(self, handler: ServerHandler) -> None:
+        # Subscribe now, so that no event published before the task first runs is lost
+        for lane, types in server_event_types.items():
+            self.server_subs[lane] = self.bus.subscribe(f'{self.name}.{lane.name.lower()}',
+                                                        types, source=self)
         self.server_t = self.taskit(self.server_task(handler))
 
     # Server handler
     async def server_task(self, handler: ServerHandler) -> None:
+        try:
+            await asyncio.gather(self.activity_lane_task(handler),
+                                 self.lane_task(handler, self.server_subs[Lane.Key]),
+                                 self.lane_task(handler, self.server_subs[Lane.Telemetry]))
+        finally:
+            for sub in self.server_subs.values():
+                sub.close()
+
+    async def dispatch(self, handler: Any, event: Any) -> None:
+        token = latency.attach(event.trace)
+        latency.hop('dispatch')
+        try:
+            await event.dispatch(handler)
+        except AttributeError as e:
+            log.debug(e)
+        finally:
+            latency.detach(token)
+
+    async def activity_lane_task(self, handler: ServerHandler) -> None:
+        # Only the newest activity request matters. A request that arrives while an older one is
+        # still in flight cancels the older one, instead of queueing behind it.
+        sub = self.server_subs[Lane.Activity]
         while True:
-            try:
-                msg = await self.server_q.get()
-                match msg.type:
-                    case Type.SetActivity:
-                        await handler.client_set_activity(*msg.values)  # type: ignore[arg-type]
-                    case Type.KeyPress:
-                        await handler.client_press_key(*msg.values)  # type: ignore[arg-type]
-                    case Type.KeyRelease:
-                        await handler.client_release_key(*msg.values)  # type: ignore[arg-type]
-                    case Type.BatteryState:
-                        await handler.client_battery_state(*msg.values)  # type: ignore[arg-type]
-            except AttributeError as e:
-                log.debug(e)
+            event = await sub.get()
+            while True:
+                transition = asyncio.create_task(self.dispatch(handler, event))
+                getter = asyncio.create_task(sub.get())
+                done, _ = await asyncio.wait((transition, getter),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                    transition.result()
+                    break
+                event = getter.result()
+                if not transition.done():
+                    log.info('Newer activity request, cancelling in-flight activity change')
+                    transition.cancel()
+                    await asyncio.wait((transition, ))
+                if not transition.cancelled():
+                    transition.result()
+
+    async def lane_task(self, handler: Any, sub: Subscription) -> None:
+        # Events are handled strictly in order, and mergeable events are merged while queued
+        while True:
+            event = await sub.get()
+            await self.dispatch(handler, event)
 
     # Client calls
     def set_activity(self, index: int) -> None:
-        if self.server_t:
-            self.taskit(self.server_q.put(Message(Type.SetActivity, index)))
+        self.bus.publish(SetActivity(index), self)
 
     def key_press(self, key: int, count: int = 0) -> None:
-        if self.server_t:
-            self.taskit(self.server_q.put(Message(Type.KeyPress, key, count)))
+        self.bus.publish(KeyPress(key, count), self)
 
     def key_release(self, key: int) -> None:
-        if self.server_t:
-            self.taskit(self.server_q.put(Message(Type.KeyRelease, key)))
+        self.bus.publish(KeyRelease(key), self)
 
     def battery_state(self, level: int, is_charging: bool) -> None:
-        if self.server_t:
-            self.taskit(self.server_q.put(Message(Type.BatteryState, level, is_charging)))
+        self.bus.publish(BatteryState(level, is_charging), self)
+
+    def clear_battery_state(self) -> None:
+        self.bus.publish(BatteryState(None, False), self)
 
     # Client handler
     def start_client_task(self, handler: ClientHandler) -> None:
+        self.client_sub = self.bus.subscribe(f'{self.name}.{Lane.Notification.name.lower()}',
+                                             notification_event_types)
         self.client_t = self.taskit(self.client_task(handler))
 
     async def client_task(self, handler: ClientHandler) -> None:
-        while True:
-            try:
-                msg = await self.client_q.get()
-                match msg.type:
-                    case Type.SetActivity:
-                        await handler.server_notify_set_activity(*msg.values)  # type: ignore[arg-type]
-                    case Type.BatteryState:
-                        await handler.server_notify_battery_state(*msg.values)  # type: ignore[arg-type]
-            except AttributeError as e:
-                log.debug(e)
+        assert self.client_sub is not None
+        try:
+            await self.lane_task(handler, self.client_sub)
+        finally:
+            self.client_sub.close()
@@ -0,0 +1,212 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+from __future__ import annotations
+
+import tools
+
+log = tools.logger(__name__)
+
+from collections import deque
+from collections.abc import Callable
+import asyncio, time
+
+from aconfig import config
+from remote import MotionEvent, SiriRemote
+
+# Turns the gyro of gen 1 remotes into key presses.
+#
+# Samples are scaled to degrees per second, have the gyro's drift removed, and are smoothed. A
+# rotation is the run of samples while the remote turns faster than moving_dps. A short, fast
+# rotation is a flick, and a slower rotation through a large enough angle is a tilt. Gestures are
+# named by their kind, direction and gyro axis, i.e. 'flick +z' or 'tilt -x'. The signs depend on
+# how the remote is held, so use motion_tool.py on recordings to find them, and to tune the
+# thresholds.
+#
+# Motion is only streamed when gestures are mapped to keys, and for idle_sec after the last button
+# or touch, so a remote that is lying around doesn't use the radio for it.
+
+config.default('remote.motion.keymap', {}) # i.e. {'flick +z': Key.LEFT, 'flick -z': Key.RIGHT}
+config.default('remote.motion.idle_sec', 10)
+# The gen 1 gyro is assumed to be 16 bit, at +/-2000 degrees per second
+config.default('remote.motion.gyro_dps_per_unit', 2000 / 32768)
+config.default('remote.motion.smoothing', 0.5) # Weight of each new sample
+config.default('remote.motion.buffer_samples', 32)
+# The remote is still, and the gyro drift can be learnt, while the buffer spans less than this
+config.default('remote.motion.still_dps', 3)
+config.default('remote.motion.drift_rate', 0.05)
+# A steady rate above this is a slow rotation, rather than drift
+config.default('remote.motion.max_drift_dps', 10)
+config.default('remote.motion.moving_dps', 20)
+config.default('remote.motion.flick.min_dps', 200)
+config.default('remote.motion.flick.max_sec', 0.3)
+config.default('remote.motion.tilt.min_deg', 25)
+
+AXES = 'xyz'
+
+Rates = tuple[float, float, float]
+
+class MotionFilter:
+    def __init__(self) -> None:
+        self.dps_per_unit: float = config['remote.motion.gyro_dps_per_unit']
+        self.smoothing: float = config['remote.motion.smoothing']
+        self.still_dps: float = config['remote.motion.still_dps']
+        self.drift_rate: float = config['remote.motion.drift_rate']
+        self.max_drift_dps: float = config['remote.motion.max_drift_dps']
+        # A ring buffer of the latest samples, in degrees per second
+        self.samples: deque[Rates] = deque(maxlen=config['remote.motion.buffer_samples'])
+        self.drift = [0.0, 0.0, 0.0]
+        self.smoothed: list[float] | None = None
+
+    def is_still(self) -> bool:
+        if len(self.samples) != self.samples.maxlen:
+            return False
+        for axis in range(3):
+            values = [s[axis] for s in self.samples]
+            if max(values) - min(values) > self.still_dps:
+                return False
+        return True
+
+    def update(self, motion: MotionEvent) -> Rates:
+        """ Returns the rates of the remote, in degrees per second """
+        k = self.dps_per_unit
+        gyro = motion.gyro
+        rates = (gyro.x * k, gyro.y * k, gyro.z * k)
+        self.samples.append(rates)
+        if self.is_still():
+            # Whatever a still gyro reads is drift
+            means = [sum(s[axis] for s in self.samples) / len(self.samples) for axis in range(3)]
+            if all(abs(mean) <= self.max_drift_dps for mean in means):
+                for axis in range(3):
+                    self.drift[axis] += (means[axis] - self.drift[axis]) * self.drift_rate
+        corrected = [rates[axis] - self.drift[axis] for axis in range(3)]
+        if self.smoothed is None:
+            self.smoothed = corrected
+        else:
+            a = self.smoothing
+            self.smoothed = [s + (c - s) * a for s, c in zip(self.smoothed, corrected)]
+        return self.smoothed[0], self.smoothed[1], self.smoothed[2]
+
+class Rotation:
+    """ A run of samples while the remote was turning """
+    def __init__(self, t: float) -> None:
+        self.start = t
+        self.end = t
+        self.angles = [0.0, 0.0, 0.0] # degrees
+        self.peaks = [0.0, 0.0, 0.0] # degrees per second, signed
+
+    def add(self, t: float, dt: float, rates: Rates) -> None:
+        self.end = t
+        for axis in range(3):
+            self.angles[axis] += rates[axis] * dt
+            if abs(rates[axis]) > abs(self.peaks[axis]):
+                self.peaks[axis] = rates[axis]
+
+    def duration(self) -> float:
+        return self.end - self.start
+
+    def __str__(self) -> str:
+        peaks = ' '.join(f'{p:.0f}' for p in self.peaks)
+        angles = ' '.join(f'{a:.0f}' for a in self.angles)
+        return f'{self.duration() * 1000:.0f}ms peaks {peaks}dps angles {angles}deg'
+
+class MotionRecognizer:
+    def __init__(self, callback: Callable[[str | None, Rotation], None]) -> None:
+        """ The callback gets the name of the gesture, or None if a rotation wasn't one """
+        self.callback = callback
+        self.moving_dps: float = config['remote.motion.moving_dps']
+        self.flick_min_dps: float = config['remote.motion.flick.min_dps']
+        self.flick_max_sec: float = config['remote.motion.flick.max_sec']
+        self.tilt_min_deg: float = config['remote.motion.tilt.min_deg']
+        self.filter = MotionFilter()
+        self.rotation: Rotation | None = None
+        self.last_t: float | None = None
+
+    def update(self, t: float, motion: MotionEvent) -> None:
+        rates = self.filter.update(motion)
+        # Samples can stop when streaming does, so don't integrate across gaps
+        dt = min(t - self.last_t, 0.1) if self.last_t is not None else 0.0
+        self.last_t = t
+        if max(abs(r) for r in rates) >= self.moving_dps:
+            if self.rotation is None:
+                self.rotation = Rotation(t)
+            self.rotation.add(t, dt, rates)
+        elif self.rotation is not None:
+            rotation = self.rotation
+            self.rotation = None
+            self.callback(self.classify(rotation), rotation)
+
+    def classify(self, rotation: Rotation) -> str | None:
+        axis = max(range(3), key=lambda a: abs(rotation.peaks[a]))
+        peak = rotation.peaks[axis]
+        if abs(peak) >= self.flick_min_dps and rotation.duration() <= self.flick_max_sec:
+            return f'flick {"+" if peak > 0 else "-"}{AXES[axis]}'
+        axis = max(range(3), key=lambda a: abs(rotation.angles[a]))
+        angle = rotation.angles[axis]
+        if abs(angle) >= self.tilt_min_deg:
+            return f'tilt {"+" if angle > 0 else "-"}{AXES[axis]}'
+        return None
+
+class MotionPipeline:
+    def __init__(self, callback: Callable[[SiriRemote, str, int], None]) -> None:
+        """ The callback gets the gestures that are mapped to keys, and their keys """
+        self.callback = callback
+        self.keymap: dict[str, int] = config['remote.motion.keymap']
+        self.idle_sec: float = config['remote.motion.idle_sec']
+        self.recognizer = MotionRecognizer(self.rotation_ended)
+        self.remote: SiriRemote | None = None
+        self.streaming = False
+        self.last_input = 0.0
+        self.last_sample = 0.0
+        self.enabled_at = 0.0
+        self.idle_timer: asyncio.TimerHandle | None = None
+
+    def note_input(self, remote: SiriRemote) -> None:
+        """ Streams motion while the remote is in use """
+        if not self.keymap or not remote.has_motion():
+            return
+        now = time.monotonic()
+        self.last_input = now
+        self.remote = remote
+        if self.streaming:
+            # If the remote reconnected, it stopped streaming
+            if now - max(self.last_sample, self.enabled_at) < 1:
+                return
+            log.info('Motion stopped, restarting it')
+        self.enable(remote, True)
+
+    def enable(self, remote: SiriRemote, enable: bool) -> None:
+        log.info(f'{"Starting" if enable else "Stopping"} motion')
+        remote.enable_motion(enable)
+        self.streaming = enable
+        self.enabled_at = time.monotonic()
+        if enable and self.idle_timer is None:
+            self.idle_timer = asyncio.get_running_loop().call_later(self.idle_sec,
+                                                                    self.idle_timer_elapsed)
+
+    def idle_timer_elapsed(self) -> None:
+        # Input in the meantime only moves the deadline, so the timer isn't rescheduled for every
+        # input
+        self.idle_timer = None
+        idle_in_sec = self.last_input + self.idle_sec - time.monotonic()
+        if idle_in_sec > 0:
+            self.idle_timer = asyncio.get_running_loop().call_later(idle_in_sec,
+                                                                    self.idle_timer_elapsed)
+        elif self.streaming and self.remote is not None:
+            self.enable(self.remote, False)
+
+    def motion(self, remote: SiriRemote, motion: MotionEvent) -> None:
+        self.remote = remote
+        self.last_sample = time.monotonic()
+        self.recognizer.update(self.last_sample, motion)
+
+    def rotation_ended(self, gesture: str | None, rotation: Rotation) -> None:
+        if gesture is None:
+            return
+        key = self.keymap.get(gesture)
+        log.info(f'Motion {gesture} {rotation}' + (f' key {key:02X}' if key is not None else ''))
+        if key is not None and self.remote is not None:
+            self.callback(self.remote, gesture, key)
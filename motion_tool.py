@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import tools
+
+log = tools.logger('var/log/motion_tool')
+
+import argparse, asyncio, logging, sys
+
+import motion, recording, remote
+
+class Capture(remote.RemoteListener):
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.samples: list[tuple[float, remote.MotionEvent]] = []
+
+    def event_motion(self, remote: remote.SiriRemote, motion: remote.MotionEvent) -> None:
+        self.samples.append((self.now, motion))
+
+async def load(path: str) -> list[tuple[float, remote.MotionEvent]]:
+    identity, notifications = recording.load(path)
+    capture = Capture()
+    sr = remote.SiriRemote('00:00:00:00:00:00', capture)
+    sr.load_identity(identity)
+    for t, handle, data in notifications:
+        capture.now = t
+        sr.handleNotification(handle, data)
+        await asyncio.sleep(0)
+    return capture.samples
+
+async def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Show the motion gestures in recordings made '
+                                         'with remote.record.dir, to tune remote.motion')
+    arg_parser.add_argument('recordings', nargs='+')
+    arg_parser.add_argument('--moving-dps', type=float, help='remote.motion.moving_dps')
+    arg_parser.add_argument('--flick-dps', type=float, help='remote.motion.flick.min_dps')
+    arg_parser.add_argument('--flick-sec', type=float, help='remote.motion.flick.max_sec')
+    arg_parser.add_argument('--tilt-deg', type=float, help='remote.motion.tilt.min_deg')
+    arg_parser.add_argument('--smoothing', type=float, help='remote.motion.smoothing')
+    args = arg_parser.parse_args()
+    log.addHandler(logging.StreamHandler(sys.stdout))
+
+    for path in args.recordings:
+        samples = await load(path)
+        log.info(f'{path}: {len(samples)} motion samples')
+        if not samples:
+            continue
+        start = samples[0][0]
+
+        def rotation_ended(gesture: str | None, rotation: motion.Rotation) -> None:
+            log.info(f'{rotation.start - start:9.3f} {gesture or "-":10s} {rotation}')
+
+        recognizer = motion.MotionRecognizer(rotation_ended)
+        if args.moving_dps is not None: recognizer.moving_dps = args.moving_dps
+        if args.flick_dps is not None: recognizer.flick_min_dps = args.flick_dps
+        if args.flick_sec is not None: recognizer.flick_max_sec = args.flick_sec
+        if args.tilt_deg is not None: recognizer.tilt_min_deg = args.tilt_deg
+        if args.smoothing is not None: recognizer.filter.smoothing = args.smoothing
+        for t, event in samples:
+            recognizer.update(t, event)
+        drift = ' '.join(f'{d:.2f}' for d in recognizer.filter.drift)
+        log.info(f'Gyro drift {drift}dps')
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -20,6 +20,7 @@ import yaml
 import aiomqtt
 
 from hdmi import Key
+import latency
 from messaging import Pipe
 import mqtt_defaults
 
@@ -362,6 +363,7 @@ class MQTT:
         topic = message.topic.value
         payload = message.payload.decode('utf-8')
         log.info(f'Received command on {topic}: {payload}')
+        latency.begin('mqtt')
 
         try:
             # Handle switch commands (power on/off)
@@ -0,0 +1,74 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+from __future__ import annotations
+
+import tools
+
+log = tools.logger(__name__)
+
+from typing import Any, Protocol, TextIO
+import asyncio, json, os, time
+
+# Records the raw notifications of a remote, and replays them without a radio.
+#
+# A recording is a JSON lines file. The first line is the identity of the remote, in the same form
+# as a GATT cache entry, so a replay decodes exactly as the remote did. Each following line is a
+# notification as [seconds since the recording began, handle, data as hex].
+
+class Recorder:
+    def __init__(self, path: str, identity: dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.file: TextIO | None = open(path, 'w')
+        self.file.write(json.dumps(identity) + '\n')
+        self.start = time.monotonic()
+        log.info(f'Recording remote notifications to {path}')
+
+    def record(self, handle: int, data: bytes) -> None:
+        if self.file is None:
+            return
+        try:
+            self.file.write(f'[{time.monotonic() - self.start:.6f}, {handle}, "{data.hex()}"]\n')
+        except OSError as e:
+            log.info(f'Stopped recording to {self.path} {e}')
+            self.close()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def load(path: str) -> tuple[dict[str, Any], list[tuple[float, int, bytes]]]:
+    with open(path, 'r') as file:
+        identity = json.loads(file.readline())
+        notifications = []
+        for line in file:
+            t, handle, data = json.loads(line)
+            notifications.append((t, handle, bytes.fromhex(data)))
+    return identity, notifications
+
+class Replayable(Protocol):
+    """ See remote.SiriRemote """
+    def load_identity(self, identity: dict[str, Any]) -> None: ...
+    def handleNotification(self, handle: int, data: bytes) -> None: ...
+
+async def replay(remote: Replayable, path: str, speed: float = 1) -> int:
+    """ Replays a recording at speed times the original pace, or as fast as possible if speed is
+    0. Recognizers that use the wall clock, like taps, see compressed time when sped up. Returns
+    the number of notifications replayed. """
+    identity, notifications = load(path)
+    remote.load_identity(identity)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    for t, handle, data in notifications:
+        delay = start + t / speed - loop.time() if speed > 0 else 0
+        # Yield even without a delay, so each notification is handled as if it arrived alone
+        await asyncio.sleep(max(delay, 0))
+        remote.handleNotification(handle, data)
+    # Let pending touches flush
+    await asyncio.sleep(0)
+    return len(notifications)
@@ -0,0 +1,115 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+from __future__ import annotations
+
+import tools
+
+log = tools.logger(__name__)
+
+import asyncio
+
+# Some remotes never say that a key was released. They send the key's event again and again while
+# it is held, and just stop when it is released, so a release can only be told by a timeout.
+#
+# The timeout follows the intervals the remote actually repeats at, so the release comes soon after
+# the last event, but it never exceeds timeout_sec. Many remotes wait longer before their first
+# repeat than between the later ones, so the first interval is learnt on its own, and the timeout
+# follows it until the second event of a hold arrives.
+#
+# If an event of the held key comes after it was released, but within timeout_sec, the release was
+# early. The learnt interval grows to that gap, and the rest of the hold is ignored, as pressing the
+# key again would press it twice.
+#
+# There is only ever one timer. An event while it runs only moves the deadline, and the timer
+# checks it when it elapses, so a held key doesn't cost a timer per event.
+
+class ReleaseByTimeout:
+    def __init__(self, timeout_sec: float, min_timeout_sec: float, interval_factor: float,
+                 interval_rate: float = 0.25) -> None:
+        self.timeout_sec = timeout_sec
+        self.min_timeout_sec = min_timeout_sec
+        # The timeout is this many repeat intervals
+        self.interval_factor = interval_factor
+        self.interval_rate = interval_rate
+        # The learnt intervals before the first repeat, and between the later ones
+        self.first_interval_sec: float | None = None
+        self.interval_sec: float | None = None
+        self.held_key: int | None = None
+        self.last_key: int | None = None
+        self.last_event = 0.0
+        # How many events the latest run of events of last_key has had
+        self.events = 0
+        self.released_early = False
+        self.release_timer: asyncio.TimerHandle | None = None
+
+    def key_pressed(self, key: int) -> None:
+        """ Overridden to press the key """
+
+    def key_released(self, key: int) -> None:
+        """ Overridden to release the key """
+
+    def release_timeout_sec(self) -> float:
+        interval_sec = self.first_interval_sec if self.events <= 1 else self.interval_sec
+        if interval_sec is None:
+            return self.timeout_sec
+        return min(self.timeout_sec, max(self.min_timeout_sec, interval_sec * self.interval_factor))
+
+    def learnt(self, learnt_sec: float | None, interval_sec: float) -> float:
+        if learnt_sec is None:
+            return interval_sec
+        return learnt_sec + (interval_sec - learnt_sec) * self.interval_rate
+
+    def learn_interval(self, interval_sec: float) -> None:
+        if self.events == 2:
+            self.first_interval_sec = self.learnt(self.first_interval_sec, interval_sec)
+        else:
+            self.interval_sec = self.learnt(self.interval_sec, interval_sec)
+
+    def key_event(self, key: int) -> None:
+        """ Handles each event of a key, be it its first, or a repeat """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        gap = now - self.last_event
+        repeat = key == self.last_key and gap < self.timeout_sec
+        self.events = self.events + 1 if repeat else 1
+        self.last_event = now
+        self.last_key = key
+        if repeat and self.held_key == key:
+            self.learn_interval(gap)
+            return
+        if repeat:
+            if not self.released_early:
+                # Released too early, so wait longer from now on
+                log.info(f'Key {key:02X} repeated {gap * 1000:.0f}ms after its release')
+                self.released_early = True
+                if self.events == 2:
+                    self.first_interval_sec = max(self.first_interval_sec or 0, gap)
+                else:
+                    self.interval_sec = max(self.interval_sec or 0, gap)
+            return
+        self.released_early = False
+        if self.held_key is not None:
+            # Straight from one key to another
+            self.key_released(self.held_key)
+        self.held_key = key
+        self.key_pressed(key)
+        if self.release_timer is None:
+            self.release_timer = loop.call_later(self.release_timeout_sec(),
+                                                 self.release_timer_elapsed)
+
+    def release_timer_elapsed(self) -> None:
+        self.release_timer = None
+        if self.held_key is None:
+            return
+        loop = asyncio.get_running_loop()
+        release_in_sec = self.last_event + self.release_timeout_sec() - loop.time()
+        if release_in_sec > 0:
+            self.release_timer = loop.call_later(release_in_sec, self.release_timer_elapsed)
+            return
+        key = self.held_key
+        self.held_key = None
+        self.key_released(key)
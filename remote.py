@@ -12,8 +12,29 @@ import tools
 
 log = tools.logger(__name__)
 
-import asyncio, subprocess, time
-from bluepy3.btle import AssignedNumbers, BTLEConnectError, BTLEException, DefaultDelegate, Peripheral
+from aconfig import config
+import asyncio, math, os, socket, struct, time, yaml
+from collections.abc import Awaitable, Callable
+from typing import Any, Protocol
+
+import att, hci, latency, recording
+from att import AssignedNumbers
+
+config.default('remote.gatt_cache_path', 'var/remote/gatt_cache.yaml')
+config.default('remote.touchpad.pressure_threshold', 20)
+config.default('remote.reconnect.min_delay_sec', 0.5)
+config.default('remote.reconnect.max_delay_sec', 60)
+# Connection parameters for when the remote is in use, and for when it is idle. The hub asks for
+# the fast parameters while touches are in flight, or while an activity runs and the remote was
+# used in the last idle_sec.
+config.default('remote.connection.adaptive', True)
+config.default('remote.connection.fast', {'interval_ms': 15, 'latency': 0, 'timeout_ms': 2000})
+config.default('remote.connection.slow', {'interval_ms': 100, 'latency': 4, 'timeout_ms': 6000})
+config.default('remote.connection.idle_sec', 30)
+# A directory to record the raw notifications of remotes to, for replay. See recording.py
+config.default('remote.record.dir', None)
+# Remotes besides the one at remote.mac, as a list of {'mac': ..., 'name': ...}
+config.default('remote.additional', [])
 
 class PnpInfo:
     @classmethod
@@ -65,17 +86,16 @@ class MotionEvent:
         return f'gyro {self.gyro}'
 
 class Touch:
+    __slots__ = ('remote', 'id', 'timestamp', 'x', 'y', 'p')
+
     def __init__(self, remote: SiriRemote, idtxyp: tuple[int, int, int, int, int]) -> None:
         self.remote = remote
         self.id, self.timestamp, self.x, self.y, self.p = idtxyp
     def axis_distances_from_touch(self, t: Touch) -> tuple[float, float]: # in mm
-        rtp = self.remote.profile.touchpad
-        dx_mm = (self.x - t.x) / rtp.RESOLUTION[rtp.X_AXIS] * rtp.SIZE_MM
-        dy_mm = (self.y - t.y) / rtp.RESOLUTION[rtp.Y_AXIS] * rtp.SIZE_MM
-        return dx_mm, dy_mm
+        mm_per_unit = self.remote.profile.touchpad.MM_PER_UNIT
+        return (self.x - t.x) * mm_per_unit[0], (self.y - t.y) * mm_per_unit[1]
     def distance_from_touch(self, t: Touch) -> float: # in mm
-        dx_mm, dy_mm = self.axis_distances_from_touch(t)
-        return (dx_mm**2 + dy_mm**2)**.5
+        return math.hypot(*self.axis_distances_from_touch(t))
     def velocity_from_touch(self, t: Touch) -> float: # in mm/s
         dt = self.time_from_touch(t)
         if dt == 0: return self.remote.profile.touchpad.SIZE_MM
@@ -98,6 +118,10 @@ class Touch:
     def __repr__(self) -> str:
         return f'({self.id}, {self.timestamp}, {self.x}, {self.y}, {self.p})'
 
+# Touchpad report layouts. See SiriRemote.__handle_touchpad()
+touch_header = struct.Struct('<xH')
+touch_finger = struct.Struct('<HBxxBB')
+
 class RemoteListener:
     def event_battery(self, remote: SiriRemote, percent: int) -> None:
         pass
@@ -117,29 +141,6 @@ class RemoteListener:
     def event_audio(self, remote: SiriRemote, data: bytes) -> None:
         pass
 
-class RemoteListenerAsyncWrapper(RemoteListener):
-    def __init__(self, loop: asyncio.AbstractEventLoop, listener: RemoteListener) -> None:
-        self.loop = loop
-        self.listener = listener
-
-    def event_battery(self, remote: SiriRemote, percent: int) -> None:
-        self.loop.call_soon_threadsafe(self.listener.event_battery, remote, percent)
-
-    def event_power(self, remote: SiriRemote, charging: bool) -> None:
-        self.loop.call_soon_threadsafe(self.listener.event_power, remote, charging)
-
-    def event_button(self, remote: SiriRemote, button: int) -> None:
-        self.loop.call_soon_threadsafe(self.listener.event_button, remote, button)
-
-    def event_touches(self, remote: SiriRemote, touches: list[Touch]) -> None:
-        self.loop.call_soon_threadsafe(self.listener.event_touches, remote, touches)
-
-    def event_motion(self, remote: SiriRemote, motion: MotionEvent) -> None:
-        self.loop.call_soon_threadsafe(self.listener.event_motion, remote, motion)
-
-    def event_audio(self, remote: SiriRemote, data: bytes) -> None:
-        self.loop.call_soon_threadsafe(self.listener.event_audio, remote, data)
-
 class HwRevisions:
     GEN_1   = 0x0266
     GEN_1_5 = 0x026D
@@ -194,6 +195,8 @@ class TouchpadProfile:
             self.RESOLUTION = (1370, 1370)
             self.SIZE_MM = 31 # Diameter of the circular pad
             self.TIMESTAMP_HZ = 2000
+        self.MM_PER_UNIT = (self.SIZE_MM / self.RESOLUTION[self.X_AXIS],
+                            self.SIZE_MM / self.RESOLUTION[self.Y_AXIS])
 
 class Handles:
     def __init__(self, hw_revision: int, fw_revision: int) -> None:
@@ -238,11 +241,89 @@ class RemoteProfile:
         self.buttons = ButtonCodes(hw_revision, fw_revision)
         self.touchpad = TouchpadProfile(hw_revision, fw_revision)
 
-class SiriRemote(DefaultDelegate):
-    def __init__(self, mac: str, listener: RemoteListener) -> None:
+class BluetoothSystem(Protocol):
+    """ The system's Bluetooth stack, as seen by a remote. See bluez.BlueZ """
+    async def disconnect(self, mac: str) -> None: ...
+    async def wait_for_device(self, mac: str, timeout_sec: float) -> None: ...
+
+class LinkControl(Protocol):
+    """ Changes the parameters of the connection to a remote. See hci.Hci """
+    def update_connection(self, mac: str, params: hci.ConnectionParameters) -> None: ...
+
+class BluetoothCtl:
+    """ A fallback for when BlueZ can't be reached over D-Bus """
+    async def disconnect(self, mac: str) -> None:
+        log.info(f'Calling bluetoothctl to disconnect MAC {mac}')
+        try:
+            process = await asyncio.create_subprocess_exec('/usr/bin/bluetoothctl', 'disconnect', mac,
+                                                           stdout=asyncio.subprocess.DEVNULL,
+                                                           stderr=asyncio.subprocess.DEVNULL)
+            await process.wait()
+        except OSError as e:
+            log.info(f'Failed to run bluetoothctl {e}')
+
+    async def wait_for_device(self, mac: str, timeout_sec: float) -> None:
+        await asyncio.sleep(timeout_sec)
+
+class GattCache:
+    """ Remembers the GATT layout of remotes by MAC, so reconnects can skip discovery """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.entries: dict[str, dict[str, Any]] = {}
+        try:
+            with open(path, 'r') as file:
+                entries = yaml.safe_load(file)
+            if isinstance(entries, dict):
+                self.entries = entries
+        except FileNotFoundError:
+            pass
+        except (OSError, yaml.YAMLError) as e:
+            log.info(f'Ignoring GATT cache {path} {e}')
+
+    def get(self, mac: str) -> dict[str, Any] | None:
+        return self.entries.get(mac)
+
+    def put(self, mac: str, entry: dict[str, Any]) -> None:
+        self.entries[mac] = entry
+        self.save()
+
+    def forget(self, mac: str) -> None:
+        if self.entries.pop(mac, None) is not None:
+            self.save()
+
+    def save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as file:
+                yaml.safe_dump(self.entries, file)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.info(f'Failed to save GATT cache {self.path} {e}')
+
+Connect = Callable[[str], Awaitable[socket.socket]]
+
+class SiriRemote:
+    def __init__(self, mac: str, listener: RemoteListener, connect: Connect = att.connect,
+                 gatt_cache: GattCache | None = None, system: BluetoothSystem | None = None,
+                 link: LinkControl | None = None) -> None:
         self.mac = mac
+        self.__link = link
+        self.__fast_params = hci.ConnectionParameters.from_config(config['remote.connection.fast'])
+        self.__slow_params = hci.ConnectionParameters.from_config(config['remote.connection.slow'])
+        self.__idle_sec: float = config['remote.connection.idle_sec']
+        self.__activity_running = False
+        self.__last_input = 0.0
+        self.__link_is_fast: bool | None = None
+        self.__idle_timer: asyncio.TimerHandle | None = None
+        self.__identity: dict[str, Any] | None = None
+        self.__recorder: recording.Recorder | None = None
+        self.__connect = connect
+        self.__system = system if system is not None else BluetoothCtl()
+        self.__gatt_cache = gatt_cache if gatt_cache is not None else GattCache(config['remote.gatt_cache_path'])
         self.__ready = False
         self.__listener = listener
+        self.__client: att.Client | None = None
         self.__device_name: str | None = None
         self.__serial_number: str | None = None
         self.__pnp_info: PnpInfo | None = None
@@ -250,124 +331,279 @@ class SiriRemote(DefaultDelegate):
         self.__hw_revision: int | None = None
         self.__fw_revision: int | None = None
         self.__last_keepalive: float | None = None
+        self.__pressure_threshold: int = config['remote.touchpad.pressure_threshold']
+        self.__touch_origin = (360, 360)
+        self.__touches_down: set[int] = set()
+        self.__pending_touches: list[Touch] | None = None
+        self.__pending_is_move = False
         self.profile = RemoteProfile(HwRevisions.GEN_2, FwRevisions.GEN_2_0x0083)
-        self.__setup()
 
-    def __setup(self) -> None:
+    async def run(self) -> None:
+        """ Connects to the remote, and reconnects whenever the connection is lost. Only returns by
+        raising UnknownRemoteException. """
+        min_delay_sec: float = config['remote.reconnect.min_delay_sec']
+        max_delay_sec: float = config['remote.reconnect.max_delay_sec']
+        delay_sec = min_delay_sec
         while True:
+            was_ready = False
             try:
-                self.__ready = False
-                self.__device = Peripheral()
-                self.__device.withDelegate(self)
                 # The system will often connect on its own to the remote, and stop us from
                 # connecting. So disconnect the remote from the system.
-                log.info(f'Calling bluetoothctl to disconnect MAC {self.mac}')
-                subprocess.run(['/usr/bin/bluetoothctl', 'disconnect', self.mac], capture_output=True)
-                self.__device.connect(self.mac)
-                self.__device.getServices()
-
-                # Need to know HW/FW revisions to work with the different remotes
-                device_info_svc = self.__device.getServiceByUUID(AssignedNumbers.device_information) # type: ignore[attr-defined]
-                for ch in device_info_svc.getCharacteristics():
-                    if ch.uuid == AssignedNumbers.device_name: # type: ignore[attr-defined]
-                        self.__device_name = self.read_characteristic(ch.getHandle()).decode()
-                    elif ch.uuid == AssignedNumbers.serial_number_string: # type: ignore[attr-defined]
-                        self.__serial_number = self.read_characteristic(ch.getHandle()).decode()
-                    elif ch.uuid == AssignedNumbers.hardware_revision_string: # type: ignore[attr-defined]
-                        hwr = self.read_characteristic(ch.getHandle()).decode()
-                    elif ch.uuid == AssignedNumbers.firmware_revision_string: # type: ignore[attr-defined]
-                        fwr = self.read_characteristic(ch.getHandle()).decode()
-                    elif ch.uuid == AssignedNumbers.pnp_id: # type: ignore[attr-defined]
-                        pnp_data = self.read_characteristic(ch.getHandle())
-
-                pnp_info = PnpInfo.WithData(pnp_data)
-                self.__pnp_info = pnp_info
-                product_id = pnp_info.product_id
-
-                #print(f'hw {hwr} fw {fwr} PNP {pnp_info}')
-
-                # Try to parse HW/FW versions strings into meaningful versions
-                # If it fails, raise an exception
+                await self.__system.disconnect(self.mac)
+                self.__client = att.Client(await self.__connect(self.mac), self.handleNotification)
                 try:
-                    # Some(?) gen 1/1.5 remotes have crazy long, meaningless looking, FW strings.
-                    # ATV denotes those as version 0x257
-                    if product_id in (HwRevisions.GEN_1, HwRevisions.GEN_1_5) and len(fwr) > 5:
-                        fwri = FwRevisions.GEN_1_0x257
-                    else:
-                        fwri = int(fwr, 16)
-                except ValueError:
-                    raise UnknownRemoteException(hwr, fwr, pnp_info)
-
-                # hwr seems to be inconsistent compared to the PNP product id,
-                # so use the product id instead. We store hwr strictly for debug.
-                self.__hw_revision = product_id
-                self.__fw_revision = fwri
-                self.__hwr = hwr
-
-                # Negotiate MTU
-                if self.__hw_revision >= HwRevisions.GEN_2:
-                    mtu = 527
-                else:
-                    mtu = 185
-                self.__device.setMTU(mtu)
-
-                self.profile = RemoteProfile(self.__hw_revision, self.__fw_revision)
-                self.__last_button = self.profile.buttons.RELEASED
-                self.__handles = Handles(self.__hw_revision, self.__fw_revision)
-                self.__power_states = PowerStates(self.__hw_revision, self.__fw_revision)
-
-                # Find handles for battery, and power state
-                battery_service = self.__device.getServiceByUUID(AssignedNumbers.battery_service) # type: ignore[attr-defined]
-                for ch in battery_service.getCharacteristics():
-                    config_handle = self.__handles.INVALID
-                    for desc in ch.getDescriptors():
-                        if desc.uuid == AssignedNumbers.client_characteristic_configuration: # type: ignore[attr-defined]
-                            config_handle = desc.handle
-                    log.info(f'Battery service characteristic {ch.uuid} {ch.uuid.getCommonName()} {ch.getHandle():02X} config {config_handle:02X}')
-                    if ch.uuid == AssignedNumbers.battery_level: # type: ignore[attr-defined]
-                        self.__handles.BATTERY = ch.getHandle()
-                        self.__handles.BATTERY_CONFIG = config_handle
-                    elif ch.uuid == AssignedNumbers.battery_level_status: # type: ignore[attr-defined]
-                        self.__handles.POWER = ch.getHandle()
-                        self.__handles.POWER_CONFIG = config_handle
-
-                # Start remote notifications
-                self.enable_notifications(self.__handles.BATTERY_CONFIG)
-                self.enable_notifications(self.__handles.POWER_CONFIG)
-
-                if self.__hw_revision >= HwRevisions.GEN_2:
-                    if self.__fw_revision >= FwRevisions.GEN_2_0x0083:
-                        self.enable_notifications(0x0037)
-                        self.enable_notifications(0x003b)
-                        self.enable_notifications(0x003f)
-                        self.enable_notifications(0x0043)
-                        self.enable_notifications(0x0047)
-                        self.enable_notifications(0x004b)
-                        self.enable_notifications(0x003a)
-                        self.write_characteristic(0x004e, b'\xF0\xBC')  # magic 1
-                        self.write_characteristic(0x004e, b'\xF0\xBB')  # magic 2
-                    else: # Known to work for firmware version 0x0021
-                        self.enable_notifications(0x003a)  # hid service | buttons
-                        self.enable_notifications(0x003e)  # hid service | touch
-                        self.enable_notifications(0x0036)  # hid service | audio
-                        self.write_characteristic(0x004d, b'\xF0\x00')  # magic
-                elif self.__hw_revision in (HwRevisions.GEN_1, HwRevisions.GEN_1_5):
-                    self.enable_notifications(0x0024) # HID
-                    self.write_characteristic(0x001d, b'\xAF') # magic 1
+                    await self.__setup()
+                    self.__start_recording()
+                    self.__ready = was_ready = True
+                    delay_sec = min_delay_sec
+                    self.__update_link()
+                    await self.__client.wait_closed()
+                finally:
+                    self.__ready = False
+                    self.__link_is_fast = None
+                    if self.__idle_timer is not None:
+                        self.__idle_timer.cancel()
+                        self.__idle_timer = None
+                    if self.__recorder is not None:
+                        self.__recorder.close()
+                        self.__recorder = None
+                    self.__client.close()
+            except (OSError, att.AttError) as e:
+                if was_ready:
+                    log.info(f'Lost remote {e}. Will reconnect.')
+                    self.__listener.event_button(self, 0)  # release all keys
                 else:
-                    raise UnknownRemoteException(self.__hwr, self.__fw_revision, self.__pnp_info)
-
-                self.__handle_battery(self.read_characteristic(self.__handles.BATTERY))
-                self.__handle_power(self.read_characteristic(self.__handles.POWER))
+                    log.info(f'Failed to connect to remote {e}. Will retry within {delay_sec}s.')
+            # Back off while the remote is away, but retry as soon as the system hears from it
+            await self.__system.wait_for_device(self.mac, delay_sec)
+            delay_sec = min(delay_sec * 2, max_delay_sec)
+
+    async def __setup(self) -> None:
+        assert self.__client is not None
+        entry = self.__gatt_cache.get(self.mac)
+        if entry is not None:
+            try:
+                if await self.__setup_cached(entry):
+                    self.__identity = entry
+                    return
+                log.info(f'Remote {self.mac} changed. Rediscovering')
+            except att.AttError as e:
+                log.info(f'Cached setup of remote {self.mac} failed {e}. Rediscovering')
+            self.__gatt_cache.forget(self.mac)
+        entry = await self.__discover()
+        await self.__configure(pipelined=False)
+        self.__gatt_cache.put(self.mac, entry)
+        self.__identity = entry
+
+    async def __setup_cached(self, entry: dict[str, Any]) -> bool:
+        """ Sets up the remote with the cached GATT layout. Returns False if the remote is no
+        longer the one that was cached. """
+        # A firmware update may move handles, so verify the identity of the remote first
+        pnp_data = await self.read_characteristic(entry['pnp_handle'])
+        fwr = (await self.read_characteristic(entry['fwr_handle'])).decode()
+        if pnp_data.hex() != entry['pnp'] or fwr != entry['fwr']:
+            return False
+        self.__load_identity(entry, pnp_data)
+        await self.__configure(pipelined=True)
+        return True
+
+    async def __discover(self) -> dict[str, Any]:
+        """ Discovers the GATT layout of the remote, and returns it as a cache entry """
+        assert self.__client is not None
+        services = {service.uuid: service for service in await self.__client.discover()}
+
+        def service(uuid: int) -> att.Service:
+            svc = services.get(uuid)
+            if svc is None:
+                raise ConnectionError(f'Remote has no service 0x{uuid:04X}')
+            return svc
+
+        # Need to know HW/FW revisions to work with the different remotes
+        device_info_svc = service(AssignedNumbers.device_information)
+        for ch in device_info_svc.characteristics:
+            if ch.uuid == AssignedNumbers.device_name:
+                self.__device_name = (await self.read_characteristic(ch.value_handle)).decode()
+            elif ch.uuid == AssignedNumbers.serial_number_string:
+                self.__serial_number = (await self.read_characteristic(ch.value_handle)).decode()
+            elif ch.uuid == AssignedNumbers.hardware_revision_string:
+                hwr = (await self.read_characteristic(ch.value_handle)).decode()
+            elif ch.uuid == AssignedNumbers.firmware_revision_string:
+                fwr_handle = ch.value_handle
+                fwr = (await self.read_characteristic(ch.value_handle)).decode()
+            elif ch.uuid == AssignedNumbers.pnp_id:
+                pnp_handle = ch.value_handle
+                pnp_data = await self.read_characteristic(ch.value_handle)
+
+        self.__identify(hwr, fwr, pnp_data)
+
+        # Find handles for battery, and power state
+        battery_service = service(AssignedNumbers.battery_service)
+        for ch in battery_service.characteristics:
+            config_handle = ch.descriptors.get(AssignedNumbers.client_characteristic_configuration,
+                                               self.__handles.INVALID)
+            log.info(f'Battery service characteristic {ch.uuid:04X} {ch.value_handle:02X} config {config_handle:02X}')
+            if ch.uuid == AssignedNumbers.battery_level:
+                self.__handles.BATTERY = ch.value_handle
+                self.__handles.BATTERY_CONFIG = config_handle
+            elif ch.uuid == AssignedNumbers.battery_level_status:
+                self.__handles.POWER = ch.value_handle
+                self.__handles.POWER_CONFIG = config_handle
+
+        return {
+            'hwr': hwr,
+            'fwr': fwr,
+            'fwr_handle': fwr_handle,
+            'pnp': pnp_data.hex(),
+            'pnp_handle': pnp_handle,
+            'battery': self.__handles.BATTERY,
+            'battery_config': self.__handles.BATTERY_CONFIG,
+            'power': self.__handles.POWER,
+            'power_config': self.__handles.POWER_CONFIG,
+        }
+
+    def __load_identity(self, entry: dict[str, Any], pnp_data: bytes) -> None:
+        self.__identify(entry['hwr'], entry['fwr'], pnp_data)
+        self.__handles.BATTERY = entry['battery']
+        self.__handles.BATTERY_CONFIG = entry['battery_config']
+        self.__handles.POWER = entry['power']
+        self.__handles.POWER_CONFIG = entry['power_config']
+
+    def load_identity(self, identity: dict[str, Any]) -> None:
+        """ Makes this remote decode notifications as the remote with the identity did, without
+        connecting to it. For replays. """
+        self.__load_identity(identity, bytes.fromhex(identity['pnp']))
+        self.__identity = identity
+        self.__ready = True
+
+    def __start_recording(self) -> None:
+        record_dir = config['remote.record.dir']
+        if record_dir is None:
+            return
+        assert self.__identity is not None
+        path = os.path.join(record_dir, f'{self.mac.replace(":", "")}-{time.strftime("%Y%m%d-%H%M%S")}.jsonl')
+        try:
+            self.__recorder = recording.Recorder(path, self.__identity)
+        except OSError as e:
+            log.info(f'Failed to record to {path} {e}')
+
+    def __identify(self, hwr: str, fwr: str, pnp_data: bytes) -> None:
+        pnp_info = PnpInfo.WithData(pnp_data)
+        self.__pnp_info = pnp_info
+        product_id = pnp_info.product_id
+
+        #print(f'hw {hwr} fw {fwr} PNP {pnp_info}')
+
+        # Try to parse HW/FW versions strings into meaningful versions
+        # If it fails, raise an exception
+        try:
+            # Some(?) gen 1/1.5 remotes have crazy long, meaningless looking, FW strings.
+            # ATV denotes those as version 0x257
+            if product_id in (HwRevisions.GEN_1, HwRevisions.GEN_1_5) and len(fwr) > 5:
+                fwri = FwRevisions.GEN_1_0x257
+            else:
+                fwri = int(fwr, 16)
+        except ValueError:
+            raise UnknownRemoteException(hwr, fwr, pnp_info)
+
+        # hwr seems to be inconsistent compared to the PNP product id,
+        # so use the product id instead. We store hwr strictly for debug.
+        self.__hw_revision = product_id
+        self.__fw_revision = fwri
+        self.__hwr = hwr
+
+        self.profile = RemoteProfile(self.__hw_revision, self.__fw_revision)
+        self.__last_button = self.profile.buttons.RELEASED
+        if self.__hw_revision in (HwRevisions.GEN_1, HwRevisions.GEN_1_5):
+            self.__touch_origin = (1000, 230)
+        else: # Gen 2 or greater
+            self.__touch_origin = (360, 360)
+        self.__touches_down = set()
+        self.__pending_touches = None
+        self.__handles = Handles(self.__hw_revision, self.__fw_revision)
+        self.__power_states = PowerStates(self.__hw_revision, self.__fw_revision)
+
+    def __setup_writes(self) -> tuple[list[tuple[int, bytes]], list[tuple[int, bytes]]]:
+        """ Returns the writes that start remote notifications, as the client characteristic
+        configuration writes that enable them, and the vendor writes that follow """
+        assert self.__hw_revision is not None and self.__fw_revision is not None
+        notify = b'\x01\x00'
+        configs = [(self.__handles.BATTERY_CONFIG, notify), (self.__handles.POWER_CONFIG, notify)]
+        magics = []
+        if self.__hw_revision >= HwRevisions.GEN_2:
+            if self.__fw_revision >= FwRevisions.GEN_2_0x0083:
+                configs += [(handle, notify) for handle in (0x0037, 0x003b, 0x003f, 0x0043, 0x0047,
+                                                            0x004b, 0x003a)]
+                magics.append((0x004e, b'\xF0\xBC'))  # magic 1
+                magics.append((0x004e, b'\xF0\xBB'))  # magic 2
+            else: # Known to work for firmware version 0x0021
+                configs.append((0x003a, notify))  # hid service | buttons
+                configs.append((0x003e, notify))  # hid service | touch
+                configs.append((0x0036, notify))  # hid service | audio
+                magics.append((0x004d, b'\xF0\x00'))  # magic
+        elif self.__hw_revision in (HwRevisions.GEN_1, HwRevisions.GEN_1_5):
+            configs.append((0x0024, notify)) # HID
+            magics.append((0x001d, b'\xAF')) # magic 1
+        else:
+            raise UnknownRemoteException(self.__hwr, self.__fw_revision, self.__pnp_info)
+        return configs, magics
 
-                self.__ready = True
-                while True:
-                    self.__device.waitForNotifications(5)
+    async def __configure(self, pipelined: bool) -> None:
+        assert self.__client is not None and self.__hw_revision is not None
+        configs, magics = self.__setup_writes()
 
-            except (BTLEConnectError, BTLEException, BrokenPipeError) as e:
-                log.info(f'Ignoring remote exception {e}. Will restart.')
-                self.__listener.event_button(self, 0)  # release all keys
-                time.sleep(0.5)
+        # Negotiate MTU
+        if self.__hw_revision >= HwRevisions.GEN_2:
+            mtu = 527
+        else:
+            mtu = 185
+        await self.__client.exchange_mtu(mtu)
+
+        # Client characteristic configurations are written with requests, as the spec requires,
+        # so that a remote that doesn't take one fails the setup, rather than connecting with its
+        # buttons or touch silently off. A failed cached setup is retried with discovery.
+        for handle, data in configs:
+            await self.write_characteristic(handle, data)
+        if pipelined:
+            # The vendor writes of a known remote don't need to wait for each other
+            for handle, data in magics:
+                self.__client.write_command(handle, data)
+        else:
+            for handle, data in magics:
+                await self.write_characteristic(handle, data)
+
+        self.__handle_battery(await self.read_characteristic(self.__handles.BATTERY))
+        self.__handle_power(await self.read_characteristic(self.__handles.POWER))
+
+    def set_activity_running(self, running: bool) -> None:
+        self.__activity_running = running
+        if running:
+            # Starting an activity is using the remote
+            self.__last_input = time.monotonic()
+        self.__update_link()
+
+    def __note_input(self) -> None:
+        self.__last_input = time.monotonic()
+        if self.__link_is_fast is not True:
+            self.__update_link()
+
+    def __update_link(self) -> None:
+        if self.__link is None or not self.__ready:
+            return
+        idle_in_sec = self.__last_input + self.__idle_sec - time.monotonic()
+        is_fast = bool(self.__touches_down) or (self.__activity_running and idle_in_sec > 0)
+        if is_fast and self.__idle_timer is None:
+            # Check again when the remote may have become idle. Input in the meantime only moves
+            # the deadline, so the timer isn't rescheduled for every input.
+            self.__idle_timer = asyncio.get_running_loop().call_later(max(idle_in_sec, 0.1),
+                                                                      self.__idle_timer_elapsed)
+        if is_fast == self.__link_is_fast:
+            return
+        self.__link_is_fast = is_fast
+        self.__link.update_connection(self.mac, self.__fast_params if is_fast else self.__slow_params)
+
+    def __idle_timer_elapsed(self) -> None:
+        self.__idle_timer = None
+        self.__update_link()
 
     def zero_touch(self) -> Touch:
         return Touch(self, (0, 0, 0, 0, 0))
@@ -379,19 +615,38 @@ class SiriRemote(DefaultDelegate):
         if not self.has_motion():
             return False
         self.__last_keepalive = time.time()
-        self.write_characteristic(0x001d, b'\xA0\x01' if enable else b'\xA0\x00')
+        self.write_command(0x001d, b'\xA0\x01' if enable else b'\xA0\x00')
 
-    def read_characteristic(self, handle: int) -> bytes:
-        return self.__device.readCharacteristic(handle)
+    async def read_characteristic(self, handle: int) -> bytes:
+        assert self.__client is not None
+        return await self.__client.read(handle)
 
-    def write_characteristic(self, handle: int, data: bytes):
-        self.__device.writeCharacteristic(handle, data, withResponse=True)
+    async def write_characteristic(self, handle: int, data: bytes) -> None:
+        assert self.__client is not None
+        await self.__client.write(handle, data)
 
-    def enable_notifications(self, handle: int) -> None:
-        self.write_characteristic(handle, b'\x01\x00')
+    def write_command(self, handle: int, data: bytes) -> None:
+        """ Writes without waiting for a response, so it can be called from a listener event """
+        if self.__client is None:
+            return
+        try:
+            self.__client.write_command(handle, data)
+        except OSError as e:
+            log.info(f'Remote write failed {e}')
+
+    async def enable_notifications(self, handle: int) -> None:
+        await self.write_characteristic(handle, b'\x01\x00')
 
     def handleNotification(self, handle: int, data: bytes) -> None:
         if not self.__ready: return
+        latency.begin('remote')
+        if self.__recorder is not None:
+            self.__recorder.record(handle, data)
+        self.__dispatch_notification(handle, data)
+        if handle == self.__handles.INPUT or handle == self.__handles.TOUCH:
+            self.__note_input()
+
+    def __dispatch_notification(self, handle: int, data: bytes) -> None:
         if handle == self.__handles.BATTERY:
             self.__handle_battery(data)
         elif handle == self.__handles.POWER:
@@ -437,15 +692,17 @@ class SiriRemote(DefaultDelegate):
             self.__listener.event_power(self, False)
 
     def __handle_button(self, button: int) -> None:
+        # Touches that came before the button must be seen before it
+        self.__flush_touches()
         if button != self.__last_button:
             self.__last_button = button
             self.__listener.event_button(self, button)
 
     def __handle_motion(self, data: bytes) -> None:
         now = time.time()
-        assert self.__last_keepalive is not None
-        if now - self.__last_keepalive > 50:
-            self.write_characteristic(0x001d, b'\xf0\x7f')
+        # Replays stream motion without enabling it
+        if self.__last_keepalive is not None and now - self.__last_keepalive > 50:
+            self.write_command(0x001d, b'\xf0\x7f')
             self.__last_keepalive = now
         # The gen 1 remote uses a Bosch BMA280 accelerometer.
         # It is speculated that the remote is exporting the values as is from the chip. But it
@@ -521,32 +778,95 @@ class SiriRemote(DefaultDelegate):
         #              - bits 5-7 - ellipse orientation index - angle = index * 22.5 [degrees]
         # If second touch, bytes 11-17, inclusive, are added, and are as bytes 4-10 for the
         # second touch
-        timestamp = int.from_bytes(data[1:3], byteorder='little', signed=False)
-        touches = [self.__decode_finger(timestamp, data[4:11])]
+        timestamp, = touch_header.unpack_from(data)
+        touches = [self.__decode_finger(timestamp, data, 4)]
         if len(data) > 11:
-            touches.append(self.__decode_finger(timestamp, data[11:]))
+            touches.append(self.__decode_finger(timestamp, data, 11))
+        self.__queue_touches(touches)
+
+    def __queue_touches(self, touches: list[Touch]) -> None:
+        # Only the first sample below the pressure threshold matters, as it ends a touch. Drop the
+        # rest, they are the pad sensing a hovering, or resting, finger.
+        threshold = self.__pressure_threshold
+        down = self.__touches_down
+        touches = [t for t in touches if t.p >= threshold or t.id in down]
+        if not touches:
+            return
+        # Samples that only move touches that are already down can be coalesced. A burst that
+        # arrives together is delivered as the latest of its samples.
+        is_move = all(t.p >= threshold and t.id in down for t in touches)
+        pending = self.__pending_touches
+        if pending is not None:
+            if (is_move and self.__pending_is_move and
+                [t.id for t in pending] == [t.id for t in touches]):
+                self.__pending_touches = touches
+                return
+            self.__flush_touches()
+        for t in touches:
+            if t.p >= threshold:
+                down.add(t.id)
+            else:
+                down.discard(t.id)
+        self.__pending_touches = touches
+        self.__pending_is_move = is_move
+        # The ATT client reads all the notifications that are waiting before this runs
+        asyncio.get_running_loop().call_soon(self.__flush_touches)
+
+    def __flush_touches(self) -> None:
+        touches = self.__pending_touches
+        if touches is None:
+            return
+        self.__pending_touches = None
         self.__listener.event_touches(self, touches)
 
     def __handle_audio(self, data: bytes) -> None:
         self.__listener.event_audio(self, data)
 
-    def __decode_finger(self, timestamp: int, data: bytes) -> Touch:
-        x = ((data[1] & 0x0f) << 8) | data[0]
-        if x & 0x800:
-            x -= 0x1000
-        if self.__hw_revision in (HwRevisions.GEN_1, HwRevisions.GEN_1_5):
-            x += 1000
-        else: # Gen 2 or greater
-            x += 360
-        y = (data[2] << 4) | ((data[1] & 0xf0) >> 4)
-        if y & 0x800:
-            y -= 0x1000
-        if self.__hw_revision in (HwRevisions.GEN_1, HwRevisions.GEN_1_5):
-            y += 230
-        else: # Gen 2 or greater
-            y += 360
-        p = data[5]
+    def __decode_finger(self, timestamp: int, data: bytes, offset: int) -> Touch:
+        xy, y_high, p, flags = touch_finger.unpack_from(data, offset)
+        x = xy & 0xfff
+        x -= (x & 0x800) << 1
+        y = (y_high << 4) | (xy >> 12)
+        y -= (y & 0x800) << 1
+        x0, y0 = self.__touch_origin
         # Make it so first touch is usually 0, and second touch is usually 1.
         # Though, the order is not guaranteed for all touch sequences.
-        id = 1 - ((data[6] & 0x08) >> 3)
-        return Touch(self, (id, timestamp, x, y, p))
+        id = 1 - ((flags & 0x08) >> 3)
+        return Touch(self, (id, timestamp, x + x0, y + y0, p))
+
+class RemoteManager:
+    """ Runs any number of remotes concurrently. The remotes share the GATT cache, and the
+    connection to the system's Bluetooth stack. """
+    def __init__(self, system: BluetoothSystem | None = None, connect: Connect = att.connect,
+                 gatt_cache: GattCache | None = None, link: LinkControl | None = None) -> None:
+        self.system = system if system is not None else BluetoothCtl()
+        self.link = link
+        self.connect = connect
+        self.gatt_cache = gatt_cache if gatt_cache is not None else GattCache(config['remote.gatt_cache_path'])
+        self.remotes: list[SiriRemote] = []
+
+    def add(self, mac: str, listener: RemoteListener) -> SiriRemote:
+        remote = SiriRemote(mac, listener, self.connect, self.gatt_cache, self.system, self.link)
+        self.remotes.append(remote)
+        return remote
+
+    async def run(self) -> None:
+        await asyncio.gather(*(self.supervise(remote) for remote in self.remotes))
+
+    async def supervise(self, remote: SiriRemote) -> None:
+        """ Runs a remote, so that one that fails, i.e. isn't a known remote, doesn't stop the
+        others. It is run again after the longest reconnect delay. """
+        while True:
+            delay_sec: float = config['remote.reconnect.max_delay_sec']
+            try:
+                await remote.run()
+            except UnknownRemoteException as e:
+                log.error(f'Unknown remote {remote.mac} {e}. Trying again in {delay_sec}s.')
+            except Exception as e:
+                log.error(f'Remote {remote.mac} failed {e!r}. Trying again in {delay_sec}s.')
+            await asyncio.sleep(delay_sec)
+
+    # Duck typed methods for messaging
+    async def server_notify_set_activity(self, index: int) -> None:
+        for remote in self.remotes:
+            remote.set_activity_running(index >= 0)
@@ -10,8 +10,8 @@ import tools
 
 log = tools.logger(__name__)
 
-import gestures, messaging, remote
-from remote import HwRevisions, SiriRemote, Touch
+import gestures, latency, messaging, motion, remote
+from remote import HwRevisions, MotionEvent, SiriRemote, Touch
 from hdmi import Key
 
 
@@ -20,8 +20,10 @@ class Adapter(remote.RemoteListener):
         self.pipe = pipe
         self.button_state = 0
         self.swipe_recognizer = gestures.SwipeRecognizer(self.swipe_callback)
+        self.kinetic_scroller = gestures.KineticScroller(self.kinetic_step)
         self.dpad_emulator = gestures.DPadEmulator()
         self.multitap_recognizer = gestures.MultiTapRecognizer(1, 3, self.multitap_callback)
+        self.motion_pipeline = motion.MotionPipeline(self.motion_callback)
         self.battery_level = 100
         self.is_charging = False
 
@@ -44,7 +46,10 @@ class Adapter(remote.RemoteListener):
             btns.SIRI : Key.DISPLAY_INFO,
         }
 
+        latency.hop('remote_adapter')
         log.info(f'Buttons {buttons:04X}')
+        self.kinetic_scroller.cancel()
+        self.motion_pipeline.note_input(remote)
         dpad_buttons = self.dpad_emulator.buttons(remote, buttons)
         if buttons != dpad_buttons:
             buttons = dpad_buttons
@@ -72,21 +77,29 @@ class Adapter(remote.RemoteListener):
         if self.button_state != 0:
             log.info(f'Swipe with active buttons {self.button_state:04X}. Ignoring!')
             return
-        if event.x < 0:
-            counter = -event.x
-            hkey = Key.LEFT
-        elif event.x > 0:
-            counter = event.x
-            hkey = Key.RIGHT
-        elif event.y < 0:
-            counter = -event.y
-            hkey = Key.DOWN
-        else: # event.y > 0
-            counter = event.y
-            hkey = Key.UP
-        log.info(f'Swiping {hkey.name} {counter} times')
+        axis = 0 if event.x != 0 else 1
+        if event.type & gestures.EventType.End and event.velocity != 0:
+            # The swipe was released, so let it glide
+            log.info(f'Gliding {event.x + event.y} steps at {event.velocity:.0f}mm/s, '
+                     f'{event.early_steps} sent early')
+            self.kinetic_scroller.start(axis, event.velocity, event.early_steps)
+            return
+        counter = event.x + event.y
+        hkey = self.swipe_key(axis, counter)
+        log.info(f'Swiping {hkey.name} {abs(counter)} times')
         if self.pipe:
-            self.pipe.key_press(hkey, counter)
+            self.pipe.key_press(hkey, abs(counter))
+
+    def swipe_key(self, axis: int, direction: int) -> Key:
+        if axis == 0:
+            return Key.RIGHT if direction > 0 else Key.LEFT
+        return Key.UP if direction > 0 else Key.DOWN
+
+    def kinetic_step(self, axis: int, direction: int) -> None:
+        hkey = self.swipe_key(axis, direction)
+        log.info(f'Gliding {hkey.name}')
+        if self.pipe:
+            self.pipe.key_press(hkey, 1)
 
     def multitap_callback(self, recognizer: gestures.MultiTapRecognizer, event: gestures.TapEvent) -> None:
         if not (event.type & gestures.EventType.Detected):
@@ -97,11 +110,26 @@ class Adapter(remote.RemoteListener):
         self.event_button(event.remote, buttons)
 
     def event_touches(self, remote: SiriRemote, touches: list[Touch]) -> None:
+        latency.hop('remote_adapter')
+        # A new touch stops a glide
+        self.kinetic_scroller.cancel()
+        self.motion_pipeline.note_input(remote)
         self.swipe_recognizer.touches(remote, touches)
         self.dpad_emulator.touches(remote, touches)
         if remote.profile.hw_revision in (HwRevisions.GEN_1, HwRevisions.GEN_1_5):
             self.multitap_recognizer.touches(remote, touches)
 
+    def event_motion(self, remote: SiriRemote, motion: MotionEvent) -> None:
+        self.motion_pipeline.motion(remote, motion)
+
+    def motion_callback(self, remote: SiriRemote, gesture: str, key: int) -> None:
+        if self.button_state != 0:
+            log.info(f'Motion with active buttons {self.button_state:04X}. Ignoring!')
+            return
+        log.info(f'Motion {gesture} {Key(key).name}')
+        if self.pipe:
+            self.pipe.key_press(key, 1)
+
     def event_battery(self, remote: SiriRemote, percent: int) -> None:
         log.info(f'Battery charge at {percent}%')
         self.battery_level = percent
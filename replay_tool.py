@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import tools
+
+log = tools.logger('var/log/replay_tool')
+
+import argparse, asyncio, logging, sys, time
+
+import messaging, recording, remote, remote_adapter
+from hdmi import Key
+
+class KeyPrinter:
+    """ Prints what the remote would have sent the hub """
+    def __init__(self) -> None:
+        self.start = time.monotonic()
+        self.events = 0
+
+    def print(self, s: str) -> None:
+        self.events += 1
+        log.info(f'{time.monotonic() - self.start:9.3f} {s}')
+
+    async def client_set_activity(self, index: int) -> None:
+        self.print(f'Set activity {index}')
+
+    async def client_press_key(self, key: int, count: int = 0) -> None:
+        self.print(f'Press {Key(key).name}' + (f' x{count}' if count else ''))
+
+    async def client_release_key(self, key: int) -> None:
+        self.print(f'Release {Key(key).name}')
+
+    async def client_battery_state(self, level: int, is_charging: bool) -> None:
+        self.print(f'Battery {level}%' + (' charging' if is_charging else ''))
+
+async def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Replay recorded remote notifications through '
+                                         'the remote adapter, without a remote')
+    arg_parser.add_argument('recordings', nargs='+', help='recordings made with remote.record.dir')
+    arg_parser.add_argument('-s', '--speed', type=float, default=1,
+                            help='replay speed, relative to the recording, or 0 for as fast as possible')
+    args = arg_parser.parse_args()
+    log.addHandler(logging.StreamHandler(sys.stdout))
+
+    for path in args.recordings:
+        log.info(f'Replaying {path}')
+        pipe = messaging.Pipe(name='replay')
+        printer = KeyPrinter()
+        pipe.start_server_task(printer)
+        sr = remote.SiriRemote('00:00:00:00:00:00', remote_adapter.Adapter(pipe))
+        cpu_start = time.process_time()
+        wall_start = time.monotonic()
+        count = await recording.replay(sr, path, args.speed)
+        cpu_sec = time.process_time() - cpu_start
+        wall_sec = time.monotonic() - wall_start
+        # Let the printer catch up
+        await asyncio.sleep(0.1)
+        assert pipe.server_t is not None
+        pipe.server_t.cancel()
+        log.info(f'{count} notifications, {printer.events} events, {wall_sec:.3f}s, '
+                 f'{cpu_sec * 1e6 / max(count, 1):.1f}us CPU per notification')
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -11,13 +11,15 @@ log = tools.logger(__name__)
 import evdev
 import evdev.ecodes as e
 
-import asyncio, time
+import asyncio
 from typing import Any
 
 from aconfig import config
 from evdev import InputDevice
 from hdmi import Key
+import latency
 from messaging import Pipe
+from release_timeout import ReleaseByTimeout
 
 # SolarCell is very odd. It is exposed as 3 devices in Linux, named:
 # 'bluez-hog-device Keyboard'
@@ -56,23 +58,28 @@ config.default('solarcell.keymap', {
     0xFA : Key.F4,                  # Activity YouTube
 })
 
+# The release timeout, until the repeat interval is learnt, and at most after
 config.default('solarcell.repeat.timeout_sec', 0.15)
-config.default('solarcell.repeat.sleep_sec', 0.075)
+config.default('solarcell.repeat.min_timeout_sec', 0.05)
+# The release timeout, in repeat intervals
+config.default('solarcell.repeat.interval_factor', 2.5)
 
-class Handler:
+class Handler(ReleaseByTimeout):
     def __init__(self, pipe: Pipe | None) -> None:
+        super().__init__(config['solarcell.repeat.timeout_sec'],
+                         config['solarcell.repeat.min_timeout_sec'],
+                         config['solarcell.repeat.interval_factor'])
         self.name = 'SolarCell'
         self.devices: list[InputDevice] = []
         self.pipe = pipe
-        self.taskit = tools.Tasker('SolarCell')
-        self.taskit(self.repeat_monitor_task())
-        self.last_key: Key = Key.NO_KEY
-        self.last_timestamp: float = 0
-        self.key_event = asyncio.Event()
 
     def wait_on(self) -> set[asyncio.Task[Any]]:
         return set()
 
+    def probe_key(self) -> str:
+        # Change this whenever probe() changes
+        return 'vendor 5d product 1 EV_REL REL_MISC'
+
     def probe(self, dev: InputDevice) -> bool:
         # It's not clear how to definitively identify the SolarCell device of interest.
         # For now the conditions are:
@@ -102,7 +109,11 @@ class Handler:
 
     keymap = config['solarcell.keymap']
 
-    async def dispatch_input_event(self, event: evdev.InputEvent) -> None:
+    async def dispatch_input_frame(self, events: list[evdev.InputEvent]) -> None:
+        for event in events:
+            self.dispatch_input_event(event)
+
+    def dispatch_input_event(self, event: evdev.InputEvent) -> None:
         if event.type != e.EV_REL:
             return
         if event.code != e.REL_MISC:
@@ -112,36 +123,18 @@ class Handler:
             log.info(f'Unhandled key value {event.value:02X}')
             return
 
-        # Note the time of the last key event
-        self.last_timestamp = time.time()
-        if self.last_key != hkey:
-            if self.last_key == Key.NO_KEY:
-                # Transitioning from quiet to key presses, start the key release monitor
-                self.key_event.set()
-            else:
-                # Transitioning from one key to another, release the previous key
-                if self.pipe:
-                    self.pipe.key_release(self.last_key)
-            self.last_key = hkey
-            log.info(f'Key press {hkey:02X}')
-            # Press the key
-            if self.pipe:
-                self.pipe.key_press(hkey)
-
-    async def repeat_monitor_task(self) -> None:
-        timeout_sec = config['solarcell.repeat.timeout_sec']
-        sleep_sec = config['solarcell.repeat.sleep_sec']
-        while True:
-            # Wait for signal that key presses have begun
-            await self.key_event.wait()
-            self.key_event.clear()
-            # Busy wait for key events to stop
-            while time.time() - self.last_timestamp < timeout_sec:
-                await asyncio.sleep(sleep_sec)
-            # Events are done for now. Release the key, and start from the top...
-            if self.pipe:
-                self.pipe.key_release(self.last_key)
-            self.last_key = Key.NO_KEY
+        self.key_event(hkey)
+
+    def key_pressed(self, key: int) -> None:
+        latency.begin('solarcell')
+        log.info(f'Key press {key:02X}')
+        if self.pipe:
+            self.pipe.key_press(key)
+
+    def key_released(self, key: int) -> None:
+        log.info(f'Key release {key:02X}')
+        if self.pipe:
+            self.pipe.key_release(key)
 
 
 async def main() -> None:
@@ -0,0 +1,142 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import asyncio, socket, struct
+
+import att
+from att import AssignedNumbers, ErrorCode, Op
+
+# A local GATT peer that looks like a Siri remote. It serves ATT over a socket pair, so remotes
+# can be tested without Bluetooth.
+
+class FakeRemote:
+    def __init__(self, fw: str = '0083', product_id: int = 0x0314, battery: int = 80,
+                 power: int = 0x2f, mtu: int = 527) -> None:
+        self.mtu = mtu
+        self.server: socket.socket | None = None
+        self.connections = 0
+        self.requests: list[bytes] = []
+        self.writes: list[tuple[int, bytes]] = []
+        # Handles whose next write request is rejected
+        self.rejects: set[int] = set()
+        pnp = struct.pack('<BHHH', 1, 0x004c, product_id, 0x0100)
+        # Services of (uuid, characteristics of (uuid, value, has configuration descriptor))
+        services = [
+            (AssignedNumbers.generic_access, [
+                (AssignedNumbers.device_name, b'Siri Remote', False)]),
+            (AssignedNumbers.device_information, [
+                (AssignedNumbers.serial_number_string, b'SN1234', False),
+                (AssignedNumbers.hardware_revision_string, b'B', False),
+                (AssignedNumbers.firmware_revision_string, fw.encode(), False),
+                (AssignedNumbers.pnp_id, pnp, False)]),
+            (AssignedNumbers.battery_service, [
+                (AssignedNumbers.battery_level, bytes([battery]), True),
+                (AssignedNumbers.battery_level_status, bytes([power]), True)]),
+        ]
+        # Attributes of (handle, type uuid, value)
+        self.attributes: list[tuple[int, int, bytes]] = []
+        self.groups: list[tuple[int, int, int]] = []
+        self.handles: dict[int, int] = {} # characteristic uuid -> value handle
+        handle = 1
+        for service_uuid, chars in services:
+            start = handle
+            self.attributes.append((handle, AssignedNumbers.primary_service, att.uuid_to_bytes(service_uuid)))
+            handle += 1
+            for uuid, value, has_config in chars:
+                decl = struct.pack('<BH', 0x12, handle + 1) + att.uuid_to_bytes(uuid)
+                self.attributes.append((handle, AssignedNumbers.characteristic, decl))
+                self.attributes.append((handle + 1, uuid, value))
+                self.handles[uuid] = handle + 1
+                handle += 2
+                if has_config:
+                    self.attributes.append((handle, AssignedNumbers.client_characteristic_configuration,
+                                            b'\x00\x00'))
+                    handle += 1
+            self.groups.append((start, handle - 1, service_uuid))
+            handle = (handle + 0xf) & ~0xf
+
+    async def connect(self, mac: str) -> socket.socket:
+        self.drop()
+        self.server, client = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.server.setblocking(False)
+        asyncio.get_running_loop().add_reader(self.server.fileno(), self.__read)
+        self.connections += 1
+        return client
+
+    def drop(self) -> None:
+        if self.server is None:
+            return
+        asyncio.get_running_loop().remove_reader(self.server.fileno())
+        self.server.close()
+        self.server = None
+
+    def notify(self, handle: int, value: bytes) -> None:
+        assert self.server is not None
+        self.server.send(struct.pack('<BH', Op.HANDLE_VALUE_NTF, handle) + value)
+
+    def __read(self) -> None:
+        assert self.server is not None
+        try:
+            pdu = self.server.recv(1024)
+        except BlockingIOError:
+            return
+        if not pdu:
+            self.drop()
+            return
+        self.requests.append(pdu)
+        rsp = self.handle(pdu)
+        if rsp is not None:
+            self.server.send(rsp)
+
+    def error(self, op: int, handle: int, code: int) -> bytes:
+        return struct.pack('<BBHB', Op.ERROR_RSP, op, handle, code)
+
+    def value(self, handle: int) -> bytes | None:
+        for h, _, value in self.attributes:
+            if h == handle:
+                return value
+        return None
+
+    def handle(self, pdu: bytes) -> bytes | None:
+        op = pdu[0]
+        if op == Op.EXCHANGE_MTU_REQ:
+            return struct.pack('<BH', Op.EXCHANGE_MTU_RSP, self.mtu)
+        if op == Op.READ_BY_GROUP_TYPE_REQ:
+            start, end = struct.unpack_from('<HH', pdu, 1)
+            for group_start, group_end, uuid in self.groups:
+                if start <= group_start <= end:
+                    return struct.pack('<BBHHH', Op.READ_BY_GROUP_TYPE_RSP, 6, group_start, group_end, uuid)
+            return self.error(op, start, ErrorCode.ATTRIBUTE_NOT_FOUND)
+        if op == Op.READ_BY_TYPE_REQ:
+            start, end = struct.unpack_from('<HH', pdu, 1)
+            type_uuid = att.uuid_from_bytes(pdu[5:])
+            for handle, uuid, value in self.attributes:
+                if start <= handle <= end and uuid == type_uuid:
+                    return struct.pack('<BBH', Op.READ_BY_TYPE_RSP, 2 + len(value), handle) + value
+            return self.error(op, start, ErrorCode.ATTRIBUTE_NOT_FOUND)
+        if op == Op.FIND_INFORMATION_REQ:
+            start, end = struct.unpack_from('<HH', pdu, 1)
+            for handle, uuid, _ in self.attributes:
+                if start <= handle <= end:
+                    return struct.pack('<BBHH', Op.FIND_INFORMATION_RSP, 1, handle, uuid)
+            return self.error(op, start, ErrorCode.ATTRIBUTE_NOT_FOUND)
+        if op in (Op.READ_REQ, Op.READ_BLOB_REQ):
+            handle, = struct.unpack_from('<H', pdu, 1)
+            offset = struct.unpack_from('<H', pdu, 3)[0] if op == Op.READ_BLOB_REQ else 0
+            value = self.value(handle)
+            if value is None:
+                return self.error(op, handle, ErrorCode.INVALID_HANDLE)
+            return bytes([op + 1]) + value[offset:offset + self.mtu - 1]
+        if op in (Op.WRITE_REQ, Op.WRITE_CMD):
+            handle, = struct.unpack_from('<H', pdu, 1)
+            if op == Op.WRITE_REQ and handle in self.rejects:
+                self.rejects.discard(handle)
+                return self.error(op, handle, ErrorCode.WRITE_NOT_PERMITTED)
+            self.writes.append((handle, pdu[3:]))
+            return bytes([Op.WRITE_RSP]) if op == Op.WRITE_REQ else None
+        if op & Op.COMMAND_FLAG:
+            return None
+        return self.error(op, 0, ErrorCode.REQUEST_NOT_SUPPORTED)
@@ -0,0 +1,25 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import remote
+from remote import HwRevisions, SiriRemote
+
+# A remote and a clock to feed touch reports to the gesture recognizers with, for the tests and
+# bench/gestures_bench.py.
+
+def gen_1_remote() -> SiriRemote:
+    sr = SiriRemote('00:00:00:00:00:00', remote.RemoteListener())
+    pnp = bytes([0x01, 0x4c, 0x00]) + HwRevisions.GEN_1.to_bytes(2, 'little') + bytes([0x00, 0x01])
+    sr.load_identity({'hwr': 'A', 'fwr': '0097', 'pnp': pnp.hex(), 'battery': 0xffff,
+                      'battery_config': 0xffff, 'power': 0xffff, 'power_config': 0xffff})
+    return sr
+
+class Clock:
+    """ A clock that only moves when it is set """
+    def __init__(self) -> None:
+        self.now = 0.0
+    def __call__(self) -> float:
+        return self.now
@@ -0,0 +1,97 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import test_common
+
+import unittest
+
+from dbus_fast import Message, MessageType, Variant
+
+import bluez
+
+KEYBOARD = '/org/bluez/hci0/dev_AA_BB_CC_DD_EE_01'
+SPEAKER = '/org/bluez/hci0/dev_AA_BB_CC_DD_EE_02'
+
+
+def device(mac, icon, paired=True):
+    return {'Address': Variant('s', mac), 'Icon': Variant('s', icon),
+            'Paired': Variant('b', paired), 'UUIDs': Variant('as', [])}
+
+
+def battery(percentage):
+    return {'Percentage': Variant('y', percentage)}
+
+
+def signal(path, interface, member, signature, body):
+    return Message(message_type=MessageType.SIGNAL, path=path, interface=interface,
+                   member=member, signature=signature, body=body)
+
+
+def properties_changed(path, interface, changed):
+    return signal(path, 'org.freedesktop.DBus.Properties', 'PropertiesChanged', 'sa{sv}as',
+                  [interface, changed, []])
+
+
+class FakeBus:
+    def __init__(self, objects):
+        self.objects = objects
+        self.handlers = []
+
+    def add_message_handler(self, handler):
+        self.handlers.append(handler)
+
+    async def call(self, msg):
+        assert msg.member == 'GetManagedObjects'
+        return Message(message_type=MessageType.METHOD_RETURN, reply_serial=1,
+                       signature='a{oa{sa{sv}}}', body=[self.objects])
+
+    def send(self, msg):
+        for handler in self.handlers:
+            handler(msg)
+
+
+class TestBatteries(unittest.IsolatedAsyncioTestCase):
+    async def test_watch_batteries(self):
+        bus = FakeBus({
+            KEYBOARD: {bluez.device_interface: device('AA:BB:CC:DD:EE:01', 'input-keyboard'),
+                       bluez.battery_interface: battery(80)},
+            SPEAKER: {bluez.device_interface: device('AA:BB:CC:DD:EE:02', 'audio-card'),
+                      bluez.battery_interface: battery(50)},
+        })
+        blue = bluez.BlueZ(bus)
+        levels = []
+        await blue.watch_batteries(lambda mac, percentage: levels.append((mac, percentage)))
+        # Only input devices
+        self.assertEqual(levels, [('AA:BB:CC:DD:EE:01', 80)])
+
+        levels.clear()
+        bus.send(properties_changed(KEYBOARD, bluez.battery_interface, battery(75)))
+        bus.send(properties_changed(SPEAKER, bluez.battery_interface, battery(45)))
+        self.assertEqual(levels, [('AA:BB:CC:DD:EE:01', 75)])
+
+        # A HID device that is paired, and then gets a battery
+        levels.clear()
+        gamepad = '/org/bluez/hci0/dev_AA_BB_CC_DD_EE_03'
+        properties = device('AA:BB:CC:DD:EE:03', '', paired=False)
+        properties['UUIDs'] = Variant('as', ['00001812-0000-1000-8000-00805f9b34fb'])
+        bus.send(signal('/', 'org.freedesktop.DBus.ObjectManager', 'InterfacesAdded',
+                        'oa{sa{sv}}', [gamepad, {bluez.device_interface: properties}]))
+        bus.send(properties_changed(gamepad, bluez.device_interface,
+                                    {'Paired': Variant('b', True)}))
+        bus.send(signal('/', 'org.freedesktop.DBus.ObjectManager', 'InterfacesAdded',
+                        'oa{sa{sv}}', [gamepad, {bluez.battery_interface: battery(60)}]))
+        self.assertEqual(levels, [('AA:BB:CC:DD:EE:03', 60)])
+
+        levels.clear()
+        bus.send(signal('/', 'org.freedesktop.DBus.ObjectManager', 'InterfacesRemoved', 'oas',
+                        [KEYBOARD, [bluez.battery_interface]]))
+        bus.send(signal('/', 'org.freedesktop.DBus.ObjectManager', 'InterfacesRemoved', 'oas',
+                        [SPEAKER, [bluez.device_interface, bluez.battery_interface]]))
+        self.assertEqual(levels, [('AA:BB:CC:DD:EE:01', None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
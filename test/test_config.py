@@ -11,6 +11,7 @@ import os
 import tempfile
 import yaml
 from enum import IntEnum
+from collections.abc import Mapping
 
 from config import Config
 
@@ -501,5 +502,67 @@ class TestConfigYamlHandler(unittest.TestCase):
             os.unlink(fname)
 
 
+class TestConfigAccess(unittest.TestCase):
+    def test_accessor(self):
+        c = Config('dummy.yaml')
+        c.default('remote.battery.low_threshold', 10)
+        c.default('items,1', 'second')
+        low_threshold = c.accessor('remote.battery.low_threshold')
+        second = c.accessor('items,1')
+        self.assertEqual(low_threshold(), 10)
+        self.assertEqual(second(), 'second')
+        self.assertIs(c.compile('items,1'), c.compile('items,1'))
+
+        # Accessors follow changes
+        c['remote.battery.low_threshold'] = 20
+        self.assertEqual(low_threshold(), 20)
+        c.replace_user_root({'remote': {'battery': {'low_threshold': 5}}})
+        self.assertEqual(low_threshold(), 5)
+        self.assertEqual(second(), 'second')
+        self.assertIsNone(c.accessor('remote.missing')())
+
+        c['remote'] = 'scalar'
+        with self.assertRaises(TypeError):
+            low_threshold()
+
+    def test_snapshot(self):
+        c = Config('dummy.yaml')
+        c.default('remote.battery.low_threshold', 10)
+        c.default('remote.keymap', {1: 'one'})
+        c.default('entries', ['first', {'name': 'second'}, {}])
+        c.default('items', 'subscript only')
+        snapshot = c.snapshot()
+        self.assertIs(c.snapshot(), snapshot)
+        self.assertEqual(snapshot.remote.battery.low_threshold, 10)
+        self.assertEqual(snapshot['remote'].keymap[1], 'one')
+        self.assertEqual(snapshot.entries[1].name, 'second')
+        self.assertEqual(snapshot['items'], 'subscript only')
+        self.assertIn('battery', snapshot.remote)
+        with self.assertRaises(AttributeError):
+            snapshot.remote.missing
+
+        # Every dict is a mapping of the same kind, empty ones too
+        self.assertIsInstance(snapshot.remote.keymap, Mapping)
+        self.assertEqual(dict(snapshot.remote.keymap), {1: 'one'})
+        self.assertEqual(len(snapshot.entries[2]), 0)
+        self.assertEqual(list(snapshot.entries[2]), [])
+        self.assertIs(type(snapshot.entries[2]), type(snapshot.remote.keymap))
+        self.assertEqual(snapshot.remote.get('missing', 5), 5)
+        self.assertEqual(snapshot.remote.battery, {'low_threshold': 10})
+
+        # Snapshots are read only
+        with self.assertRaises(AttributeError):
+            snapshot.remote.battery.low_threshold = 20
+        with self.assertRaises(TypeError):
+            snapshot.remote.keymap[2] = 'two'
+        with self.assertRaises(AttributeError):
+            snapshot.remote.keymap.extra = 'two'
+
+        # A snapshot holds the config it was taken from
+        c['remote.battery.low_threshold'] = 20
+        self.assertEqual(snapshot.remote.battery.low_threshold, 10)
+        self.assertEqual(c.snapshot().remote.battery.low_threshold, 20)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,191 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import test_common
+
+import unittest
+from unittest.mock import patch
+import asyncio
+import os
+import shutil
+import tempfile
+
+import evdev
+import evdev.ecodes as e
+from evdev import DeviceInfo
+
+import evdev_input
+
+
+class FakeDevice:
+    def __init__(self, path, name='Remote', phys='aa:bb', uniq='cc:dd', product=1):
+        self.path = path
+        self.name = name
+        self.phys = phys
+        self.uniq = uniq
+        self.info = DeviceInfo(5, 0x5d, product, 0x100)
+        self.reads = asyncio.Queue()
+        self.closed = False
+        self.active = []
+
+    def async_read(self):
+        return self.reads.get()
+
+    def close(self):
+        self.closed = True
+
+    def active_keys(self):
+        return self.active
+
+
+class FakeHandler:
+    def __init__(self, name, wants='Remote'):
+        self.name = name
+        self.wants = wants
+        self.probes = 0
+        self.frames = []
+
+    def wait_on(self):
+        return set()
+
+    def probe(self, dev):
+        self.probes += 1
+        return dev.name == self.wants
+
+    def probe_key(self):
+        return self.wants
+
+    async def dispatch_input_frame(self, events):
+        self.frames.append([(event.type, event.code, event.value) for event in events])
+
+
+def key(code, value):
+    return evdev.InputEvent(0, 0, e.EV_KEY, code, value)
+
+
+def syn(code=e.SYN_REPORT):
+    return evdev.InputEvent(0, 0, e.EV_SYN, code, 0)
+
+
+class TestEvdevInput(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.dir, 'cache.yaml')
+        test_common.mock_config['evdev.fingerprint_cache_path'] = self.cache_path
+        self.devices = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_input(self, handlers):
+        with patch.object(evdev_input.EvdevInput, 'start_input_monitor'), \
+             patch.object(evdev_input.evdev, 'list_devices', return_value=[]):
+            inp = evdev_input.EvdevInput(handlers, asyncio.get_running_loop())
+        inp.taskit = asyncio.create_task
+        return inp
+
+    def listen(self, inp, device):
+        self.devices[device.path] = device
+        with patch.object(evdev_input.evdev, 'InputDevice', lambda path: self.devices[path]):
+            inp.listen_device_at_path(device.path)
+
+    async def test_reconnect_replaces_listener(self):
+        handler = FakeHandler('Remote')
+        inp = self.make_input([handler])
+        old = FakeDevice('/dev/input/event1')
+        self.listen(inp, old)
+        await asyncio.sleep(0)
+        old_task = next(iter(inp.physical.values()))
+
+        # The device is back at a new node, before its old one went away
+        new = FakeDevice('/dev/input/event2')
+        self.listen(inp, new)
+        await asyncio.sleep(0)
+        self.assertTrue(old_task.done())
+        self.assertTrue(old.closed)
+        self.assertEqual(inp.listening, {new.path})
+        self.assertEqual(len(inp.physical), 1)
+
+        new.reads.put_nowait([evdev.InputEvent(0, 0, e.EV_REL, e.REL_MISC, 7),
+                              evdev.InputEvent(0, 0, e.EV_SYN, e.SYN_REPORT, 0)])
+        await asyncio.sleep(0)
+        self.assertEqual(handler.frames, [[(e.EV_REL, e.REL_MISC, 7)]])
+
+        # Another device of the same model is a device of its own
+        other = FakeDevice('/dev/input/event3', uniq='cc:de')
+        self.listen(inp, other)
+        await asyncio.sleep(0)
+        self.assertEqual(inp.listening, {new.path, other.path})
+        for task in inp.physical.values():
+            task.cancel()
+
+    async def test_frames(self):
+        handler = FakeHandler('Remote')
+        inp = self.make_input([handler])
+        device = FakeDevice('/dev/input/event1')
+        self.listen(inp, device)
+        # Frames are split on SYN_REPORT, within a read and across reads
+        device.reads.put_nowait([key(e.KEY_UP, 1), syn(), key(e.KEY_LEFT, 1)])
+        device.reads.put_nowait([key(e.KEY_DOWN, 1), syn(), syn()])
+        await asyncio.sleep(0.01)
+        self.assertEqual(handler.frames, [[(e.EV_KEY, e.KEY_UP, 1)],
+                                          [(e.EV_KEY, e.KEY_LEFT, 1), (e.EV_KEY, e.KEY_DOWN, 1)]])
+
+        # Events from a drop up to the next SYN_REPORT are skipped. Keys that were released
+        # meanwhile are released then.
+        handler.frames.clear()
+        device.active = [e.KEY_LEFT]
+        device.reads.put_nowait([key(e.KEY_RIGHT, 1), syn(e.SYN_DROPPED), key(e.KEY_UP, 0), syn(),
+                                 key(e.KEY_LEFT, 0), syn()])
+        await asyncio.sleep(0.01)
+        self.assertEqual(handler.frames, [[(e.EV_KEY, e.KEY_UP, 0), (e.EV_KEY, e.KEY_DOWN, 0)],
+                                          [(e.EV_KEY, e.KEY_LEFT, 0)]])
+
+        stats = inp.stats()['Remote']
+        self.assertEqual({name: stats[name] for name in ('reads', 'frames', 'events', 'dropped')},
+                         {'reads': 3, 'frames': 4, 'events': 6, 'dropped': 1})
+        self.assertEqual(stats['latency']['count'], 4)
+        self.assertEqual(inp.stats().keys(), {'Remote'})
+        for task in inp.physical.values():
+            task.cancel()
+
+    async def test_fingerprint_cache(self):
+        remote = FakeHandler('Remote')
+        keyboard = FakeHandler('Keyboard', 'Keyboard')
+        inp = self.make_input([remote, keyboard])
+        # A miss probes every handler
+        self.listen(inp, FakeDevice('/dev/input/event1'))
+        self.listen(inp, FakeDevice('/dev/input/event2', name='Mouse'))
+        self.assertEqual((remote.probes, keyboard.probes), (2, 2))
+        self.assertEqual(inp.listening, {'/dev/input/event1'})
+
+        # Hits skip probing, after restarts too
+        inp = self.make_input([remote, keyboard])
+        self.listen(inp, FakeDevice('/dev/input/event3', uniq='cc:de'))
+        self.listen(inp, FakeDevice('/dev/input/event4', name='Mouse'))
+        self.assertEqual((remote.probes, keyboard.probes), (2, 2))
+        self.assertEqual(inp.listening, {'/dev/input/event3'})
+
+        # A handler whose probe changed probes again, and a run with another set of handlers
+        # keeps the results of the others
+        keyboard.wants = 'Mouse'
+        inp = self.make_input([keyboard])
+        self.listen(inp, FakeDevice('/dev/input/event5', name='Mouse'))
+        self.assertEqual((remote.probes, keyboard.probes), (2, 3))
+        self.assertEqual(inp.listening, {'/dev/input/event5'})
+        inp = self.make_input([remote, keyboard])
+        self.listen(inp, FakeDevice('/dev/input/event6', name='Mouse'))
+        self.listen(inp, FakeDevice('/dev/input/event7', uniq='cc:df'))
+        # The changed handler probes the remote's fingerprint again
+        self.assertEqual((remote.probes, keyboard.probes), (2, 4))
+        self.assertEqual(inp.listening, {'/dev/input/event6', '/dev/input/event7'})
+        await asyncio.sleep(0)
+        for task in asyncio.all_tasks() - {asyncio.current_task()}:
+            task.cancel()
+
+
+if __name__ == '__main__':
+    unittest.main()
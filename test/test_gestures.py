@@ -0,0 +1,220 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import test_common
+
+import unittest
+import asyncio
+
+import gestures
+from fake_touch import Clock, gen_1_remote
+from remote import Touch
+
+try:
+    import gestures_batch
+except ImportError:
+    gestures_batch = None
+
+
+class TestGestures(unittest.TestCase):
+    def setUp(self):
+        self.remote = gen_1_remote()
+        self.t = 0.0
+
+    def report(self, x, y, p=60):
+        """ A report of one touch, 10ms after the last """
+        self.t += 0.01
+        return self.t, [Touch(self.remote, (0, round(self.t * 2461) % 65536, x, y, p))]
+
+    def swipe(self, dx, n=20):
+        reports = [self.report(i * dx, 0) for i in range(n)]
+        reports.append(self.report((n - 1) * dx, 0, 0))
+        return reports
+
+    def taps(self, count):
+        reports = []
+        for _ in range(count):
+            reports += [self.report(0, 0) for _ in range(10)]
+            reports.append(self.report(0, 0, 0))
+            self.t += 0.15
+        return reports
+
+    def test_multitap_clock(self):
+        clock = Clock()
+        events = []
+        recognizer = gestures.MultiTapRecognizer(1, 3, lambda r, e: events.append(e.type), clock)
+        for t, touches in self.taps(3):
+            clock.now = t
+            recognizer.touches(self.remote, touches)
+        self.assertTrue(events[-1] & gestures.EventType.Detected)
+
+        # Too slow to be a triple tap
+        events.clear()
+        for t, touches in self.taps(3):
+            clock.now = t * 4
+            recognizer.touches(self.remote, touches)
+        self.assertFalse(any(e & gestures.EventType.Detected for e in events))
+
+    def swipe_events(self, reports, predict=True):
+        events = []
+        recognizer = gestures.SwipeRecognizer(
+            lambda r, e: events.append(e) if e.type & gestures.EventType.Detected else None)
+        if not predict:
+            for r in recognizer.rs:
+                r.predict_horizon_sec = 0
+        for i, (t, touches) in enumerate(reports):
+            count = len(events)
+            recognizer.touches(self.remote, touches)
+            for e in events[count:]:
+                e.sample = i
+        return events
+
+    def steps(self, events):
+        """ The net steps a swipe makes, including its glide """
+        total = 0
+        for e in events:
+            counter = e.x + e.y
+            if e.type & gestures.EventType.End and e.velocity != 0:
+                total += counter - (e.early_steps if counter > 0 else -e.early_steps)
+            else:
+                total += counter
+        return total
+
+    def test_swipe_prediction(self):
+        reports = self.swipe(60)
+        predicted = self.swipe_events(reports)
+        unpredicted = self.swipe_events(reports, predict=False)
+        # The first key goes out earlier, and the swipe steps as far
+        self.assertEqual((predicted[0].x, predicted[0].y), (1, 0))
+        self.assertLess(predicted[0].sample, unpredicted[0].sample)
+        self.assertEqual(self.steps(predicted), self.steps(unpredicted))
+
+        # Resting fingers aren't predicted
+        self.t = 0
+        reports = [self.report(5 * (i % 3), 5 * (i % 2)) for i in range(60)]
+        reports.append(self.report(0, 0, 0))
+        self.assertEqual(self.swipe_events(reports), [])
+
+    def test_swipe_misprediction(self):
+        # Flick, then stop short of the threshold, and rest
+        reports = [self.report(i * 50, 0) for i in range(5)]
+        reports += [self.report(200, 0) for _ in range(100)]
+        reports.append(self.report(200, 0, 0))
+        events = self.swipe_events(reports)
+        # The early step stands, rather than sending the opposite key
+        self.assertEqual([(e.x, e.y) for e in events], [(1, 0)])
+        self.assertEqual(self.steps(events), 1)
+
+        # Flick one way, then swipe the other. The early step isn't taken off.
+        self.t = 0
+        reports = [self.report(200 + i * 50, 0) for i in range(5)]
+        reports += [self.report(400 - i * 60, 0) for i in range(20)]
+        reports.append(self.report(400 - 19 * 60, 0, 0))
+        events = self.swipe_events(reports)
+        unpredicted = self.swipe_events(reports, predict=False)
+        self.assertEqual((events[0].x, events[0].y), (1, 0))
+        self.assertLess(self.steps(unpredicted), 0)
+        self.assertEqual(self.steps(events), self.steps(unpredicted) + 1)
+        self.assertEqual(events[-1].early_steps, 0)
+
+    @unittest.skipIf(gestures_batch is None, 'NumPy is not installed')
+    def test_batched_decisions_match(self):
+        reports = self.swipe(40) + self.taps(3) + self.swipe(-25) + self.taps(2) + self.swipe(3)
+
+        def recorder(decisions):
+            def callback(recognizer, event):
+                if event.type & gestures.EventType.Detected:
+                    decisions.append((event.x, event.y))
+            return callback
+
+        swipes, taps = [], []
+        clock = Clock()
+        swipe = gestures.SwipeRecognizer(recorder(swipes))
+        multitap = gestures.MultiTapRecognizer(1, 3, recorder(taps), clock)
+        for t, touches in reports:
+            clock.now = t
+            swipe.touches(self.remote, touches)
+            multitap.touches(self.remote, touches)
+        self.assertTrue(any(x < 0 for x, _ in swipes))
+        self.assertTrue(taps)
+
+        for window in (1, 3, 16, len(reports)):
+            batched_swipes, batched_taps = [], []
+            swipe = gestures_batch.BatchSwipeRecognizer(recorder(batched_swipes))
+            multitap = gestures_batch.BatchMultiTapRecognizer(1, 3, recorder(batched_taps))
+            for i in range(0, len(reports), window):
+                swipe.reports(self.remote, reports[i:i + window])
+                multitap.reports(self.remote, reports[i:i + window])
+            self.assertEqual(batched_swipes, swipes, f'window {window}')
+            self.assertEqual(batched_taps, taps, f'window {window}')
+
+
+
+class TestKineticScroller(unittest.TestCase):
+    def test_glide(self):
+        async def glide():
+            steps = []
+            loop = asyncio.get_running_loop()
+            scroller = gestures.KineticScroller(
+                lambda axis, direction: steps.append((loop.time(), axis, direction)))
+            scroller.deceleration = 250
+            scroller.distance_thresholds_mm = (7, 7)
+            scroller.min_interval_sec = 0.02
+            start = loop.time()
+            # Glides 400^2 / (2 * 250) = 320mm in 1.6s, for 45 steps, the last at 1.4s
+            scroller.start(1, -400)
+            self.assertAlmostEqual(scroller.step_time(45), 1.4)
+            self.assertIsNone(scroller.step_time(46))
+            await asyncio.sleep(1.8)
+            self.assertFalse(scroller.is_running())
+            # A late timer merges steps, so only the glide's own count is exact
+            self.assertEqual(scroller.steps, 45)
+            self.assertGreaterEqual(len(steps), 40)
+            self.assertTrue(all(s[1:] == (1, -1) for s in steps))
+            # The glide slows down
+            times = [s[0] - start for s in steps]
+            intervals = [b - a for a, b in zip(times, times[1:])]
+            self.assertLess(intervals[0], intervals[-1])
+            self.assertTrue(all(i >= 0.019 for i in intervals))
+
+            # Steps don't come faster than the bus can take them, and the glide still stops when
+            # its motion does, with fewer steps
+            steps.clear()
+            scroller.min_interval_sec = 0.1
+            start = loop.time()
+            scroller.start(0, 400)
+            await asyncio.sleep(0.55)
+            self.assertLessEqual(len(steps), 6)
+            self.assertTrue(scroller.is_running())
+            await asyncio.sleep(1.2)
+            self.assertFalse(scroller.is_running())
+            times = [s[0] - start for s in steps]
+            intervals = [b - a for a, b in zip(times, times[1:])]
+            self.assertTrue(all(i >= 0.099 for i in intervals))
+            self.assertLessEqual(times[-1], 1.6 + 0.01)
+            self.assertLessEqual(len(steps), 17)
+            self.assertGreaterEqual(len(steps), 14)
+
+            # A new touch stops the glide at once
+            scroller.start(0, 400)
+            await asyncio.sleep(0.3)
+            scroller.cancel()
+            count = len(steps)
+            await asyncio.sleep(0.3)
+            self.assertEqual(len(steps), count)
+
+            # Steps sent early aren't sent again
+            steps.clear()
+            scroller.min_interval_sec = 0.02
+            scroller.start(1, -400, early_steps=1)
+            await asyncio.sleep(1.8)
+            self.assertEqual(scroller.steps, 45)
+            self.assertLessEqual(len(steps), 44)
+        asyncio.run(glide())
+
+
+if __name__ == '__main__':
+    unittest.main()
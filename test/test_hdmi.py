@@ -308,6 +308,80 @@ class TestControllerImpl(unittest.TestCase):
         # Should still be the same activity
         self.assertEqual(self.ctrl.current_activity.name, 'Watch TV')
 
+    def test_newer_set_activity_replans_from_partial_state(self):
+        tv = self.ctrl.devices['TV'].dev
+        lr = self.ctrl.devices['Living Room'].dev
+        ps5 = self.ctrl.devices['PlayStation5'].dev
+        async def run():
+            gate = asyncio.Event()
+            async def slow_power_on():
+                await gate.wait()
+            tv.power_on.side_effect = slow_power_on
+            first = asyncio.create_task(self.ctrl.set_activity(0))
+            await asyncio.sleep(0)
+            second = asyncio.create_task(self.ctrl.set_activity(1))
+            await asyncio.sleep(0)
+            gate.set()
+            return await first, await second
+        first, second = asyncio.run(run())
+        self.assertFalse(first)
+        self.assertTrue(second)
+        self.assertEqual(self.ctrl.current_activity.name, 'Play PS5')
+        # The TV is shared, so it's powered on once, and never put in standby
+        tv.power_on.assert_called_once()
+        tv.standby.assert_not_called()
+        # Living Room was never reached
+        lr.power_on.assert_not_called()
+        lr.standby.assert_not_called()
+        ps5.power_on.assert_called_once()
+        self.assertEqual(list(self.ctrl.active_devices), ['TV', 'PlayStation5', 'AVR-X3400H'])
+
+    def test_cancelled_set_activity_powers_on_again(self):
+        tv = self.ctrl.devices['TV'].dev
+        async def run():
+            gate = asyncio.Event()
+            async def slow_power_on():
+                await gate.wait()
+            tv.power_on.side_effect = slow_power_on
+            first = asyncio.create_task(self.ctrl.set_activity(0))
+            await asyncio.sleep(0)
+            first.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await first
+            tv.power_on.side_effect = None
+            return await self.ctrl.set_activity(1)
+        self.assertTrue(asyncio.run(run()))
+        # The TV never got its first power on, so it gets it now
+        self.assertEqual(tv.power_on.call_count, 2)
+        self.assertEqual(list(self.ctrl.active_devices), ['TV', 'PlayStation5', 'AVR-X3400H'])
+
+    def test_force_standby_abandons_transition(self):
+        tv = self.ctrl.devices['TV'].dev
+        lr = self.ctrl.devices['Living Room'].dev
+        async def run():
+            gate = asyncio.Event()
+            async def slow_power_on():
+                await gate.wait()
+            tv.power_on.side_effect = slow_power_on
+            transition = asyncio.create_task(self.ctrl.set_activity(0))
+            await asyncio.sleep(0)
+            await self.ctrl.force_standby()
+            gate.set()
+            return await transition
+        self.assertFalse(asyncio.run(run()))
+        self.assertEqual(self.ctrl.current_activity.name, 'No Activity')
+        # Only the power on that was already on the wire went out
+        self.assertEqual(list(self.ctrl.active_devices), ['TV'])
+        lr.power_on.assert_not_called()
+        self.ctrl.front_adapter.active_source.assert_not_called()
+
+    def test_switch_standbys_only_unshared_devices(self):
+        asyncio.run(self.ctrl.set_activity(0))
+        asyncio.run(self.ctrl.set_activity(1))
+        self.ctrl.devices['Living Room'].dev.standby.assert_called_once()
+        self.ctrl.devices['TV'].dev.standby.assert_not_called()
+        self.ctrl.devices['TV'].dev.power_on.assert_called_once()
+
     def test_get_device_found(self):
         device = asyncio.run(self.ctrl.get_device('TV'))
         self.assertIsNotNone(device)
@@ -8,11 +8,13 @@ import test_common
 from test_common import make_taskit_mock
 
 import unittest
-from unittest.mock import Mock, patch, AsyncMock
+from unittest.mock import Mock, patch, AsyncMock, call
 import asyncio
 import time
 
-from main import Hub, KeyState
+from main import Hub, HubControl, HubSource, KeyState
+import macros
+import messaging
 from hdmi import Key, no_activity
 
 
@@ -29,11 +31,29 @@ class MockController:
 
 
 class MockPipe:
-    """Mock pipe for testing"""
+    """Mock pipe for testing, that records the notifications the hub publishes"""
+    count = 0
+
     def __init__(self):
-        self.notify_set_activity = Mock()
-        self.notify_battery_state = Mock()
-        self.start_server_task = Mock()
+        MockPipe.count += 1
+        self.name = f'mock{MockPipe.count}'
+        self.sub = None
+        self.start_server_task = Mock(side_effect=self.subscribe)
+
+    def subscribe(self, handler):
+        self.sub = handler.hub.bus.subscribe('mock', messaging.notification_event_types)
+
+    def notices(self, event_type):
+        events = []
+        while not self.sub.empty():
+            events.append(self.sub.get_nowait())
+        return [e for e in events if type(e) is event_type]
+
+    def activity_notices(self):
+        return [e.index for e in self.notices(messaging.ActivityNotice)]
+
+    def battery_notices(self):
+        return [(e.level, e.is_charging, e.is_low) for e in self.notices(messaging.BatteryNotice)]
 
 
 class TestKeyState(unittest.TestCase):
@@ -141,7 +161,11 @@ class TestHubSync(unittest.TestCase):
 
         self.assertEqual(len(self.hub.pipes), 1)
         self.assertEqual(self.hub.pipes[0], pipe)
-        pipe.start_server_task.assert_called_once_with(self.hub)
+        pipe.start_server_task.assert_called_once()
+        handler = pipe.start_server_task.call_args.args[0]
+        self.assertIsInstance(handler, HubSource)
+        self.assertIs(handler.hub, self.hub)
+        self.assertEqual(handler.name, pipe.name)
 
     def test_add_multiple_pipes(self):
         """Test adding multiple pipes"""
@@ -239,7 +263,7 @@ class TestHubAsync(unittest.IsolatedAsyncioTestCase):
 
         self.assertTrue(result)
         self.controller.set_activity.assert_called_once_with(2)
-        pipe.notify_set_activity.assert_called_once_with(2)
+        self.assertEqual(pipe.activity_notices(), [2])
         self.assertTrue(self.hub.wait_for_release)
 
     async def test_set_activity_failure(self):
@@ -251,7 +275,7 @@ class TestHubAsync(unittest.IsolatedAsyncioTestCase):
         result = await self.hub.set_activity(2)
 
         self.assertFalse(result)
-        pipe.notify_set_activity.assert_not_called()
+        self.assertEqual(pipe.activity_notices(), [])
 
     async def test_standby_from_no_activity(self):
         """Test standby when no activity is active"""
@@ -265,7 +289,7 @@ class TestHubAsync(unittest.IsolatedAsyncioTestCase):
         self.controller.standby.assert_not_called()
         self.assertFalse(self.hub.play_pause_is_playing)
         self.assertTrue(self.hub.wait_for_release)
-        pipe.notify_set_activity.assert_called_once_with(-1)
+        self.assertEqual(pipe.activity_notices(), [-1])
 
     async def test_standby_from_activity(self):
         """Test standby when an activity is active"""
@@ -278,7 +302,7 @@ class TestHubAsync(unittest.IsolatedAsyncioTestCase):
         self.controller.standby.assert_called_once()
         self.controller.force_standby.assert_not_called()
         self.assertFalse(self.hub.play_pause_is_playing)
-        pipe.notify_set_activity.assert_called_once_with(-1)
+        self.assertEqual(pipe.activity_notices(), [-1])
 
     async def test_standby_notifies_all_pipes(self):
         """Test that standby notifies all registered pipes"""
@@ -290,8 +314,71 @@ class TestHubAsync(unittest.IsolatedAsyncioTestCase):
 
         await self.hub.standby()
 
-        pipe1.notify_set_activity.assert_called_once_with(-1)
-        pipe2.notify_set_activity.assert_called_once_with(-1)
+        self.assertEqual(pipe1.activity_notices(), [-1])
+        self.assertEqual(pipe2.activity_notices(), [-1])
+
+    async def test_sources_share_held_key(self):
+        """Test that a key held by two sources is released only by the last holder"""
+        self.hub.client_press_key = AsyncMock()
+        self.hub.client_release_key = AsyncMock()
+        living_room = HubSource(self.hub, 'remote')
+        bedroom = HubSource(self.hub, 'remote.bedroom')
+
+        await living_room.client_press_key(Key.VOLUME_UP)
+        await bedroom.client_press_key(Key.VOLUME_UP)
+        await bedroom.client_release_key(Key.VOLUME_UP)
+        self.hub.client_press_key.assert_called_once_with(Key.VOLUME_UP, 0)
+        self.hub.client_release_key.assert_not_called()
+
+        await living_room.client_release_key(Key.VOLUME_UP)
+        self.hub.client_release_key.assert_called_once_with(Key.VOLUME_UP)
+        self.assertEqual(self.hub.key_holders, {})
+
+    async def test_source_cannot_release_others_keys(self):
+        """Test that a source can't release a key held by another source"""
+        self.hub.client_release_key = AsyncMock()
+        living_room = HubSource(self.hub, 'remote')
+        bedroom = HubSource(self.hub, 'remote.bedroom')
+
+        await living_room.client_press_key(Key.SELECT)
+        await bedroom.client_release_key(Key.SELECT)
+
+        self.hub.client_release_key.assert_not_called()
+        self.assertIn(Key.SELECT, self.hub.key_state)
+
+    async def test_source_counted_presses(self):
+        """Test that counted presses from all sources reach the hub"""
+        self.hub.client_press_key = AsyncMock()
+        await HubSource(self.hub, 'remote').client_press_key(Key.UP, 2)
+        await HubSource(self.hub, 'remote.bedroom').client_press_key(Key.UP, 1)
+        self.assertEqual(self.hub.client_press_key.call_count, 2)
+        self.assertEqual(self.hub.key_holders, {})
+
+    async def test_source_battery_state(self):
+        """Test that the battery of the remote that most needs charging is reported"""
+        pipe = MockPipe()
+        self.hub.add_pipe(pipe)
+
+        await HubSource(self.hub, 'remote').client_battery_state(80, False)
+        await HubSource(self.hub, 'remote.bedroom').client_battery_state(5, False)
+        await HubSource(self.hub, 'remote').client_battery_state(70, False)
+
+        self.assertEqual(pipe.battery_notices(), [(5, False, True)])
+
+    async def test_source_battery_cleared(self):
+        """Test that a source whose last battery went away is no longer reported"""
+        pipe = MockPipe()
+        self.hub.add_pipe(pipe)
+
+        await HubSource(self.hub, 'remote').client_battery_state(80, False)
+        await HubSource(self.hub, 'keyboard').client_battery_state(5, False)
+        await HubSource(self.hub, 'keyboard').client_battery_state(None, False)
+        await HubSource(self.hub, 'keyboard').client_battery_state(None, False)
+        # The low keyboard battery is no longer reported
+        self.assertEqual(pipe.battery_notices(), [(80, False, False)])
+
+        await HubSource(self.hub, 'remote').client_battery_state(None, False)
+        self.assertEqual(pipe.battery_notices(), [(100, False, False)])
 
     async def test_client_battery_state_normal(self):
         """Test battery state notification with normal level"""
@@ -300,7 +387,7 @@ class TestHubAsync(unittest.IsolatedAsyncioTestCase):
 
         await self.hub.client_battery_state(50, False)
 
-        pipe.notify_battery_state.assert_called_once_with(50, False, False)
+        self.assertEqual(pipe.battery_notices(), [(50, False, False)])
 
     async def test_client_battery_state_low(self):
         """Test battery state notification with low battery"""
@@ -309,7 +396,7 @@ class TestHubAsync(unittest.IsolatedAsyncioTestCase):
 
         await self.hub.client_battery_state(5, False)
 
-        pipe.notify_battery_state.assert_called_once_with(5, False, True)
+        self.assertEqual(pipe.battery_notices(), [(5, False, True)])
 
     async def test_client_battery_state_low_but_charging(self):
         """Test battery state - low but charging is not considered low"""
@@ -318,7 +405,7 @@ class TestHubAsync(unittest.IsolatedAsyncioTestCase):
 
         await self.hub.client_battery_state(5, True)
 
-        pipe.notify_battery_state.assert_called_once_with(5, True, False)
+        self.assertEqual(pipe.battery_notices(), [(5, True, False)])
 
     async def test_client_battery_state_at_threshold(self):
         """Test battery state at exact threshold"""
@@ -327,7 +414,7 @@ class TestHubAsync(unittest.IsolatedAsyncioTestCase):
 
         await self.hub.client_battery_state(10, False)
 
-        pipe.notify_battery_state.assert_called_once_with(10, False, True)
+        self.assertEqual(pipe.battery_notices(), [(10, False, True)])
 
     async def test_client_press_key_during_no_activity(self):
         """Test pressing unflagged key (count=0) when no activity is active"""
@@ -431,12 +518,14 @@ class TestHubAsync(unittest.IsolatedAsyncioTestCase):
         self.controller.current_activity = no_activity
         self.hub.wait_for_release = False
         self.hub.in_macro = False
+        self.hub.taskit = Mock(side_effect=asyncio.ensure_future)
 
         # Simulate short press by setting timestamp in the past
         self.hub.key_state[Key.SELECT] = KeyState(0)
         self.hub.key_state[Key.SELECT].timestamp = time.time() - 0.2
 
         await self.hub.client_release_key(Key.SELECT)
+        await asyncio.sleep(0)
 
         # Should set activity index 0
         self.controller.set_activity.assert_called_once_with(0)
@@ -446,12 +535,14 @@ class TestHubAsync(unittest.IsolatedAsyncioTestCase):
         self.controller.current_activity = Mock()
         self.hub.wait_for_release = False
         self.hub.in_macro = False
+        self.hub.taskit = Mock(side_effect=asyncio.ensure_future)
 
         # Simulate short press of POWER (< 0.5 seconds)
         self.hub.key_state[Key.POWER] = KeyState(0)
         self.hub.key_state[Key.POWER].timestamp = time.time() - 0.2
 
         await self.hub.client_release_key(Key.POWER)
+        await asyncio.sleep(0)
 
         # Should call standby
         self.controller.standby.assert_called_once()
@@ -723,6 +814,7 @@ class TestHubAsync(unittest.IsolatedAsyncioTestCase):
         """Test macro execution when keys are released"""
         self.controller.current_activity = Mock()
         self.hub.wait_for_release = False
+        self.hub.taskit = Mock(side_effect=asyncio.ensure_future)
 
         # Setup macro state
         await self.hub.client_press_key(Key.POWER, 0)
@@ -733,11 +825,226 @@ class TestHubAsync(unittest.IsolatedAsyncioTestCase):
 
         # Release the function key (SELECT)
         await self.hub.client_release_key(Key.SELECT)
+        await asyncio.sleep(0)
 
         # Should execute macro and set activity
         self.assertTrue(self.hub.macro_executed)
         self.controller.set_activity.assert_called()
 
+    async def test_macro_detection_three_key_chord(self):
+        """Test macro detection of a chord with more than two keys"""
+        self.hub.macro_matcher = macros.MacroMatcher([(Key.POWER, Key.UP, Key.RIGHT)])
+        self.hub.macros = self.hub.macro_matcher.macros
+        self.controller.current_activity = Mock()
+        self.hub.wait_for_release = False
+
+        await self.hub.client_press_key(Key.POWER, 0)
+        await self.hub.client_press_key(Key.UP, 0)
+        self.assertFalse(self.hub.in_macro)
+        await self.hub.client_press_key(Key.RIGHT, 0)
+
+        self.assertTrue(self.hub.in_macro)
+        self.assertEqual(self.hub.macro_index, 0)
+
+    async def test_macro_sequence_double_tap(self):
+        """Test a double tap sequence macro executes on release of the second tap"""
+        self.hub.macro_matcher = macros.MacroMatcher([(Key.RIGHT, Key.RIGHT)])
+        self.hub.macros = self.hub.macro_matcher.macros
+        self.hub.long_press_keymap[Key.RIGHT] = Key.F6
+        self.controller.current_activity = Mock()
+        self.hub.wait_for_release = False
+        self.hub.taskit = Mock(side_effect=asyncio.ensure_future)
+
+        await self.hub.client_press_key(Key.RIGHT, 0)
+        self.assertFalse(self.hub.in_macro)
+        await self.hub.client_release_key(Key.RIGHT)
+        await self.hub.client_press_key(Key.RIGHT, 0)
+        self.assertTrue(self.hub.in_macro)
+
+        await self.hub.client_release_key(Key.RIGHT)
+        await asyncio.sleep(0)
+
+        self.controller.set_activity.assert_called_once_with(2)
+        # The first tap was held back, and didn't reach the device
+        await asyncio.sleep(0.5)
+        self.controller.press_key.assert_not_called()
+
+    async def test_macro_sequence_single_tap_passes_through(self):
+        """Test that a press held back for a sequence is sent once the sequence can't match"""
+        self.hub.macro_matcher = macros.MacroMatcher([(Key.RIGHT, Key.RIGHT)], 0.05)
+        self.hub.macros = self.hub.macro_matcher.macros
+        self.controller.current_activity = Mock()
+        self.hub.wait_for_release = False
+        self.hub.taskit = Mock(side_effect=asyncio.ensure_future)
+
+        # The sequence window expires
+        await self.hub.client_press_key(Key.RIGHT, 0)
+        await self.hub.client_release_key(Key.RIGHT)
+        self.controller.press_key.assert_not_called()
+        await asyncio.sleep(0.1)
+        self.controller.press_key.assert_called_once_with(Key.RIGHT, True)
+        self.controller.release_key.assert_called_once()
+
+        # Another key breaks the sequence, and goes after the held back press
+        self.controller.press_key.reset_mock()
+        await self.hub.client_press_key(Key.RIGHT, 0)
+        await self.hub.client_release_key(Key.RIGHT)
+        await self.hub.client_press_key(Key.DOWN, 0)
+        await self.hub.client_release_key(Key.DOWN)
+        await asyncio.sleep(0)
+        self.assertEqual(self.controller.press_key.call_args_list,
+                         [call(Key.RIGHT, True), call(Key.DOWN, True)])
+
+
+    async def test_long_press_promoted_while_held(self):
+        """Test that a long press acts once the duration elapses, without waiting for release"""
+        self.controller.current_activity = no_activity
+        self.hub.wait_for_release = False
+        self.hub.long_press_duration_sec = 0.01
+        self.hub.activity_map[Key.F6] = 5
+
+        await self.hub.client_press_key(Key.SELECT, 0)
+        self.hub.taskit.assert_not_called()
+        await asyncio.sleep(0.05)
+
+        self.hub.taskit.assert_called_once()
+        self.assertTrue(self.hub.key_state[Key.SELECT].handled)
+
+        # The release must not act on the press again
+        await self.hub.client_release_key(Key.SELECT)
+        self.controller.set_activity.assert_not_called()
+
+    async def test_short_press_cancels_long_press(self):
+        """Test that releasing before the long press duration acts as a short press"""
+        self.controller.current_activity = no_activity
+        self.hub.wait_for_release = False
+        self.hub.long_press_duration_sec = 0.05
+        self.hub.activity_map[Key.F6] = 5
+        self.hub.taskit = Mock(side_effect=asyncio.ensure_future)
+
+        await self.hub.client_press_key(Key.SELECT, 0)
+        await self.hub.client_release_key(Key.SELECT)
+        await asyncio.sleep(0.1)
+
+        # Only the short press ran
+        self.controller.set_activity.assert_called_once_with(0)
+        self.hub.taskit.assert_called_once()
+
+    async def test_release_not_held_up_by_activity_change(self):
+        """Test that keys are handled while an activity change started by a release runs"""
+        self.controller.current_activity = no_activity
+        self.hub.wait_for_release = False
+        self.hub.taskit = Mock(side_effect=asyncio.ensure_future)
+        gate = asyncio.Event()
+        async def slow_set_activity(index):
+            await gate.wait()
+            return True
+        self.controller.set_activity.side_effect = slow_set_activity
+
+        await self.hub.client_press_key(Key.SELECT, 0)
+        await asyncio.wait_for(self.hub.client_release_key(Key.SELECT), 0.1)
+        await asyncio.sleep(0)
+        self.controller.set_activity.assert_called_once_with(0)
+
+        # The change is still in flight, and a later key is handled meanwhile
+        await asyncio.wait_for(self.hub.client_press_key(Key.DOWN, 0), 0.1)
+        await asyncio.wait_for(self.hub.client_release_key(Key.DOWN), 0.1)
+        self.assertEqual(self.hub.key_state, {})
+        self.assertFalse(gate.is_set())
+        gate.set()
+        await asyncio.sleep(0)
+
+    async def test_speculative_short_press(self):
+        """Test that a key without a distinct long press acts immediately on press"""
+        self.controller.current_activity = no_activity
+        self.hub.wait_for_release = False
+
+        await self.hub.client_press_key(Key.UP, 0)
+
+        # UP has no long press mapping, so there is nothing to wait for
+        self.hub.taskit.assert_called_once()
+        self.assertTrue(self.hub.key_state[Key.UP].handled)
+        await self.hub.client_release_key(Key.UP)
+        self.controller.set_activity.assert_not_called()
+
+    async def test_power_long_press_promoted_when_not_in_chord(self):
+        """Test that holding POWER fixes the activity without waiting for release"""
+        self.hub.macro_matcher = macros.MacroMatcher([(Key.F1, )])
+        self.hub.macros = self.hub.macro_matcher.macros
+        self.controller.current_activity = Mock()
+        self.hub.wait_for_release = False
+        self.hub.long_press_duration_sec = 0.01
+        self.hub.taskit = Mock(side_effect=asyncio.ensure_future)
+
+        await self.hub.client_press_key(Key.POWER, 0)
+        await asyncio.sleep(0.05)
+        self.controller.fix_current_activity.assert_called_once()
+
+        await self.hub.client_release_key(Key.POWER)
+        self.controller.standby.assert_not_called()
+        self.controller.fix_current_activity.assert_called_once()
+
+    async def test_power_hold_is_not_long_press_when_in_chord(self):
+        """Test that holding POWER doesn't act when POWER starts a chord"""
+        self.controller.current_activity = Mock()
+        self.hub.wait_for_release = False
+        self.hub.long_press_duration_sec = 0.01
+
+        await self.hub.client_press_key(Key.POWER, 0)
+        await asyncio.sleep(0.05)
+
+        self.hub.taskit.assert_not_called()
+
+
+class TestHubControl(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the hub's IPC ops"""
+
+    async def asyncSetUp(self):
+        test_common.mock_config['hub.activity_map'] = {}
+        test_common.mock_config['hub.macros'] = []
+        test_common.mock_config['hub.long_press.keymap'] = {}
+        test_common.mock_config['hub.short_press.keymap'] = {}
+        self.controller = MockController()
+        self.controller.current_activity = no_activity
+        self.controller.activities = [Mock(), Mock()]
+        self.controller.activities[0].name = 'Watch TV'
+        self.controller.activities[1].name = 'Play PS5'
+        self.controller.devices = {}
+        self.controller.rescan_devices = AsyncMock()
+        self.hub = Hub(self.controller)
+        self.pipe = messaging.Pipe(self.hub.bus, 'ipc')
+        self.sub = self.hub.bus.subscribe('test', (messaging.SetActivity, messaging.KeyPress))
+        self.control = HubControl(self.hub, self.pipe)
+
+    async def test_set_activity(self):
+        reply = await self.control.server.handle_request({'op': 'set_activity', 'index': 1})
+        self.assertEqual(reply['status'], 'OK')
+        self.assertEqual(self.sub.get_nowait().index, 1)
+
+    async def test_set_activity_out_of_bounds(self):
+        reply = await self.control.server.handle_request({'op': 'set_activity', 'index': 2})
+        self.assertNotEqual(reply['status'], 'OK')
+        self.assertTrue(self.sub.empty())
+
+    async def test_key(self):
+        await self.control.server.handle_request({'op': 'key', 'key': int(Key.SELECT)})
+        event = self.sub.get_nowait()
+        self.assertEqual((event.key, event.count), (Key.SELECT, 1))
+
+    async def test_scan_forces_rescan(self):
+        reply = await self.control.server.handle_request({'op': 'scan'})
+        self.controller.rescan_devices.assert_called_once_with(force=True)
+        self.assertEqual(reply['devices'], [])
+
+    async def test_status(self):
+        reply = await self.control.server.handle_request({'op': 'status'})
+        self.assertEqual(reply['activity'], -1)
+        self.assertEqual(reply['activities'], ['Watch TV', 'Play PS5'])
+
+    async def test_stats(self):
+        reply = await self.control.server.handle_request({'op': 'stats'})
+        self.assertIn('test', reply['bus'])
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,52 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import test_common
+
+import unittest
+import asyncio, os, tempfile
+
+import inotify
+
+
+class TestInotify(unittest.TestCase):
+    def test_watch(self):
+        async def watch():
+            events = []
+            changed = asyncio.Event()
+            def callback(mask, path):
+                events.append((mask & ~inotify.IN_ISDIR, os.path.basename(path)))
+                changed.set()
+
+            async def wait_for(count):
+                while len(events) < count:
+                    changed.clear()
+                    await asyncio.wait_for(changed.wait(), 1)
+
+            with tempfile.TemporaryDirectory() as path:
+                mask = inotify.IN_CREATE | inotify.IN_ATTRIB | inotify.IN_DELETE
+                watcher = inotify.Watcher(path, mask, callback, asyncio.get_running_loop())
+                device = os.path.join(path, 'event3')
+                with open(device, 'w'):
+                    pass
+                await wait_for(1)
+                os.chmod(device, 0o660)
+                await wait_for(2)
+                os.remove(device)
+                await wait_for(3)
+                self.assertEqual(events, [(inotify.IN_CREATE, 'event3'),
+                                          (inotify.IN_ATTRIB, 'event3'),
+                                          (inotify.IN_DELETE, 'event3')])
+                watcher.close()
+                self.assertIsNone(watcher.fd)
+
+            with self.assertRaises(OSError):
+                inotify.Watcher('/nonexistent', mask, callback, asyncio.get_running_loop())
+        asyncio.run(watch())
+
+
+if __name__ == '__main__':
+    unittest.main()
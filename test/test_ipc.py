@@ -0,0 +1,76 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import test_common
+
+import unittest
+import asyncio, os, struct, tempfile
+
+import ipc
+
+
+class TestIpc(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'run', 'hub.sock')
+        self.server = ipc.Server(self.path)
+        async def echo(request):
+            return {'echo': request['value']}
+        async def fail(request):
+            return {'status': 'Nope'}
+        self.server.add_op('echo', echo)
+        self.server.add_op('fail', fail)
+        await self.server.start()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+        self.tmp.cleanup()
+
+    async def test_request(self):
+        reply = await ipc.request('echo', self.path, value=[1, 'two'])
+        self.assertEqual(reply, {'echo': [1, 'two'], 'status': 'OK'})
+
+    async def test_error_status(self):
+        reply = await ipc.request('fail', self.path)
+        self.assertEqual(reply['status'], 'Nope')
+
+    async def test_unknown_op(self):
+        reply = await ipc.request('nope', self.path)
+        self.assertEqual(reply['status'], 'Unknown op nope')
+
+    async def test_bad_request(self):
+        reply = await ipc.request('echo', self.path)
+        self.assertTrue(reply['status'].startswith('Bad echo request'))
+
+    async def test_no_hub(self):
+        self.assertIsNone(await ipc.request('echo', os.path.join(self.tmp.name, 'none.sock')))
+
+    async def test_multiple_requests_on_connection(self):
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        for value in range(3):
+            ipc.write_frame(writer, {'op': 'echo', 'value': value})
+        replies = [await ipc.read_frame(reader) for _ in range(3)]
+        self.assertEqual([reply['echo'] for reply in replies], [0, 1, 2])
+        writer.close()
+
+    async def test_oversized_frame_drops_connection(self):
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        writer.write(struct.pack('>I', ipc.max_frame_len + 1))
+        self.assertEqual(await reader.read(), b'')
+        writer.close()
+
+    async def test_bad_json_drops_connection(self):
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        writer.write(struct.pack('>I', 3) + b'{{{')
+        self.assertEqual(await reader.read(), b'')
+        writer.close()
+
+    async def test_socket_is_private(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+
+if __name__ == '__main__':
+    unittest.main()
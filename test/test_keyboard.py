@@ -0,0 +1,123 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import test_common
+from test_common import make_taskit_mock
+
+import unittest
+from unittest.mock import Mock, call, patch
+
+import evdev
+import evdev.ecodes as e
+from evdev import KeyEvent
+
+import keyboard
+from hdmi import Key
+
+
+def make_handler():
+    with patch.object(keyboard.tools, 'Tasker', return_value=make_taskit_mock()):
+        return keyboard.Handler(Mock())
+
+
+class TestBattery(unittest.TestCase):
+    def setUp(self):
+        test_common.mock_config['remote.mac'] = 'AA:BB:CC:DD:EE:FF'
+        test_common.mock_config['remote.additional'] = [{'mac': 'AA:BB:CC:DD:EE:FE'}]
+        self.handler = make_handler()
+        self.pipe = self.handler.pipe
+
+    def tearDown(self):
+        test_common.mock_config['remote.mac'] = None
+        test_common.mock_config['remote.additional'] = []
+
+    def test_battery_changed(self):
+        self.handler.battery_changed('11:22:33:44:55:01', 80)
+        self.handler.battery_changed('11:22:33:44:55:02', 40)
+        self.handler.battery_changed('11:22:33:44:55:01', 30)
+        self.assertEqual([c.args for c in self.pipe.battery_state.call_args_list],
+                         [(80, False), (40, False), (30, False)])
+
+        # The lowest is reported, until the last battery goes
+        self.pipe.reset_mock()
+        self.handler.battery_changed('11:22:33:44:55:01', None)
+        self.pipe.battery_state.assert_called_once_with(40, False)
+        self.handler.battery_changed('11:22:33:44:55:03', None)
+        self.handler.battery_changed('11:22:33:44:55:02', None)
+        self.pipe.battery_state.assert_called_once_with(40, False)
+        self.pipe.clear_battery_state.assert_called_once_with()
+
+    def test_siri_remotes_excluded(self):
+        self.handler.battery_changed('aa:bb:cc:dd:ee:ff', 5)
+        self.handler.battery_changed('AA:BB:CC:DD:EE:FE', 5)
+        self.handler.battery_changed('AA:BB:CC:DD:EE:FE', None)
+        self.pipe.battery_state.assert_not_called()
+        self.pipe.clear_battery_state.assert_not_called()
+        self.assertEqual(self.handler.batteries, {})
+
+
+def key(code, value, sec=0.0):
+    return evdev.InputEvent(int(sec), int(sec % 1 * 1000000), e.EV_KEY, code, value)
+
+
+class TestAutorepeat(unittest.TestCase):
+    def tearDown(self):
+        test_common.mock_config['keyboard.autorepeat.policy'] = 'hold'
+        test_common.mock_config['keyboard.autorepeat.keys'] = {}
+
+    def make_handler(self, policy, keys={}):
+        test_common.mock_config['keyboard.autorepeat.policy'] = policy
+        test_common.mock_config['keyboard.autorepeat.keys'] = keys
+        return make_handler()
+
+    def send(self, handler, *events):
+        for event in events:
+            handler.dispatch_input_event(event)
+
+    def test_hold(self):
+        handler = self.make_handler('hold')
+        self.send(handler, key(e.KEY_UP, KeyEvent.key_down), key(e.KEY_UP, KeyEvent.key_hold),
+                  key(e.KEY_UP, KeyEvent.key_hold), key(e.KEY_UP, KeyEvent.key_up))
+        self.assertEqual(handler.pipe.mock_calls, [call.key_press(Key.UP), call.key_release(Key.UP)])
+
+        # A repeat of a key whose key down was missed presses it
+        handler.pipe.reset_mock()
+        self.send(handler, key(e.KEY_UP, KeyEvent.key_hold), key(e.KEY_UP, KeyEvent.key_hold),
+                  key(e.KEY_UP, KeyEvent.key_up), key(e.KEY_UP, KeyEvent.key_up))
+        self.assertEqual(handler.pipe.mock_calls, [call.key_press(Key.UP), call.key_release(Key.UP)])
+
+    def test_pass(self):
+        handler = self.make_handler('pass')
+        self.send(handler, key(e.KEY_UP, KeyEvent.key_down), key(e.KEY_UP, KeyEvent.key_hold),
+                  key(e.KEY_UP, KeyEvent.key_hold), key(e.KEY_UP, KeyEvent.key_up))
+        self.assertEqual(handler.pipe.mock_calls, [call.key_press(Key.UP, 1)] * 3)
+
+    def test_rate_limit(self):
+        handler = self.make_handler('hold', {Key.VOLUME_UP: 'rate_limit'})
+        # Limited by the events' timestamps, at most one every 0.25s
+        self.send(handler, *(key(e.KEY_VOLUMEUP, KeyEvent.key_hold if i else KeyEvent.key_down,
+                                 100 + i * 0.1) for i in range(8)))
+        self.send(handler, key(e.KEY_VOLUMEUP, KeyEvent.key_up, 100.8))
+        self.assertEqual(handler.pipe.mock_calls, [call.key_press(Key.VOLUME_UP, 1)] * 3)
+
+        # Other keys keep the default policy
+        handler.pipe.reset_mock()
+        self.send(handler, key(e.KEY_UP, KeyEvent.key_down), key(e.KEY_UP, KeyEvent.key_hold),
+                  key(e.KEY_UP, KeyEvent.key_up))
+        self.assertEqual(handler.pipe.mock_calls, [call.key_press(Key.UP), call.key_release(Key.UP)])
+
+    def test_unknown_policy(self):
+        handler = self.make_handler('repeat', {Key.VOLUME_UP: 'often'})
+        self.assertEqual(handler.autorepeat_policy, 'hold')
+        self.assertEqual(handler.autorepeat_keys, {Key.VOLUME_UP: 'hold'})
+        self.send(handler, key(e.KEY_VOLUMEUP, KeyEvent.key_down),
+                  key(e.KEY_VOLUMEUP, KeyEvent.key_hold), key(e.KEY_VOLUMEUP, KeyEvent.key_up))
+        self.assertEqual(handler.pipe.mock_calls, [call.key_press(Key.VOLUME_UP),
+                                                   call.key_release(Key.VOLUME_UP)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import test_common
+
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+import asyncio, time
+
+import latency
+import messaging
+
+
+class LatencyTestCase(unittest.TestCase):
+    def setUp(self):
+        latency.enable()
+        latency.sources.clear()
+
+    def tearDown(self):
+        latency.enabled = False
+        latency.sources.clear()
+
+
+class TestHistogram(unittest.TestCase):
+    def test_stats(self):
+        h = latency.Histogram()
+        for ms in (0.5, 3, 3, 40, 1500):
+            h.add(ms)
+        stats = h.stats()
+        self.assertEqual(stats['count'], 5)
+        self.assertEqual(stats['p50_ms'], 5)
+        self.assertEqual(stats['max_ms'], 1500)
+        self.assertEqual(stats['p99_ms'], 1500)
+        self.assertEqual(stats['buckets_ms'][1], 1)
+        self.assertEqual(stats['buckets_ms'][5], 2)
+
+    def test_empty(self):
+        self.assertEqual(latency.Histogram().stats()['mean_ms'], 0)
+
+
+class TestTracing(LatencyTestCase):
+    def test_disabled(self):
+        latency.enabled = False
+        latency.begin('keyboard')
+        latency.hop('hub')
+        self.assertIsNone(latency.current())
+        latency.end(0)
+        self.assertEqual(latency.stats(), {})
+
+    def test_trace_closed_by_tx_ts(self):
+        async def run():
+            latency.begin('keyboard')
+            latency.hop('hub')
+            latency.end(time.monotonic_ns())
+            # Only the first transmission closes the trace
+            latency.end(time.monotonic_ns())
+        asyncio.run(run())
+        stats = latency.stats()['keyboard']
+        self.assertEqual(stats['total']['count'], 1)
+        self.assertEqual(set(stats['hops']), {'hub', 'wire'})
+
+    def test_trace_follows_tasks(self):
+        async def run():
+            latency.begin('mqtt')
+            async def press():
+                latency.hop('press')
+                latency.end(0)
+            await asyncio.create_task(press())
+        asyncio.run(run())
+        self.assertIn('press', latency.stats()['mqtt']['hops'])
+
+    def test_trace_crosses_bus(self):
+        handler = MagicMock()
+        async def press(key, count=0):
+            latency.hop('hub')
+            latency.end(0)
+        handler.client_press_key = AsyncMock(side_effect=press)
+        async def run():
+            pipe = messaging.Pipe()
+            pipe.taskit = asyncio.ensure_future
+            pipe.start_server_task(handler)
+            latency.begin('remote')
+            pipe.key_press(1)
+            # The trace travels with the event, not the publisher's context
+            latency.attach(None)
+            for _ in range(5):
+                await asyncio.sleep(0)
+            pipe.server_t.cancel()
+        asyncio.run(run())
+        self.assertEqual(list(latency.stats()['remote']['hops']), ['publish', 'dispatch', 'hub', 'wire'])
+
+    def test_chrome_trace(self):
+        async def run():
+            latency.begin('ipc')
+            latency.hop('hub')
+            latency.end(0)
+        asyncio.run(run())
+        events = latency.chrome_trace()['traceEvents']
+        self.assertEqual([e['name'] for e in events[-2:]], ['hub', 'wire'])
+        self.assertTrue(all(e['ph'] == 'X' and e['dur'] >= 0 for e in events))
+
+
+if __name__ == '__main__':
+    unittest.main()
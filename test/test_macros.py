@@ -0,0 +1,97 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import test_common
+
+import unittest
+
+from cec import Key
+from macros import MacroMatcher
+
+
+class TestChords(unittest.TestCase):
+    def setUp(self):
+        self.matcher = MacroMatcher([
+            (Key.POWER, Key.SELECT),
+            (Key.POWER, Key.UP),
+            (Key.POWER, Key.UP, Key.RIGHT),
+            (Key.F1, ),
+        ])
+
+    def test_no_match(self):
+        self.assertIsNone(self.matcher.match(Key.SELECT, {Key.SELECT: None}))
+
+    def test_two_key_chord(self):
+        held = {Key.POWER: None, Key.SELECT: None}
+        self.assertEqual(self.matcher.match(Key.SELECT, held), 0)
+
+    def test_order_does_not_matter(self):
+        held = {Key.SELECT: None, Key.POWER: None}
+        self.assertEqual(self.matcher.match(Key.POWER, held), 0)
+
+    def test_first_configured_chord_wins(self):
+        held = {Key.POWER: None, Key.UP: None, Key.RIGHT: None}
+        self.assertEqual(self.matcher.match(Key.RIGHT, held), 1)
+
+    def test_three_key_chord(self):
+        matcher = MacroMatcher([(Key.POWER, Key.UP, Key.RIGHT), (Key.POWER, Key.UP)])
+        held = {Key.POWER: None, Key.UP: None, Key.RIGHT: None}
+        self.assertEqual(matcher.match(Key.RIGHT, held), 0)
+
+    def test_single_key_chord(self):
+        self.assertEqual(self.matcher.match(Key.F1, {Key.F1: None}), 3)
+
+    def test_unrelated_held_keys_are_ignored(self):
+        held = {Key.POWER: None, Key.SELECT: None, Key.VOLUME_UP: None}
+        self.assertEqual(self.matcher.match(Key.VOLUME_UP, held), 0)
+
+    def test_cached_result_is_consistent(self):
+        held = {Key.POWER: None, Key.UP: None}
+        self.assertEqual(self.matcher.match(Key.UP, held), 1)
+        self.assertEqual(self.matcher.match(Key.UP, held), 1)
+        self.assertEqual(len(self.matcher.chord_cache), 1)
+
+
+class TestSequences(unittest.TestCase):
+    def setUp(self):
+        self.matcher = MacroMatcher([
+            (Key.POWER, Key.SELECT),
+            (Key.SELECT, Key.SELECT),
+        ], sequence_window_sec=.4)
+
+    def test_double_tap(self):
+        self.assertIsNone(self.matcher.match(Key.SELECT, {Key.SELECT: None}, now=10.0))
+        self.assertEqual(self.matcher.match(Key.SELECT, {Key.SELECT: None}, now=10.2), 1)
+
+    def test_double_tap_too_slow(self):
+        self.assertIsNone(self.matcher.match(Key.SELECT, {Key.SELECT: None}, now=10.0))
+        self.assertIsNone(self.matcher.match(Key.SELECT, {Key.SELECT: None}, now=10.5))
+
+    def test_double_tap_interrupted(self):
+        self.assertIsNone(self.matcher.match(Key.SELECT, {Key.SELECT: None}, now=10.0))
+        self.assertIsNone(self.matcher.match(Key.UP, {Key.UP: None}, now=10.1))
+        self.assertIsNone(self.matcher.match(Key.SELECT, {Key.SELECT: None}, now=10.2))
+
+    def test_triple_tap_matches_once(self):
+        self.assertIsNone(self.matcher.match(Key.SELECT, {}, now=10.0))
+        self.assertEqual(self.matcher.match(Key.SELECT, {}, now=10.1), 1)
+        self.assertIsNone(self.matcher.match(Key.SELECT, {}, now=10.2))
+
+    def test_pending(self):
+        self.assertFalse(self.matcher.is_pending())
+        self.matcher.match(Key.SELECT, {Key.SELECT: None}, now=10.0)
+        self.assertTrue(self.matcher.is_pending())
+        self.matcher.match(Key.UP, {Key.UP: None}, now=10.1)
+        self.assertFalse(self.matcher.is_pending())
+
+    def test_reset(self):
+        self.assertIsNone(self.matcher.match(Key.SELECT, {}, now=10.0))
+        self.matcher.reset()
+        self.assertIsNone(self.matcher.match(Key.SELECT, {}, now=10.1))
+
+
+if __name__ == '__main__':
+    unittest.main()
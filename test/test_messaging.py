@@ -14,96 +14,165 @@ import asyncio
 import messaging
 
 
-class TestMessage(unittest.TestCase):
-    def test_init_with_type_only(self):
-        msg = messaging.Message(messaging.Type.KeyRelease)
-        self.assertEqual(msg.type, messaging.Type.KeyRelease)
-        self.assertEqual(msg.values, ())
+class TestEvents(unittest.TestCase):
+    def test_set_activity(self):
+        event = messaging.SetActivity(2)
+        self.assertEqual(event.index, 2)
+        self.assertEqual(event.lane, messaging.Lane.Activity)
 
-    def test_init_with_single_value(self):
-        msg = messaging.Message(messaging.Type.SetActivity, 2)
-        self.assertEqual(msg.type, messaging.Type.SetActivity)
-        self.assertEqual(msg.values, (2,))
+    def test_key_press_default_count(self):
+        event = messaging.KeyPress(0x01)
+        self.assertEqual((event.key, event.count), (0x01, 0))
+        self.assertEqual(event.lane, messaging.Lane.Key)
 
-    def test_init_with_multiple_values(self):
-        msg = messaging.Message(messaging.Type.BatteryState, 85, True, False)
-        self.assertEqual(msg.type, messaging.Type.BatteryState)
-        self.assertEqual(msg.values, (85, True, False))
+    def test_battery_notice(self):
+        event = messaging.BatteryNotice(85, True, False)
+        self.assertEqual((event.level, event.is_charging, event.is_low), (85, True, False))
+
+    def test_slots(self):
+        event = messaging.KeyRelease(0x01)
+        with self.assertRaises(AttributeError):
+            event.extra = 1
+
+    def test_repr(self):
+        self.assertEqual(repr(messaging.KeyPress(1, 2)), 'KeyPress(key=1 count=2)')
+
+
+class TestBus(unittest.TestCase):
+    def setUp(self):
+        self.bus = messaging.Bus()
+
+    def test_publish_to_subscriber(self):
+        sub = self.bus.subscribe('test', (messaging.KeyPress, ))
+        self.bus.publish(messaging.KeyPress(1))
+        self.bus.publish(messaging.KeyRelease(1))
+        self.assertEqual(sub.get_nowait().key, 1)
+        self.assertTrue(sub.empty())
+
+    def test_publish_without_subscribers(self):
+        self.bus.publish(messaging.KeyPress(1))
+
+    def test_source_filter(self):
+        a = object()
+        b = object()
+        sub_a = self.bus.subscribe('a', (messaging.KeyPress, ), source=a)
+        sub_all = self.bus.subscribe('all', (messaging.KeyPress, ))
+        self.bus.publish(messaging.KeyPress(1), a)
+        self.bus.publish(messaging.KeyPress(2), b)
+        self.assertEqual(sub_a.get_nowait().key, 1)
+        self.assertTrue(sub_a.empty())
+        self.assertEqual([sub_all.get_nowait().key for _ in range(2)], [1, 2])
+
+    def test_merge(self):
+        sub = self.bus.subscribe('test', (messaging.BatteryState, messaging.KeyPress))
+        self.bus.publish(messaging.BatteryState(90, False))
+        self.bus.publish(messaging.KeyPress(1))
+        self.bus.publish(messaging.BatteryState(85, True))
+        battery = sub.get_nowait()
+        self.assertEqual((battery.level, battery.is_charging), (85, True))
+        self.assertEqual(sub.get_nowait().key, 1)
+        self.assertTrue(sub.empty())
+        self.assertEqual(sub.stats()['merged'], 1)
+
+    def test_bounded_drops_oldest(self):
+        class Sample(messaging.Event):
+            __slots__ = ('value', )
+            droppable = True
+            def __init__(self, value):
+                super().__init__()
+                self.value = value
+        sub = self.bus.subscribe('test', (Sample, messaging.KeyPress), max_len=3)
+        self.bus.publish(messaging.KeyPress(0))
+        for value in range(3):
+            self.bus.publish(Sample(value))
+        # The oldest droppable event goes, rather than the key
+        self.assertEqual(sub.get_nowait().key, 0)
+        self.assertEqual([sub.get_nowait().value for _ in range(2)], [1, 2])
+        self.assertEqual(sub.stats()['dropped'], 1)
+
+    def test_bounded_keeps_keys(self):
+        sub = self.bus.subscribe('test', (messaging.KeyPress, messaging.KeyRelease), max_len=2)
+        for key in range(3):
+            self.bus.publish(messaging.KeyPress(key))
+            self.bus.publish(messaging.KeyRelease(key))
+        events = [sub.get_nowait() for _ in range(6)]
+        self.assertEqual([(type(e), e.key) for e in events],
+                         [(messaging.KeyPress, 0), (messaging.KeyRelease, 0),
+                          (messaging.KeyPress, 1), (messaging.KeyRelease, 1),
+                          (messaging.KeyPress, 2), (messaging.KeyRelease, 2)])
+        self.assertEqual(sub.stats()['dropped'], 0)
+        self.assertEqual(sub.stats()['overflowed'], 4)
+
+    def test_unsubscribe(self):
+        sub = self.bus.subscribe('test', (messaging.KeyPress, ))
+        sub.close()
+        self.bus.publish(messaging.KeyPress(1))
+        self.assertTrue(sub.empty())
+        self.assertEqual(self.bus.stats(), {})
+
+    def test_lag_stats(self):
+        sub = self.bus.subscribe('test', (messaging.KeyPress, ))
+        self.bus.publish(messaging.KeyPress(1))
+        sub.get_nowait()
+        stats = self.bus.stats()['test']
+        self.assertEqual(stats['delivered'], 1)
+        self.assertGreaterEqual(stats['max_lag_sec'], 0)
+
+    def test_get_waits_for_event(self):
+        async def run():
+            sub = self.bus.subscribe('test', (messaging.KeyPress, ))
+            getter = asyncio.create_task(sub.get())
+            await asyncio.sleep(0)
+            self.assertFalse(getter.done())
+            self.bus.publish(messaging.KeyPress(1))
+            return await getter
+        self.assertEqual(asyncio.run(run()).key, 1)
 
 
 class TestPipeClientCalls(unittest.TestCase):
     def setUp(self):
         self.pipe = messaging.Pipe()
-        self.pipe.taskit = make_taskit_mock()
-
-    def test_set_activity_no_server(self):
-        self.pipe.set_activity(0)
-        self.pipe.taskit.assert_not_called()
+        self.sub = self.pipe.bus.subscribe('test', messaging.server_event_types[messaging.Lane.Activity] +
+                                           messaging.server_event_types[messaging.Lane.Key] +
+                                           messaging.server_event_types[messaging.Lane.Telemetry])
 
-    def test_set_activity_with_server(self):
-        self.pipe.server_t = True
+    def test_set_activity(self):
         self.pipe.set_activity(0)
-        self.pipe.taskit.assert_called_once()
-
-    def test_key_press_no_server(self):
-        self.pipe.key_press(0x01)
-        self.pipe.taskit.assert_not_called()
+        event = self.sub.get_nowait()
+        self.assertIsInstance(event, messaging.SetActivity)
+        self.assertIs(event.source, self.pipe)
 
-    def test_key_press_with_server(self):
-        self.pipe.server_t = True
+    def test_key_press(self):
         self.pipe.key_press(0x01, 1)
-        self.pipe.taskit.assert_called_once()
+        event = self.sub.get_nowait()
+        self.assertEqual((event.key, event.count), (0x01, 1))
 
-    def test_key_release_no_server(self):
+    def test_key_release(self):
         self.pipe.key_release(0x01)
-        self.pipe.taskit.assert_not_called()
+        self.assertIsInstance(self.sub.get_nowait(), messaging.KeyRelease)
 
-    def test_key_release_with_server(self):
-        self.pipe.server_t = True
-        self.pipe.key_release(0x01)
-        self.pipe.taskit.assert_called_once()
-
-    def test_battery_state_no_server(self):
+    def test_battery_state(self):
         self.pipe.battery_state(85, True)
-        self.pipe.taskit.assert_not_called()
+        event = self.sub.get_nowait()
+        self.assertEqual((event.level, event.is_charging), (85, True))
 
-    def test_battery_state_with_server(self):
-        self.pipe.server_t = True
+    def test_clear_battery_state(self):
         self.pipe.battery_state(85, True)
-        self.pipe.taskit.assert_called_once()
-
-
-class TestPipeServerCalls(unittest.TestCase):
-    def setUp(self):
-        self.pipe = messaging.Pipe()
-        self.pipe.taskit = make_taskit_mock()
-
-    def test_notify_set_activity_no_client(self):
-        self.pipe.notify_set_activity(0)
-        self.pipe.taskit.assert_not_called()
-
-    def test_notify_set_activity_with_client(self):
-        self.pipe.client_t = True
-        self.pipe.notify_set_activity(0)
-        self.pipe.taskit.assert_called_once()
-
-    def test_notify_battery_state_no_client(self):
-        self.pipe.notify_battery_state(85, True, False)
-        self.pipe.taskit.assert_not_called()
-
-    def test_notify_battery_state_with_client(self):
-        self.pipe.client_t = True
-        self.pipe.notify_battery_state(85, True, False)
-        self.pipe.taskit.assert_called_once()
-
-
-async def run_task_once(task_coro, queue, msg):
-    """Run an infinite-loop task coroutine for exactly one message dispatch."""
-    queue.put_nowait(msg)
-    task = asyncio.create_task(task_coro)
-    # Wait just long enough for the single message to be processed
-    await asyncio.sleep(0)
-    await asyncio.sleep(0)
+        self.pipe.clear_battery_state()
+        # The clear replaces the queued state
+        event = self.sub.get_nowait()
+        self.assertIsNone(event.level)
+        self.assertTrue(self.sub.empty())
+
+
+async def run_task_once(pipe, start, publish):
+    """Run a pipe's infinite-loop task for exactly one event dispatch."""
+    pipe.taskit = asyncio.ensure_future
+    task = start()
+    publish()
+    # Wait just long enough for the single event to be processed
+    for _ in range(5):
+        await asyncio.sleep(0)
     task.cancel()
     try:
         await task
@@ -112,50 +181,151 @@ async def run_task_once(task_coro, queue, msg):
 
 
 class TestPipeServerTask(unittest.TestCase):
-    def _run_server(self, msg, handler):
-        pipe = messaging.Pipe()
-        asyncio.run(run_task_once(pipe.server_task(handler), pipe.server_q, msg))
+    def _run_server(self, event, handler):
+        async def run():
+            pipe = messaging.Pipe()
+            await run_task_once(pipe, lambda: pipe.start_server_task(handler) or pipe.server_t,
+                                lambda: pipe.bus.publish(event, pipe))
+            self.assertEqual(pipe.bus.stats(), {})
+        asyncio.run(run())
 
     def test_dispatches_set_activity(self):
         handler = MagicMock()
         handler.client_set_activity = AsyncMock()
-        self._run_server(messaging.Message(messaging.Type.SetActivity, 2), handler)
+        self._run_server(messaging.SetActivity(2), handler)
         handler.client_set_activity.assert_called_once_with(2)
 
     def test_dispatches_key_press(self):
         handler = MagicMock()
         handler.client_press_key = AsyncMock()
-        self._run_server(messaging.Message(messaging.Type.KeyPress, 0x01, 0), handler)
+        self._run_server(messaging.KeyPress(0x01, 0), handler)
         handler.client_press_key.assert_called_once_with(0x01, 0)
 
     def test_dispatches_key_release(self):
         handler = MagicMock()
         handler.client_release_key = AsyncMock()
-        self._run_server(messaging.Message(messaging.Type.KeyRelease, 0x01), handler)
+        self._run_server(messaging.KeyRelease(0x01), handler)
         handler.client_release_key.assert_called_once_with(0x01)
 
     def test_dispatches_battery_state(self):
         handler = MagicMock()
         handler.client_battery_state = AsyncMock()
-        self._run_server(messaging.Message(messaging.Type.BatteryState, 85, True, False), handler)
-        handler.client_battery_state.assert_called_once_with(85, True, False)
+        self._run_server(messaging.BatteryState(85, True), handler)
+        handler.client_battery_state.assert_called_once_with(85, True)
+
+    def test_ignores_other_pipes(self):
+        handler = MagicMock()
+        handler.client_press_key = AsyncMock()
+        other = messaging.Pipe()
+        self._run_server(messaging.KeyPress(0x01, 0), handler)
+        async def run():
+            pipe = messaging.Pipe(other.bus)
+            await run_task_once(pipe, lambda: pipe.start_server_task(handler) or pipe.server_t,
+                                lambda: other.key_press(0x02))
+        asyncio.run(run())
+        handler.client_press_key.assert_called_once_with(0x01, 0)
+
+
+class TestPipeServerLanes(unittest.TestCase):
+    def _run(self, handler, test):
+        async def run():
+            pipe = messaging.Pipe()
+            pipe.taskit = asyncio.ensure_future
+            pipe.start_server_task(handler)
+            try:
+                await test(pipe)
+            finally:
+                pipe.server_t.cancel()
+                try:
+                    await pipe.server_t
+                except asyncio.CancelledError:
+                    pass
+        asyncio.run(run())
+
+    def test_key_release_not_blocked_by_activity_change(self):
+        started = asyncio.Event()
+        handler = MagicMock()
+        async def slow_set_activity(index):
+            started.set()
+            await asyncio.sleep(10)
+        handler.client_set_activity = AsyncMock(side_effect=slow_set_activity)
+        handler.client_release_key = AsyncMock()
+        async def test(pipe):
+            pipe.set_activity(1)
+            await started.wait()
+            pipe.key_release(0x01)
+            await asyncio.sleep(.01)
+            handler.client_release_key.assert_called_once_with(0x01)
+        self._run(handler, test)
+
+    def test_newer_activity_cancels_in_flight_one(self):
+        cancelled = []
+        completed = []
+        handler = MagicMock()
+        async def set_activity(index):
+            try:
+                await asyncio.sleep(.05 if index == 1 else 0)
+                completed.append(index)
+            except asyncio.CancelledError:
+                cancelled.append(index)
+                raise
+        handler.client_set_activity = AsyncMock(side_effect=set_activity)
+        async def test(pipe):
+            pipe.set_activity(1)
+            await asyncio.sleep(.01)
+            pipe.set_activity(2)
+            await asyncio.sleep(.1)
+            self.assertEqual(cancelled, [1])
+            self.assertEqual(completed, [2])
+        self._run(handler, test)
+
+    def test_key_events_stay_in_order(self):
+        events = []
+        handler = MagicMock()
+        async def press(key, count=0):
+            await asyncio.sleep(0)
+            events.append(('press', key))
+        async def release(key):
+            events.append(('release', key))
+        handler.client_press_key = AsyncMock(side_effect=press)
+        handler.client_release_key = AsyncMock(side_effect=release)
+        async def test(pipe):
+            for key in (1, 2):
+                pipe.key_press(key)
+                pipe.key_release(key)
+            await asyncio.sleep(.01)
+            self.assertEqual(events, [('press', 1), ('release', 1), ('press', 2), ('release', 2)])
+        self._run(handler, test)
+
+    def test_battery_state_merged(self):
+        handler = MagicMock()
+        handler.client_battery_state = AsyncMock()
+        async def test(pipe):
+            pipe.battery_state(90, False)
+            pipe.battery_state(85, True)
+            await asyncio.sleep(.01)
+            handler.client_battery_state.assert_called_once_with(85, True)
+        self._run(handler, test)
 
 
 class TestPipeClientTask(unittest.TestCase):
-    def _run_client(self, msg, handler):
-        pipe = messaging.Pipe()
-        asyncio.run(run_task_once(pipe.client_task(handler), pipe.client_q, msg))
+    def _run_client(self, event, handler):
+        async def run():
+            pipe = messaging.Pipe()
+            await run_task_once(pipe, lambda: pipe.start_client_task(handler) or pipe.client_t,
+                                lambda: pipe.bus.publish(event))
+        asyncio.run(run())
 
     def test_dispatches_set_activity(self):
         handler = MagicMock()
         handler.server_notify_set_activity = AsyncMock()
-        self._run_client(messaging.Message(messaging.Type.SetActivity, 3), handler)
+        self._run_client(messaging.ActivityNotice(3), handler)
         handler.server_notify_set_activity.assert_called_once_with(3)
 
     def test_dispatches_battery_state(self):
         handler = MagicMock()
         handler.server_notify_battery_state = AsyncMock()
-        self._run_client(messaging.Message(messaging.Type.BatteryState, 50, False, True), handler)
+        self._run_client(messaging.BatteryNotice(50, False, True), handler)
         handler.server_notify_battery_state.assert_called_once_with(50, False, True)
 
 
@@ -169,12 +339,15 @@ class TestPipeStartTasks(unittest.TestCase):
         self.pipe.start_server_task(handler)
         self.assertIsNotNone(self.pipe.server_t)
         self.pipe.taskit.assert_called_once()
+        self.assertEqual(set(self.pipe.server_subs), {messaging.Lane.Activity, messaging.Lane.Key,
+                                                      messaging.Lane.Telemetry})
 
     def test_start_client_task(self):
         handler = MagicMock()
         self.pipe.start_client_task(handler)
         self.assertIsNotNone(self.pipe.client_t)
         self.pipe.taskit.assert_called_once()
+        self.assertIsNotNone(self.pipe.client_sub)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,100 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import test_common
+
+import unittest
+import asyncio
+
+import motion
+from remote import MotionEvent, Vector
+
+
+def sample(x=0.0, y=0.0, z=0.0):
+    """ A gyro sample of rates in degrees per second """
+    k = motion.config['remote.motion.gyro_dps_per_unit']
+    return MotionEvent(Vector((round(x / k), round(y / k), round(z / k))))
+
+
+class FakeRemote:
+    def __init__(self):
+        self.enables = []
+    def has_motion(self):
+        return True
+    def enable_motion(self, enable):
+        self.enables.append(enable)
+
+
+class TestMotion(unittest.TestCase):
+    def recognize(self, rates, period_sec=0.01):
+        gestures = []
+        recognizer = motion.MotionRecognizer(lambda gesture, rotation: gestures.append(gesture))
+        for i, r in enumerate(rates):
+            recognizer.update(i * period_sec, sample(*r))
+        return recognizer, gestures
+
+    def test_drift(self):
+        # A still remote with a drifting gyro
+        recognizer, gestures = self.recognize([(5, -3, 2)] * 400)
+        self.assertEqual(gestures, [])
+        drift = recognizer.filter.drift
+        self.assertAlmostEqual(drift[0], 5, delta=0.1)
+        self.assertAlmostEqual(drift[1], -3, delta=0.1)
+        rates = recognizer.filter.update(sample(5, -3, 2))
+        self.assertTrue(all(abs(r) < 0.1 for r in rates))
+
+    def test_flick(self):
+        still = [(0, 0, 0)] * 10
+        flick = [(0, 0, -400)] * 5 + [(0, 0, 300)] * 3
+        _, gestures = self.recognize(still + flick + still)
+        self.assertEqual(gestures, ['flick -z'])
+
+    def test_tilt(self):
+        still = [(0, 0, 0)] * 10
+        # 60 degrees per second for half a second
+        tilt = [(60, 0, 0)] * 50
+        recognizer, gestures = self.recognize(still + tilt + still)
+        self.assertEqual(gestures, ['tilt +x'])
+        # A steady rotation isn't drift
+        self.assertEqual(recognizer.filter.drift, [0, 0, 0])
+
+        # Too little to be a tilt
+        _, gestures = self.recognize(still + tilt[:20] + still)
+        self.assertEqual(gestures, [None])
+
+    def test_streaming(self):
+        async def stream():
+            keys = []
+            pipeline = motion.MotionPipeline(lambda remote, gesture, key: keys.append(key))
+            remote = FakeRemote()
+            # No gestures are mapped, so no motion
+            pipeline.note_input(remote)
+            self.assertEqual(remote.enables, [])
+
+            pipeline.keymap = {'flick +y': 0x03}
+            pipeline.idle_sec = 0.2
+            pipeline.note_input(remote)
+            self.assertEqual(remote.enables, [True])
+            for _ in range(10):
+                pipeline.motion(remote, sample())
+            for _ in range(5):
+                pipeline.motion(remote, sample(0, 500, 0))
+            for _ in range(10):
+                pipeline.motion(remote, sample())
+            self.assertEqual(keys, [0x03])
+
+            # Input keeps it streaming
+            await asyncio.sleep(0.15)
+            pipeline.note_input(remote)
+            await asyncio.sleep(0.15)
+            self.assertEqual(remote.enables, [True])
+            await asyncio.sleep(0.1)
+            self.assertEqual(remote.enables, [True, False])
+        asyncio.run(stream())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import test_common
+
+import unittest
+import asyncio
+
+from release_timeout import ReleaseByTimeout
+
+
+class Remote(ReleaseByTimeout):
+    def __init__(self):
+        super().__init__(0.15, 0.05, 2.5)
+        self.keys = []
+
+    def key_pressed(self, key):
+        self.keys.append(('press', key, asyncio.get_running_loop().time()))
+
+    def key_released(self, key):
+        self.keys.append(('release', key, asyncio.get_running_loop().time()))
+
+    async def hold(self, key, count, interval_sec=0.03):
+        for _ in range(count):
+            self.key_event(key)
+            await asyncio.sleep(interval_sec)
+
+
+class TestReleaseByTimeout(unittest.IsolatedAsyncioTestCase):
+    async def test_release(self):
+        remote = Remote()
+        await remote.hold(0x41, 10)
+        last_event = remote.last_event
+        await asyncio.sleep(0.2)
+        self.assertEqual([k[:2] for k in remote.keys], [('press', 0x41), ('release', 0x41)])
+        # Released a learnt 2.5 intervals after the last event, rather than timeout_sec
+        self.assertAlmostEqual(remote.interval_sec, 0.03, delta=0.01)
+        self.assertAlmostEqual(remote.keys[1][2] - last_event, 0.075, delta=0.03)
+        self.assertIsNone(remote.release_timer)
+
+    async def test_change_key(self):
+        remote = Remote()
+        await remote.hold(0x41, 3)
+        await remote.hold(0x42, 3)
+        await asyncio.sleep(0.2)
+        self.assertEqual([k[:2] for k in remote.keys],
+                         [('press', 0x41), ('release', 0x41), ('press', 0x42), ('release', 0x42)])
+
+    async def test_early_release(self):
+        remote = Remote()
+        await remote.hold(0x41, 10, 0.01)
+        # The remote pauses for longer than the learnt timeout, but less than timeout_sec
+        await asyncio.sleep(0.08)
+        await remote.hold(0x41, 3, 0.01)
+        await asyncio.sleep(0.2)
+        # The rest of the hold isn't pressed again
+        self.assertEqual([k[0] for k in remote.keys], ['press', 'release'])
+        # The timeout grew to cover the pause
+        self.assertGreaterEqual(remote.release_timeout_sec(), 0.09)
+
+        # The next hold is pressed
+        await remote.hold(0x41, 3, 0.01)
+        await asyncio.sleep(0.2)
+        self.assertEqual([k[0] for k in remote.keys], ['press', 'release'] * 2)
+
+    async def test_initial_repeat_delay(self):
+        remote = Remote()
+        for _ in range(3):
+            # The first repeat comes later than the others
+            remote.key_event(0x41)
+            await asyncio.sleep(0.1)
+            await remote.hold(0x41, 10)
+            last_event = remote.last_event
+            await asyncio.sleep(0.3)
+            self.assertAlmostEqual(remote.keys[-1][2] - last_event, 0.075, delta=0.03)
+        self.assertEqual([k[:2] for k in remote.keys], [('press', 0x41), ('release', 0x41)] * 3)
+        self.assertAlmostEqual(remote.first_interval_sec, 0.1, delta=0.02)
+        self.assertAlmostEqual(remote.interval_sec, 0.03, delta=0.01)
+
+if __name__ == '__main__':
+    unittest.main()
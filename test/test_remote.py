@@ -0,0 +1,387 @@
+# Copyright 2026.
+# This file is part of Amity.
+# Amity is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+import test_common
+
+import unittest
+from unittest.mock import MagicMock
+import asyncio, os, struct, tempfile
+
+import att
+import hci
+import recording
+import remote
+from fake_gatt import FakeRemote
+
+
+def touch_report(timestamp, x, y, p, flags=0x08):
+    xy = (x & 0xfff) | ((y & 0xf) << 12)
+    return struct.pack('<BHBHBBBBB', 0x32, timestamp, 0, xy, (y >> 4) & 0xff, 0, 0, p, flags)
+
+
+async def settle(condition, timeout_sec=2):
+    async with asyncio.timeout(timeout_sec):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+class TestAtt(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.fake = FakeRemote(mtu=23)
+        self.notifications = []
+        self.client = att.Client(await self.fake.connect('mac'),
+                                 lambda handle, value: self.notifications.append((handle, value)))
+
+    async def asyncTearDown(self):
+        self.client.close()
+        self.fake.drop()
+
+    def test_uuids(self):
+        self.assertEqual(att.uuid_from_bytes(att.uuid_to_bytes(0x2a19)), 0x2a19)
+        self.assertEqual(len(att.uuid_to_bytes(0x12345678)), 16)
+        self.assertEqual(att.uuid_from_bytes(att.uuid_to_bytes(0x12345678)), 0x12345678)
+        uuid = 0x89abcdef_0123_4567_89ab_cdef01234567
+        self.assertEqual(att.uuid_from_bytes(att.uuid_to_bytes(uuid)), uuid)
+
+    async def test_discover(self):
+        services = {service.uuid: service for service in await self.client.discover()}
+        self.assertEqual(set(services), {att.AssignedNumbers.generic_access,
+                                         att.AssignedNumbers.device_information,
+                                         att.AssignedNumbers.battery_service})
+        battery = services[att.AssignedNumbers.battery_service].characteristic(
+            att.AssignedNumbers.battery_level)
+        assert battery is not None
+        self.assertEqual(battery.value_handle, self.fake.handles[att.AssignedNumbers.battery_level])
+        self.assertIn(att.AssignedNumbers.client_characteristic_configuration, battery.descriptors)
+
+    async def test_long_read(self):
+        self.fake.attributes.append((0x100, 0xffff, bytes(range(50))))
+        self.assertEqual(await self.client.exchange_mtu(527), 23)
+        self.assertEqual(await self.client.read(0x100), bytes(range(50)))
+
+    async def test_error(self):
+        with self.assertRaises(att.AttError) as cm:
+            await self.client.read(0x200)
+        self.assertEqual(cm.exception.code, att.ErrorCode.INVALID_HANDLE)
+
+    async def test_notification(self):
+        self.fake.notify(0x3a, b'\x08\x00')
+        await settle(lambda: self.notifications)
+        self.assertEqual(self.notifications, [(0x3a, b'\x08\x00')])
+
+    async def test_closed(self):
+        self.fake.drop()
+        with self.assertRaises(ConnectionError):
+            await self.client.wait_closed()
+        with self.assertRaises(ConnectionError):
+            await self.client.read(1)
+
+
+class FakeSystem:
+    def __init__(self):
+        self.disconnects = 0
+        self.delays = []
+
+    async def disconnect(self, mac):
+        self.disconnects += 1
+
+    async def wait_for_device(self, mac, timeout_sec):
+        self.delays.append(timeout_sec)
+        await asyncio.sleep(0)
+
+
+class FakeLink:
+    def __init__(self):
+        self.updates = []
+
+    def update_connection(self, mac, params):
+        self.updates.append(params.latency == 0)
+
+
+class TestSiriRemote(unittest.IsolatedAsyncioTestCase):
+    mac = '00:11:22:33:44:55'
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmp.name, 'remote', 'gatt_cache.yaml')
+        self.task = None
+        self.system = FakeSystem()
+        self.link = FakeLink()
+
+    async def run_remote(self, fake, connect=None):
+        self.listener = MagicMock(spec=remote.RemoteListener)
+        self.remote = remote.SiriRemote(self.mac, self.listener, connect or fake.connect,
+                                        remote.GattCache(self.cache_path), self.system, self.link)
+        self.task = asyncio.create_task(self.remote.run())
+        await settle(lambda: self.listener.event_power.called or self.task.done())
+
+    async def stop_remote(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except (asyncio.CancelledError, remote.UnknownRemoteException):
+            pass
+
+    async def asyncTearDown(self):
+        if self.task is not None:
+            await self.stop_remote()
+        self.tmp.cleanup()
+
+    async def test_setup(self):
+        fake = FakeRemote()
+        await self.run_remote(fake)
+        self.listener.event_battery.assert_called_once_with(self.remote, 80)
+        self.listener.event_power.assert_called_once_with(self.remote, False)
+        battery_config = fake.handles[att.AssignedNumbers.battery_level] + 1
+        self.assertIn((battery_config, b'\x01\x00'), fake.writes)
+        self.assertIn((0x003a, b'\x01\x00'), fake.writes)
+        self.assertEqual(fake.writes[-2:], [(0x004e, b'\xF0\xBC'), (0x004e, b'\xF0\xBB')])
+
+    async def test_button_and_touch(self):
+        fake = FakeRemote()
+        await self.run_remote(fake)
+        buttons = self.remote.profile.buttons
+        fake.notify(0x003a, buttons.SELECT.to_bytes(2, byteorder='little'))
+        fake.notify(0x003a, buttons.SELECT.to_bytes(2, byteorder='little'))
+        fake.notify(0x003e, bytes([0x32, 0x10, 0x00, 0x01, 0x00, 0x00, 0x00, 0, 0, 0x40, 0x08]))
+        await settle(lambda: self.listener.event_touches.called)
+        self.listener.event_button.assert_called_once_with(self.remote, buttons.SELECT)
+        touches = self.listener.event_touches.call_args.args[1]
+        self.assertEqual((touches[0].id, touches[0].timestamp, touches[0].x, touches[0].y, touches[0].p),
+                         (0, 0x10, 360, 360, 0x40))
+
+    async def test_touch_decoding(self):
+        fake = FakeRemote()
+        await self.run_remote(fake)
+        fake.notify(0x003e, touch_report(0xfffe, -5, -300, 0x40, flags=0))
+        await settle(lambda: self.listener.event_touches.called)
+        touch = self.listener.event_touches.call_args.args[1][0]
+        self.assertEqual((touch.id, touch.timestamp, touch.x, touch.y, touch.p), (1, 0xfffe, 355, 60, 0x40))
+
+    async def test_touch_coalescing(self):
+        fake = FakeRemote()
+        await self.run_remote(fake)
+        for timestamp, x, p in ((1, 0, 0x40), (2, 10, 0x40), (3, 20, 0x40), (4, 30, 0x40),
+                                (5, 30, 0), (6, 30, 0), (7, 30, 5)):
+            fake.notify(0x003e, touch_report(timestamp, x, 0, p))
+        await settle(lambda: self.listener.event_touches.call_count >= 3)
+        await asyncio.sleep(0.05)
+        # The begin and end of the touch are kept, the moves in between coalesce, and the samples
+        # of the lifted finger are dropped
+        timestamps = [call.args[1][0].timestamp for call in self.listener.event_touches.call_args_list]
+        self.assertEqual(timestamps, [1, 4, 5])
+
+    async def test_button_flushes_touches(self):
+        fake = FakeRemote()
+        await self.run_remote(fake)
+        buttons = self.remote.profile.buttons
+        fake.notify(0x003e, touch_report(1, 0, 0, 0x40))
+        fake.notify(0x003a, buttons.SELECT.to_bytes(2, byteorder='little'))
+        await settle(lambda: self.listener.event_button.called)
+        names = [name for name, _, _ in self.listener.mock_calls if name in ('event_touches', 'event_button')]
+        self.assertEqual(names, ['event_touches', 'event_button'])
+
+    async def test_reconnect(self):
+        fake = FakeRemote()
+        await self.run_remote(fake)
+        fake.drop()
+        await settle(lambda: fake.connections == 2 and self.listener.event_power.call_count == 2)
+        # Keys are released when the connection is lost
+        self.listener.event_button.assert_called_once_with(self.remote, 0)
+
+    async def test_backoff(self):
+        fake = FakeRemote()
+        failures = 10
+        async def connect(mac):
+            nonlocal failures
+            if failures > 0:
+                failures -= 1
+                raise TimeoutError('Remote is away')
+            return await fake.connect(mac)
+        await self.run_remote(fake, connect)
+        self.assertEqual(self.system.delays, [0.5, 1, 2, 4, 8, 16, 32, 60, 60, 60])
+        self.assertEqual(self.system.disconnects, 11)
+        # No keys were down, so none are released
+        self.listener.event_button.assert_not_called()
+        # Once connected, the backoff starts over
+        fake.drop()
+        await settle(lambda: self.listener.event_power.call_count == 2)
+        self.assertEqual(self.system.delays[-1], 0.5)
+
+    async def test_cached_reconnect(self):
+        await self.run_remote(FakeRemote())
+        await self.stop_remote()
+        self.assertIn(self.mac, remote.GattCache(self.cache_path).entries)
+
+        fake = FakeRemote()
+        await self.run_remote(fake)
+        ops = {pdu[0] for pdu in fake.requests}
+        self.assertNotIn(att.Op.READ_BY_GROUP_TYPE_REQ, ops)
+        # Notifications are enabled with write requests, and only the vendor writes are commands
+        writes = [pdu for pdu in fake.requests if pdu[0] in (att.Op.WRITE_REQ, att.Op.WRITE_CMD)]
+        self.assertEqual([pdu[0] for pdu in writes], [att.Op.WRITE_REQ] * 9 + [att.Op.WRITE_CMD] * 2)
+        self.assertTrue(all(pdu[3:] == b'\x01\x00' for pdu in writes[:9]))
+        self.listener.event_battery.assert_called_once_with(self.remote, 80)
+        self.assertEqual(fake.writes[-2:], [(0x004e, b'\xF0\xBC'), (0x004e, b'\xF0\xBB')])
+
+    async def test_cached_reconnect_rejected_config_rediscovers(self):
+        await self.run_remote(FakeRemote())
+        await self.stop_remote()
+
+        fake = FakeRemote()
+        fake.rejects.add(0x003a)
+        await self.run_remote(fake)
+        self.assertIn(att.Op.READ_BY_GROUP_TYPE_REQ, {pdu[0] for pdu in fake.requests})
+        self.assertIn((0x003a, b'\x01\x00'), fake.writes)
+        self.listener.event_battery.assert_called_once_with(self.remote, 80)
+
+    async def test_cache_mismatch_rediscovers(self):
+        await self.run_remote(FakeRemote())
+        await self.stop_remote()
+
+        fake = FakeRemote(fw='0021', power=0xaf)
+        await self.run_remote(fake)
+        self.assertIn(att.Op.READ_BY_GROUP_TYPE_REQ, {pdu[0] for pdu in fake.requests})
+        self.assertEqual(fake.writes[-1], (0x004d, b'\xF0\x00'))
+        entry = remote.GattCache(self.cache_path).get(self.mac)
+        assert entry is not None
+        self.assertEqual(entry['fwr'], '0021')
+
+    async def test_stale_cache_rediscovers(self):
+        cache = remote.GattCache(self.cache_path)
+        cache.put(self.mac, {'pnp_handle': 0x200, 'fwr_handle': 0x201})
+        fake = FakeRemote()
+        await self.run_remote(fake)
+        self.listener.event_power.assert_called_once_with(self.remote, False)
+        self.assertEqual(fake.connections, 1)
+        self.assertEqual(remote.GattCache(self.cache_path).get(self.mac)['pnp_handle'],
+                         fake.handles[att.AssignedNumbers.pnp_id])
+
+    async def test_unknown_remote(self):
+        await self.run_remote(FakeRemote(fw='bogus'))
+        with self.assertRaises(remote.UnknownRemoteException):
+            await self.task
+
+
+
+    async def test_link_follows_activity(self):
+        test_common.mock_config['remote.connection.idle_sec'] = 0.1
+        try:
+            fake = FakeRemote()
+            await self.run_remote(fake)
+            # Standby is slow
+            self.assertEqual(self.link.updates, [False])
+            self.remote.set_activity_running(True)
+            self.assertEqual(self.link.updates, [False, True])
+            # Input keeps the link fast, and it slows down once the remote is idle
+            fake.notify(0x003a, b'\x08\x00')
+            await settle(lambda: len(self.link.updates) == 3)
+            self.assertEqual(self.link.updates, [False, True, False])
+        finally:
+            test_common.mock_config['remote.connection.idle_sec'] = 30
+
+    async def test_link_fast_while_touching(self):
+        fake = FakeRemote()
+        await self.run_remote(fake)
+        fake.notify(0x003e, touch_report(1, 0, 0, 0x40))
+        await settle(lambda: len(self.link.updates) == 2)
+        self.assertEqual(self.link.updates, [False, True])
+        # Once the finger lifts, the link slows down at the next check
+        fake.notify(0x003e, touch_report(2, 0, 0, 0))
+        await settle(lambda: self.listener.event_touches.call_count == 2)
+        self.remote.set_activity_running(False)
+        self.assertEqual(self.link.updates, [False, True, False])
+
+    def test_connection_parameters_command(self):
+        params = hci.ConnectionParameters(15, 0, 2000)
+        self.assertEqual(params.command(0x40).hex(),
+                         '01' '1320' '0e' '4000' '0c00' '0c00' '0000' 'c800' '0000' '0000')
+
+
+    async def test_record_and_replay(self):
+        record_dir = os.path.join(self.tmp.name, 'recordings')
+        test_common.mock_config['remote.record.dir'] = record_dir
+        try:
+            fake = FakeRemote()
+            await self.run_remote(fake)
+            buttons = self.remote.profile.buttons
+            fake.notify(0x003e, touch_report(1, 0, 0, 0x40))
+            fake.notify(0x003a, buttons.SELECT.to_bytes(2, byteorder='little'))
+            fake.notify(0x003a, b'\x00\x00')
+            await settle(lambda: self.listener.event_button.call_count == 2)
+            await self.stop_remote()
+            self.task = None
+        finally:
+            test_common.mock_config['remote.record.dir'] = None
+        path, = (os.path.join(record_dir, name) for name in os.listdir(record_dir))
+
+        def events(listener):
+            decoded = []
+            for name, args, _ in listener.mock_calls:
+                if name == 'event_touches':
+                    decoded.append([(t.id, t.timestamp, t.x, t.y, t.p) for t in args[1]])
+                elif name == 'event_button':
+                    decoded.append(args[1])
+            return decoded
+
+        listener = MagicMock(spec=remote.RemoteListener)
+        replayer = remote.SiriRemote(self.mac, listener, gatt_cache=remote.GattCache(self.cache_path))
+        self.assertEqual(await recording.replay(replayer, path, speed=0), 3)
+        self.assertEqual(events(listener), events(self.listener))
+        self.assertEqual(events(listener), [[(0, 1, 360, 360, 0x40)], buttons.SELECT, 0])
+
+
+class TestRemoteManager(unittest.IsolatedAsyncioTestCase):
+    async def test_remotes_run_concurrently(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fakes = {'00:00:00:00:00:01': FakeRemote(), '00:00:00:00:00:02': FakeRemote(fw='0021', power=0xaf)}
+            async def connect(mac):
+                return await fakes[mac].connect(mac)
+            manager = remote.RemoteManager(FakeSystem(), connect,
+                                           remote.GattCache(os.path.join(tmp, 'gatt_cache.yaml')))
+            listeners = {mac: MagicMock(spec=remote.RemoteListener) for mac in fakes}
+            remotes = {mac: manager.add(mac, listener) for mac, listener in listeners.items()}
+            task = asyncio.create_task(manager.run())
+            await settle(lambda: all(listener.event_power.called for listener in listeners.values()))
+
+            # Each remote has its own profile, and its own listener
+            fakes['00:00:00:00:00:02'].notify(0x0039, b'\x08\x00')
+            await settle(lambda: listeners['00:00:00:00:00:02'].event_button.called)
+            listeners['00:00:00:00:00:01'].event_button.assert_not_called()
+            self.assertEqual(set(remote.GattCache(manager.gatt_cache.path).entries), set(fakes))
+            self.assertIsNot(remotes['00:00:00:00:00:01'].profile, remotes['00:00:00:00:00:02'].profile)
+
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+    async def test_failing_remote_does_not_stop_others(self):
+        test_common.mock_config['remote.reconnect.max_delay_sec'] = 0.01
+        self.addCleanup(test_common.mock_config.__setitem__, 'remote.reconnect.max_delay_sec', 60)
+        with tempfile.TemporaryDirectory() as tmp:
+            fakes = {'00:00:00:00:00:01': FakeRemote(), '00:00:00:00:00:02': FakeRemote(fw='bogus')}
+            async def connect(mac):
+                return await fakes[mac].connect(mac)
+            manager = remote.RemoteManager(FakeSystem(), connect,
+                                           remote.GattCache(os.path.join(tmp, 'gatt_cache.yaml')))
+            listeners = {mac: MagicMock(spec=remote.RemoteListener) for mac in fakes}
+            for mac, listener in listeners.items():
+                manager.add(mac, listener)
+            task = asyncio.create_task(manager.run())
+            await settle(lambda: listeners['00:00:00:00:00:01'].event_power.called)
+            # The unknown remote is tried again, and the healthy one keeps running
+            await settle(lambda: fakes['00:00:00:00:00:02'].connections >= 2)
+            self.assertFalse(task.done())
+            fakes['00:00:00:00:00:01'].notify(0x003a, b'\x08\x00')
+            await settle(lambda: listeners['00:00:00:00:00:01'].event_button.called)
+
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+
+if __name__ == '__main__':
+    unittest.main()